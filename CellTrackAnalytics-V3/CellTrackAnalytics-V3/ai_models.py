@@ -1,40 +1,194 @@
 import numpy as np
-from sklearn.cluster import DBSCAN
-from sklearn.preprocessing import StandardScaler
+import pandas as pd
 import logging
+import math
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
+EARTH_RADIUS_M = 6371008.8
+
+# Apparent speeds (km/h) between consecutive pings flagged as suspicious / impossible travel
+TRAVEL_SUSPICIOUS_KMH = float(os.environ.get('TRAVEL_SUSPICIOUS_KMH', 250))
+TRAVEL_IMPOSSIBLE_KMH = float(os.environ.get('TRAVEL_IMPOSSIBLE_KMH', 1000))
+
+class StayPointDetector:
+    """Single-pass stay-point detection over time-ordered pings
+
+    Consecutive pings within distance_m of the first ping of a run form a candidate;
+    the run becomes a stay (dwell segment) once it spans at least min_duration seconds.
+    The open run is kept in the state so later pings can extend it.
+    """
+
+    def __init__(self, distance_m=200.0, min_duration=20 * 60):
+        self.distance_m = distance_m
+        self.min_duration = min_duration
+
+    @staticmethod
+    def initial_state():
+        return {'count': 0, 'stays': [], 'candidate': None, 'last': None}
+
+    def update(self, state, coordinates, timestamps):
+        """Fold more time-ordered pings into a copy of the state in O(len(pings))"""
+        stays = list(state['stays'])
+        candidate = dict(state['candidate']) if state['candidate'] else None
+        index = state['count']
+        last = state['last']
+        for (lat, lon), ts in zip(np.asarray(coordinates, dtype=float).tolist(), np.asarray(timestamps).tolist()):
+            last = (lat, lon)
+            if candidate is not None and self._distance_m(candidate['anchor'], (lat, lon)) <= self.distance_m:
+                candidate['end'] = ts
+                candidate['count'] += 1
+                candidate['lat_sum'] += lat
+                candidate['lon_sum'] += lon
+            else:
+                if candidate is not None and self._is_stay(candidate):
+                    stays.append(self._segment(candidate))
+                candidate = {'anchor': (lat, lon), 'first_index': index, 'start': ts, 'end': ts,
+                             'count': 1, 'lat_sum': lat, 'lon_sum': lon}
+            index += 1
+        return {'count': index, 'stays': stays, 'candidate': candidate, 'last': last}
+
+    def segments(self, state):
+        """Closed stays plus the open run if it already qualifies"""
+        candidate = state['candidate']
+        if candidate is not None and self._is_stay(candidate):
+            return state['stays'] + [self._segment(candidate)]
+        return list(state['stays'])
+
+    def summarize(self, state):
+        """Per-ping stay labels (-1 for pings in transit) in the shape the DBSCAN analysis returned"""
+        segments = self.segments(state)
+        labels = np.full(state['count'], -1)
+        for label, segment in enumerate(segments):
+            labels[segment['first_index']:segment['first_index'] + segment['count']] = label
+        return {
+            'clusters': labels.tolist(),
+            'num_clusters': len(segments),
+            'is_suspicious': MovementPatternAnalyzer._detect_suspicious_pattern(labels),
+            'stay_points': [{key: segment[key] for key in ('lat', 'lng', 'start', 'end', 'count')}
+                            for segment in segments]
+        }
+
+    def detect(self, coordinates, timestamps):
+        return self.summarize(self.update(self.initial_state(), coordinates, timestamps))
+
+    def _is_stay(self, candidate):
+        return candidate['end'] - candidate['start'] >= self.min_duration
+
+    @staticmethod
+    def _segment(candidate):
+        return {
+            'lat': candidate['lat_sum'] / candidate['count'],
+            'lng': candidate['lon_sum'] / candidate['count'],
+            'start': candidate['start'],
+            'end': candidate['end'],
+            'count': candidate['count'],
+            'first_index': candidate['first_index']
+        }
+
+    @staticmethod
+    def _distance_m(a, b):
+        lat1, lon1 = math.radians(a[0]), math.radians(a[1])
+        lat2, lon2 = math.radians(b[0]), math.radians(b[1])
+        h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(h, 1.0)))
+
+def _cluster_movement(coordinates, timestamps):
+    """Detect one subscriber's stay points; a fresh detector keeps calls free of shared state"""
+    if len(coordinates) < 2:
+        return {
+            'clusters': [],
+            'num_clusters': 0,
+            'is_suspicious': False,
+            'stay_points': []
+        }
+    return StayPointDetector().detect(coordinates, timestamps)
+
+def _cluster_movement_chunk(chunk):
+    """Process pool entry point: cluster a chunk of (coordinates, timestamps) pairs"""
+    results = []
+    for coordinates, timestamps in chunk:
+        try:
+            results.append(_cluster_movement(coordinates, timestamps))
+        except Exception as e:
+            logging.error(f"Error in movement pattern analysis: {str(e)}")
+            results.append(None)
+    return results
+
 class MovementPatternAnalyzer:
-    def __init__(self):
-        self.scaler = StandardScaler()
+    # Bump when the analysis output changes so cached results are recomputed
+    VERSION = 'staypoint-2'
+
+    def __init__(self, cache_size=4096):
+        self.detector = StayPointDetector()
+        self.cache_size = cache_size
+        self._states = OrderedDict()  # mobile_number -> (detector state, last (timestamp, id) folded in)
+        self._lock = threading.Lock()
+
+    def analyze_subscriber(self, mobile_number, fetch, expected_count=None):
+        """Stay points for one subscriber, folding in only records newer than the cached state
+
+        fetch(after) returns (coordinates, timestamps, last_key) for the subscriber's records
+        ordered by (timestamp, id) after the given key, or all of them when after is None.
+        When expected_count disagrees with the folded total, records arrived out of order
+        and the state is rebuilt from scratch. Returns (analysis, last [lat, lng]).
+        """
+        with self._lock:
+            cached = self._states.get(mobile_number)
+        state, after = cached if cached else (self.detector.initial_state(), None)
+
+        coordinates, timestamps, last_key = fetch(after)
+        if after is not None and expected_count is not None and state['count'] + len(timestamps) != expected_count:
+            state, after = self.detector.initial_state(), None
+            coordinates, timestamps, last_key = fetch(None)
+
+        if len(timestamps):
+            state = self.detector.update(state, coordinates, timestamps)
+            after = last_key
+        if state['count'] == 0:
+            return None, None
+
+        with self._lock:
+            self._states[mobile_number] = (state, after)
+            self._states.move_to_end(mobile_number)
+            while len(self._states) > self.cache_size:
+                self._states.popitem(last=False)
+        return self.detector.summarize(state), list(state['last'])
+
+    def clear(self):
+        """Forget every subscriber's detector state, e.g. after records were removed"""
+        with self._lock:
+            self._states.clear()
 
     def analyze_movement_patterns(self, coordinates, timestamps):
-        """Analyze movement patterns using DBSCAN clustering"""
+        """Analyze movement patterns as stay points (dwell segments)"""
         try:
-            if len(coordinates) < 2:
-                return {
-                    'clusters': [],
-                    'num_clusters': 0,
-                    'is_suspicious': False
-                }
-
-            # Combine coordinates and timestamps
-            X = np.column_stack([coordinates, np.array(timestamps)[:, np.newaxis]])
-            X_scaled = self.scaler.fit_transform(X)
-
-            # Apply DBSCAN clustering
-            clustering = DBSCAN(eps=0.3, min_samples=2).fit(X_scaled)
-
-            return {
-                'clusters': clustering.labels_.tolist(),
-                'num_clusters': len(set(clustering.labels_)) - (1 if -1 in clustering.labels_ else 0),
-                'is_suspicious': self._detect_suspicious_pattern(clustering.labels_)
-            }
+            return _cluster_movement(coordinates, timestamps)
         except Exception as e:
             logging.error(f"Error in movement pattern analysis: {str(e)}")
             return None
 
-    def _detect_suspicious_pattern(self, cluster_labels):
+    def analyze_movement_patterns_batch(self, subscribers, n_jobs=None, chunk_size=200):
+        """Analyze many subscribers' (coordinates, timestamps) pairs across a process pool"""
+        n_jobs = n_jobs or os.cpu_count() or 1
+        chunks = [subscribers[i:i + chunk_size] for i in range(0, len(subscribers), chunk_size)]
+
+        # Pool start-up costs more than it saves for a handful of chunks
+        if n_jobs == 1 or len(chunks) < 2:
+            return [result for chunk in chunks for result in _cluster_movement_chunk(chunk)]
+
+        # Spawned workers avoid inheriting the web server's threads and DB connections
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks)), mp_context=context) as pool:
+            return [result for chunk_results in pool.map(_cluster_movement_chunk, chunks)
+                    for result in chunk_results]
+
+    @staticmethod
+    def _detect_suspicious_pattern(cluster_labels):
         """Detect if movement pattern is suspicious based on cluster distribution"""
         if len(cluster_labels) < 3:
             return False
@@ -45,70 +199,148 @@ class MovementPatternAnalyzer:
 
         return len(unique_clusters) >= 3
 
-class AnomalyDetector:
-    def __init__(self):
-        self.scaler = StandardScaler()
+class SpeedAnomalyDetector:
+    """Impossible-travel check over consecutive pings of every subscriber at once
 
-    def detect_anomalies(self, features):
-        """Detect anomalies using statistical methods"""
-        try:
-            if len(features) == 0:
-                return np.array([False])
+    Pings are ordered by (subscriber, time) so each subscriber is one contiguous run; haversine
+    distances and time gaps come from diffs over the whole arrays, and pairs straddling two
+    subscribers are masked out rather than looping per subscriber. Tower positions only place a
+    phone within a cell, so jumps shorter than min_distance_m are never flagged, and gaps are
+    floored at min_interval seconds so simultaneous pings on distant towers get a finite speed.
+    """
 
-            # Scale features
-            features_scaled = self.scaler.fit_transform(features)
+    def __init__(self, suspicious_kmh=TRAVEL_SUSPICIOUS_KMH, impossible_kmh=TRAVEL_IMPOSSIBLE_KMH,
+                 min_distance_m=10000.0, min_interval=60):
+        self.suspicious_kmh = suspicious_kmh
+        self.impossible_kmh = impossible_kmh
+        self.min_distance_m = min_distance_m
+        self.min_interval = min_interval
 
-            # Calculate Mahalanobis distance
-            distances = np.sum(features_scaled ** 2, axis=1)
+    def detect(self, groups, latitudes, longitudes, epoch_seconds, counted=None):
+        """Flagged jumps as a frame of origin/position (indexes into the inputs), seconds, distance_m,
+        speed_kmh and severity
 
-            # Use threshold at 97.5th percentile
-            threshold = np.percentile(distances, 97.5)
+        Rows with counted=False (e.g. each subscriber's last ping from an earlier load) only serve
+        as the origin of the first jump.
+        """
+        groups = np.asarray(groups, dtype=np.int64)
+        epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+        counted = np.ones(len(groups), dtype=bool) if counted is None else np.asarray(counted, dtype=bool)
+        columns = ['origin', 'position', 'seconds', 'distance_m', 'speed_kmh', 'severity']
+        if len(groups) < 2:
+            return pd.DataFrame(columns=columns)
 
-            return distances > threshold
-        except Exception as e:
-            logging.error(f"Error in anomaly detection: {str(e)}")
-            return np.array([False])
+        # On timestamp ties the uncounted ping from the earlier load sorts first, as the origin
+        order = np.lexsort((counted, epoch_seconds, groups))
+        lat = np.radians(np.asarray(latitudes, dtype=float)[order])
+        lon = np.radians(np.asarray(longitudes, dtype=float)[order])
+        seconds = np.diff(epoch_seconds[order])
 
-class PredictiveAnalysis:
-    def __init__(self):
-        self.scaler = StandardScaler()
+        h = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+        distance_m = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+        speed_kmh = distance_m / np.maximum(seconds, self.min_interval) * 3.6
 
-    def predict_next_location(self, movement_history):
-        """Predict next likely location based on movement history"""
-        try:
-            if len(movement_history) < 2:
-                return None
+        same_group = groups[order][1:] == groups[order][:-1]
+        flagged = np.flatnonzero(same_group & counted[order][1:] & (distance_m >= self.min_distance_m)
+                                 & (speed_kmh >= self.suspicious_kmh))
+        return pd.DataFrame({
+            'origin': order[flagged],
+            'position': order[flagged + 1],
+            'seconds': seconds[flagged],
+            'distance_m': distance_m[flagged],
+            'speed_kmh': speed_kmh[flagged],
+            'severity': np.where(speed_kmh[flagged] >= self.impossible_kmh, 'impossible', 'suspicious')
+        }, columns=columns)
 
-            # Get the last known locations
-            last_locations = movement_history[-2:]
+# Column order of the per-subscriber feature matrix scored by AnomalyDetector
+ANOMALY_FEATURES = ['tower_count', 'total_records', 'avg_call_duration', 'max_call_duration', 'contact_count']
 
-            # Simple linear extrapolation
-            direction = last_locations[-1] - last_locations[-2]
-            next_location = last_locations[-1] + direction
+class AnomalyDetector:
+    # Fewer rows than this cannot give a meaningful covariance estimate
+    MIN_FIT_SAMPLES = 10
+
+    def __init__(self, model_path=None, percentile=97.5):
+        self.model_path = model_path
+        self.percentile = percentile
+        self.model = None
+        self._model_mtime = None
+        self._lock = threading.Lock()
 
-            # Calculate confidence based on consistency of movement
-            confidence = self._calculate_confidence(movement_history)
+    def fit(self, features):
+        """Fit mean, inverse covariance and distance threshold on a whole population"""
+        X = np.nan_to_num(np.asarray(features, dtype=float))
+        mean = X.mean(axis=0)
+        # pinv keeps constant or collinear features from making the covariance singular
+        inv_cov = np.linalg.pinv(np.atleast_2d(np.cov(X, rowvar=False)))
+        distances = self._mahalanobis(X, mean, inv_cov)
 
-            return {
-                'latitude': float(next_location[0]),
-                'longitude': float(next_location[1]),
-                'confidence': confidence
+        with self._lock:
+            self.model = {
+                'mean': mean,
+                'inv_cov': inv_cov,
+                'threshold': float(np.percentile(distances, self.percentile)),
+                'n_samples': len(X)
             }
-        except Exception as e:
-            logging.error(f"Error in location prediction: {str(e)}")
-            return None
+        return self
+
+    def score(self, features):
+        """Squared Mahalanobis distance of every row to the fitted population"""
+        model = self._current_model()
+        if model is None:
+            raise ValueError("Anomaly model has not been fitted")
+        return self._mahalanobis(np.nan_to_num(np.asarray(features, dtype=float)), model['mean'], model['inv_cov'])
 
-    def _calculate_confidence(self, movement_history):
-        """Calculate confidence score for the prediction"""
+    def detect_anomalies(self, features):
+        """Flag rows beyond the fitted population's distance threshold; nothing is flagged before a fit"""
         try:
-            # Calculate consistency of movement
-            distances = np.linalg.norm(np.diff(movement_history, axis=0), axis=1)
-            consistency = 1 - np.std(distances) / np.mean(distances)
-            return float(np.clip(consistency, 0, 1))
-        except:
-            return 0.5
+            if len(features) == 0:
+                return np.zeros(0, dtype=bool)
+
+            # Rows are only ever scored; fitting them here would skew the model towards them
+            model = self._current_model()
+            if model is None:
+                return np.zeros(len(features), dtype=bool)
+
+            return self.score(features) > model['threshold']
+        except Exception as e:
+            logging.error(f"Error in anomaly detection: {str(e)}")
+            return np.zeros(len(features), dtype=bool)
+
+    def has_model(self):
+        return self._current_model() is not None
+
+    def save(self):
+        """Persist the fitted model so other workers can score without refitting"""
+        if self.model is None or not self.model_path:
+            return
+        tmp_path = f"{self.model_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **self.model)
+        os.replace(tmp_path, self.model_path)
+        self._model_mtime = os.path.getmtime(self.model_path)
+
+    def _current_model(self):
+        """Return the in-memory model, reloading it when the persisted file is newer"""
+        if self.model_path and os.path.exists(self.model_path):
+            mtime = os.path.getmtime(self.model_path)
+            if mtime != self._model_mtime:
+                with np.load(self.model_path) as data:
+                    model = {
+                        'mean': data['mean'],
+                        'inv_cov': data['inv_cov'],
+                        'threshold': float(data['threshold']),
+                        'n_samples': int(data['n_samples'])
+                    }
+                with self._lock:
+                    self.model = model
+                    self._model_mtime = mtime
+        return self.model
+
+    @staticmethod
+    def _mahalanobis(X, mean, inv_cov):
+        diff = X - mean
+        return np.einsum('ij,jk,ik->i', diff, inv_cov, diff)
 
 # Initialize global instances
 movement_analyzer = MovementPatternAnalyzer()
-anomaly_detector = AnomalyDetector()
-predictive_analysis = PredictiveAnalysis()
\ No newline at end of file
+anomaly_detector = AnomalyDetector(model_path=os.environ.get('ANOMALY_MODEL_PATH', '/tmp/anomaly_model.npz'))
+speed_detector = SpeedAnomalyDetector()
\ No newline at end of file
@@ -0,0 +1,97 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from app import db
+from models import AnalysisCacheEntry, SubscriberStats
+
+
+def record_stamp(stats: Optional[SubscriberStats]) -> Optional[str]:
+    """Identify the subscriber's current record set; any ingest or prune changes it"""
+    if stats is None or stats.last_seen is None:
+        return None
+    return f"{stats.record_count}:{stats.last_seen.isoformat()}"
+
+
+class AnalysisCache:
+    """Per-subscriber analysis results in an in-process LRU backed by the analysis_cache table
+
+    Entries are only served while their record stamp and analyzer version still match,
+    so other processes that ingest records never serve stale results; invalidate()
+    additionally frees entries as soon as this process ingests for a subscriber.
+    """
+
+    def __init__(self, memory_entries: int = 4096):
+        self.memory_entries = memory_entries
+        self._memory: OrderedDict = OrderedDict()  # (analyzer, mobile_number) -> (version, stamp, result)
+        self._lock = threading.Lock()
+
+    def get(self, analyzer: str, mobile_number: str, version: str, stamp: str) -> Optional[Dict]:
+        key = (analyzer, mobile_number)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[:2] == (version, stamp):
+                self._memory.move_to_end(key)
+                return entry[2]
+
+        row = db.session.get(AnalysisCacheEntry, (mobile_number, analyzer))
+        if row is None or (row.version, row.record_stamp) != (version, stamp):
+            return None
+        self._remember(key, (version, stamp, row.result))
+        return row.result
+
+    def put(self, analyzer: str, mobile_number: str, version: str, stamp: str, result: Dict):
+        self._remember((analyzer, mobile_number), (version, stamp, result))
+        try:
+            db.session.merge(AnalysisCacheEntry(
+                mobile_number=mobile_number, analyzer=analyzer, version=version,
+                record_stamp=stamp, result=result
+            ))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error storing cached analysis: {str(e)}")
+
+    def get_or_compute(self, analyzer: str, mobile_number: str, version: str,
+                       stats: Optional[SubscriberStats], compute: Callable[[], Optional[Dict]]) -> Tuple[Optional[Dict], bool]:
+        """Return (result, cache_hit); results of None are not cached"""
+        stamp = record_stamp(stats)
+        if stamp is not None:
+            cached = self.get(analyzer, mobile_number, version, stamp)
+            if cached is not None:
+                return cached, True
+
+        result = compute()
+        if stamp is not None and result is not None:
+            self.put(analyzer, mobile_number, version, stamp, result)
+        return result, False
+
+    def invalidate(self, mobile_numbers: Iterable[str], batch_size: int = 1000):
+        """Drop entries of subscribers that received records; runs inside the caller's transaction"""
+        numbers = list(dict.fromkeys(str(number) for number in mobile_numbers))
+        affected = set(numbers)
+        with self._lock:
+            for key in [key for key in self._memory if key[1] in affected]:
+                del self._memory[key]
+        for start in range(0, len(numbers), batch_size):
+            AnalysisCacheEntry.query.filter(
+                AnalysisCacheEntry.mobile_number.in_(numbers[start:start + batch_size])
+            ).delete(synchronize_session=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        AnalysisCacheEntry.query.delete()
+        db.session.commit()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+
+# Initialize global instance
+analysis_cache = AnalysisCache()
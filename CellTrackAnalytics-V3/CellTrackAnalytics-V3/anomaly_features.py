@@ -0,0 +1,59 @@
+from typing import Dict, List
+
+import numpy as np
+
+from app import db
+from models import SubscriberStats
+from ai_models import anomaly_detector, ANOMALY_FEATURES
+
+# subscriber_stats columns behind ANOMALY_FEATURES; avg_call_duration is duration_sum / duration_count
+STATS_COLUMNS = [
+    SubscriberStats.tower_count, SubscriberStats.record_count, SubscriberStats.duration_sum,
+    SubscriberStats.duration_count, SubscriberStats.duration_max, SubscriberStats.contact_count
+]
+
+
+def _feature_matrix(rows) -> np.ndarray:
+    values = np.array([tuple(row) for row in rows], dtype=float).reshape(-1, len(STATS_COLUMNS))
+    values = np.nan_to_num(values)
+    tower_count, record_count, duration_sum, duration_count, duration_max, contact_count = values.T
+    avg_duration = np.divide(duration_sum, duration_count, out=np.zeros(len(values)), where=duration_count > 0)
+    return np.column_stack([tower_count, record_count, avg_duration, duration_max, contact_count])
+
+
+def subscriber_features(mobile_numbers: List[str], batch_size: int = 5000) -> Dict[str, List[float]]:
+    """Anomaly features per number from the subscriber_stats rollup, read by primary key"""
+    numbers = list(dict.fromkeys(mobile_numbers))
+    features = {}
+    # Batches only bound the IN list size; each batch is a single round trip
+    for start in range(0, len(numbers), batch_size):
+        rows = db.session.query(SubscriberStats.mobile_number, *STATS_COLUMNS)\
+            .filter(SubscriberStats.mobile_number.in_(numbers[start:start + batch_size]))\
+            .all()
+        matrix = _feature_matrix([row[1:] for row in rows])
+        features.update({row[0]: values for row, values in zip(rows, matrix.tolist())})
+    return features
+
+
+def population_features(batch_size: int = 100000) -> np.ndarray:
+    """Feature matrix of every subscriber in the rollup, in the ANOMALY_FEATURES column order"""
+    query = db.session.query(*STATS_COLUMNS)
+    parts = [_feature_matrix(rows) for rows in
+             db.session.execute(query.statement.execution_options(yield_per=batch_size)).partitions()]
+    return np.vstack(parts) if parts else np.empty((0, len(ANOMALY_FEATURES)))
+
+
+def fit_anomaly_model() -> int:
+    """Refit and persist the population model on every subscriber; returns the sample count (0 if too few)"""
+    features = population_features()
+    if len(features) < anomaly_detector.MIN_FIT_SAMPLES:
+        return 0
+    anomaly_detector.fit(features).save()
+    return len(features)
+
+
+def ensure_anomaly_model() -> bool:
+    """Fit the model once when none has been fitted or persisted yet; later refits are explicit"""
+    if anomaly_detector.has_model():
+        return True
+    return fit_anomaly_model() > 0
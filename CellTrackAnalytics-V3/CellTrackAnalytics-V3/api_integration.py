@@ -3,138 +3,438 @@ import logging
 from datetime import datetime, timedelta
 import json
 import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from typing import Dict, List, Optional, Union
 import pandas as pd
 import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from archive import PROCESSING_COLUMNS
+from graph_analysis import ContactGraph
+from utils import group_offsets
+
+EARTH_RADIUS_M = 6371008.8
+
+def _haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+class TowerLookupCache:
+    """On-disk SQLite store for cached tower lookups and an optional OpenCelliD dump"""
+
+    # Column order of the OpenCelliD cell export
+    OPENCELLID_COLUMNS = ['radio', 'mcc', 'net', 'area', 'cell', 'unit', 'lon', 'lat', 'range',
+                          'samples', 'changeable', 'created', 'updated', 'averageSignal']
+
+    # Disk recency is refreshed at most this often per key to avoid a commit on every hit
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 50000, memory_entries: int = 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> (created_at, touched_at, cells)
+        # Guards the memory tier and the connection, which is shared by every thread
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """The SQLite connection, opened on first use; callers hold _lock"""
+        if self._db is None:
+            self._db = self._open()
+        return self._db
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS lookups (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lookups_accessed ON lookups (accessed_at);
+            CREATE TABLE IF NOT EXISTS cells (
+                radio TEXT, mcc INTEGER, net INTEGER, area INTEGER, cell INTEGER,
+                lat REAL NOT NULL, lon REAL NOT NULL, range INTEGER, samples INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_cells_lat_lon ON cells (lat, lon);
+        """)
+        return conn
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                if now - entry[1] > self.TOUCH_INTERVAL:
+                    self._touch(key, now)
+                    self._memory[key] = (entry[0], now, entry[2])
+                return entry[2]
+
+            row = self._conn.execute("SELECT payload, created_at FROM lookups WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._memory.pop(key, None)
+                self._conn.execute("DELETE FROM lookups WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._touch(key, now)
+            cells = json.loads(row[0])
+            self._remember(key, row[1], now, cells)
+        return cells
+
+    def _touch(self, key: str, now: float):
+        self._conn.execute("UPDATE lookups SET accessed_at = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+
+    def _remember(self, key: str, created_at: float, now: float, cells: List[Dict]):
+        self._memory[key] = (created_at, now, cells)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key: str, cells: List[Dict]):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, now, cells)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lookups (key, payload, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(cells), now, now)
+            )
+            # Evict least recently used entries beyond the size limit
+            self._conn.execute("""
+                DELETE FROM lookups WHERE key IN (
+                    SELECT key FROM lookups ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self._conn.commit()
+
+    def import_opencellid(self, csv_path: str, chunk_size: int = 100000) -> int:
+        """Load an OpenCelliD CSV export (plain or gzip) for offline lookups"""
+        has_header = str(pd.read_csv(csv_path, nrows=1, header=None).iloc[0, 0]) == 'radio'
+        imported = 0
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size, header=0 if has_header else None,
+                                 names=None if has_header else self.OPENCELLID_COLUMNS):
+            rows = chunk[['radio', 'mcc', 'net', 'area', 'cell', 'lat', 'lon', 'range', 'samples']]
+            with self._lock:
+                self._conn.executemany("INSERT INTO cells VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                       rows.itertuples(index=False, name=None))
+                self._conn.commit()
+            imported += len(rows)
+        return imported
+
+    def has_offline_data(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM cells LIMIT 1").fetchone() is not None
+
+    def query_offline(self, lat: float, lon: float, radius: float) -> List[Dict]:
+        """Cells from the local dump within radius metres, nearest first"""
+        lat_delta = np.degrees(radius / EARTH_RADIUS_M)
+        lon_delta = lat_delta / max(np.cos(np.radians(lat)), 1e-6)
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT radio, mcc, net, area, cell, lat, lon, range, samples FROM cells
+                WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?
+            """, (lat - lat_delta, lat + lat_delta, lon - lon_delta, lon + lon_delta)).fetchall()
+
+        cells = [{'radio': r[0], 'mcc': r[1], 'mnc': r[2], 'lac': r[3], 'cellid': r[4],
+                  'lat': r[5], 'lon': r[6], 'range': r[7], 'samples': r[8]} for r in rows]
+        return CellTowerAPI._within(cells, lat, lon, radius)
 
 class CellTowerAPI:
+    # Lookups are cached per quantized tile; a tile is queried with a radius covering all of it
+    TILE_DEGREES = 0.01
+    RADIUS_STEP_M = 500
+
     def __init__(self):
         self.base_url = "https://opencellid.org/cell/getInArea"
         self.api_key = os.environ.get("CELL_TOWER_API_KEY")
-        
+        self.offline = os.environ.get("CELL_TOWER_OFFLINE", "").lower() in ('1', 'true', 'yes')
+        self.timeout = (
+            float(os.environ.get("CELL_TOWER_CONNECT_TIMEOUT", 3.05)),
+            float(os.environ.get("CELL_TOWER_READ_TIMEOUT", 10))
+        )
+        # Set from the app config by init_app(); nothing is opened at import time
+        self.cache: Optional[TowerLookupCache] = None
+
+        # Pooled keep-alive connections with a small retry budget for transient failures
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=20,
+                              max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504]))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def init_app(self, app):
+        self.cache = TowerLookupCache(app.config['CELL_TOWER_CACHE_PATH'], ttl=app.config['CELL_TOWER_CACHE_TTL'])
+
     def get_nearby_towers(self, lat: float, lon: float, radius: float = 5000) -> List[Dict]:
         """Get nearby cell towers within radius (meters)"""
         try:
-            params = {
-                "key": self.api_key,
-                "lat": lat,
-                "lon": lon,
-                "radius": radius,
-                "format": "json"
-            }
-            
-            response = requests.get(self.base_url, params=params)
-            if response.status_code == 200:
-                return response.json().get("cells", [])
-            else:
-                logging.error(f"API error: {response.status_code}")
-                return []
+            if self.offline or not self.api_key:
+                return self.cache.query_offline(lat, lon, radius) if self.cache.has_offline_data() else []
+
+            tile_lat, tile_lon, tile_radius = self._tile(lat, lon, radius)
+            key = f"{tile_lat:.4f}:{tile_lon:.4f}:{tile_radius}"
+            cells = self.cache.get(key)
+            if cells is None:
+                cells = self._fetch(tile_lat, tile_lon, tile_radius)
+                if cells is None:
+                    return []
+                self.cache.put(key, cells)
+
+            return self._within(cells, lat, lon, radius)
         except Exception as e:
             logging.error(f"Error fetching nearby towers: {str(e)}")
             return []
 
+    def _fetch(self, lat: float, lon: float, radius: float) -> Optional[List[Dict]]:
+        params = {
+            "key": self.api_key,
+            "lat": lat,
+            "lon": lon,
+            "radius": radius,
+            "format": "json"
+        }
+
+        response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+        if response.status_code == 200:
+            return response.json().get("cells", [])
+        else:
+            logging.error(f"API error: {response.status_code}")
+            return None
+
+    def _tile(self, lat: float, lon: float, radius: float):
+        """Snap a query to its tile centre, growing the radius so the tile is fully covered"""
+        tile_lat = (np.floor(lat / self.TILE_DEGREES) + 0.5) * self.TILE_DEGREES
+        tile_lon = (np.floor(lon / self.TILE_DEGREES) + 0.5) * self.TILE_DEGREES
+        half_diagonal = _haversine_m(tile_lat, tile_lon,
+                                     tile_lat + self.TILE_DEGREES / 2, tile_lon + self.TILE_DEGREES / 2)
+        covering = radius + half_diagonal
+        tile_radius = int(np.ceil(covering / self.RADIUS_STEP_M) * self.RADIUS_STEP_M)
+        return float(tile_lat), float(tile_lon), tile_radius
+
+    @staticmethod
+    def _within(cells: List[Dict], lat: float, lon: float, radius: float) -> List[Dict]:
+        if not cells:
+            return []
+        distances = _haversine_m(lat, lon, np.array([c['lat'] for c in cells], dtype=float),
+                                 np.array([c['lon'] for c in cells], dtype=float))
+        order = np.argsort(distances)
+        return [cells[i] for i in order if distances[i] <= radius]
+
+class UploadSummary:
+    """Upload-wide statistics and contact network, folded in one chunk at a time
+
+    Only distinct numbers, towers and contact pairs are kept, not rows, so a large
+    upload can be summarized while it streams. A single chunk holding the whole
+    upload gives the same result as summarizing the full frame.
+    """
+    # Buffered contact pairs are deduplicated once they outgrow this (or twice the last deduplicated count)
+    COMPACT_PAIRS = 100000
+
+    def __init__(self):
+        self.total_records = 0
+        self.numbers = set()
+        self.towers = set()
+        self.first_seen: List = []
+        self.last_seen: List = []
+        self.duration_sum = 0.0
+        self.duration_count = 0
+        self.duration_max: List[float] = []
+        self.total_calls = 0
+        self.call_edges = 0
+        self._pairs: List[pd.DataFrame] = []
+        self._compacted_pairs = 0
+
+    def add(self, chunk: pd.DataFrame) -> 'UploadSummary':
+        timestamps = pd.to_datetime(chunk['timestamp'])
+        self.total_records += len(chunk)
+        self.numbers.update(chunk['mobile_number'].dropna().unique().tolist())
+        self.towers.update(chunk['tower_id'].dropna().unique().tolist())
+        self.first_seen.append(timestamps.min())
+        self.last_seen.append(timestamps.max())
+
+        durations = chunk['call_duration']
+        self.duration_sum += float(durations.sum())
+        self.duration_count += int(durations.count())
+        self.duration_max.append(float(durations.max()) if durations.count() else np.nan)
+
+        calls = chunk['call_type'].isin(['incoming', 'outgoing']).to_numpy()
+        self.total_calls += int(calls.sum())
+        edges = pd.DataFrame({
+            'source': chunk['mobile_number'][calls].astype(object),
+            'target': chunk['connected_number'][calls].astype(object),
+            'timestamp': timestamps[calls]
+        }).dropna()
+        self.call_edges += len(edges)
+        # Repeated calls only count towards total_edges; first-seen order keeps hub ties stable
+        self._pairs.append(edges[['source', 'target']].drop_duplicates())
+        if sum(len(pairs) for pairs in self._pairs) > 2 * max(self._compacted_pairs, self.COMPACT_PAIRS):
+            self._pairs = [self._unique_pairs()]
+            self._compacted_pairs = len(self._pairs[0])
+        return self
+
+    def _unique_pairs(self) -> pd.DataFrame:
+        return pd.concat(self._pairs, ignore_index=True).drop_duplicates()
+
+    def stats(self) -> Dict:
+        """Calculate overall statistics"""
+        return {
+            'total_records': self.total_records,
+            'unique_numbers': len(self.numbers),
+            'unique_towers': len(self.towers),
+            'date_range': {
+                'start': pd.Series(self.first_seen, dtype='datetime64[ns]').min().isoformat(),
+                'end': pd.Series(self.last_seen, dtype='datetime64[ns]').max().isoformat()
+            },
+            'call_stats': {
+                'avg_duration': self.duration_sum / self.duration_count if self.duration_count else float('nan'),
+                'max_duration': float(pd.Series(self.duration_max, dtype=float).max()),
+                'total_calls': self.total_calls
+            }
+        }
+
+    def network_analysis(self) -> Dict:
+        """Analyze communication network patterns"""
+        if not self.call_edges:
+            return {}
+        # Build the adjacency index once and derive components, degrees and hubs from it
+        pairs = self._unique_pairs()
+        return ContactGraph(pairs['source'].to_numpy(), pairs['target'].to_numpy(),
+                            num_calls=self.call_edges).summary()
+
+
 class DataProcessor:
     @staticmethod
     def process_tower_data(df: pd.DataFrame) -> Dict[str, Union[List, Dict]]:
         """Process tower data and extract patterns"""
         try:
-            # Group data by mobile number
-            grouped = df.groupby('mobile_number').agg({
-                'timestamp': ['count', 'min', 'max'],
-                'tower_id': lambda x: list(x),
-                'latitude': lambda x: list(x),
-                'longitude': lambda x: list(x),
-                'connected_number': lambda x: list(x),
-                'call_duration': ['mean', 'max']
-            }).reset_index()
-            
-            patterns = []
-            for _, row in grouped.iterrows():
-                pattern = {
-                    'mobile_number': row['mobile_number'],
-                    'tower_count': len(set(row['tower_id'])),
-                    'first_seen': row['timestamp']['min'].isoformat(),
-                    'last_seen': row['timestamp']['max'].isoformat(),
-                    'total_records': row['timestamp']['count'],
-                    'movement_path': list(zip(row['latitude'], row['longitude'])),
-                    'avg_call_duration': float(row['call_duration']['mean']),
-                    'max_call_duration': float(row['call_duration']['max']),
-                    'contact_network': DataProcessor._analyze_contacts(row['connected_number'])
-                }
-                patterns.append(pattern)
-                
+            if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+                df = df.assign(timestamp=pd.to_datetime(df['timestamp']))
+
+            # Sort once so every subscriber occupies a contiguous, time-ordered slice
+            sorted_df, starts, ends = group_offsets(df)
+            summary = UploadSummary().add(df)
+
             return {
-                'patterns': patterns,
-                'stats': DataProcessor._calculate_stats(df),
-                'network_analysis': DataProcessor._analyze_network(df)
+                'patterns': DataProcessor.build_patterns(sorted_df, starts, ends),
+                'stats': summary.stats(),
+                'network_analysis': summary.network_analysis()
             }
         except Exception as e:
             logging.error(f"Error processing tower data: {str(e)}")
             return {'patterns': [], 'stats': {}, 'network_analysis': {}}
-    
+
     @staticmethod
-    def _analyze_contacts(numbers: List[str]) -> Dict:
-        """Analyze contact patterns"""
-        numbers = [n for n in numbers if n]  # Remove None/empty values
-        if not numbers:
-            return {}
-            
-        contact_freq = pd.Series(numbers).value_counts()
+    def process_archive(archive, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        mobile_numbers: Optional[List[str]] = None,
+                        include_patterns: bool = False) -> Dict[str, Union[List, Dict]]:
+        """Process archived records batch by batch, reading only the columns and partitions the analysis needs
+
+        Statistics and the contact network fold in one record batch at a time. Patterns need each
+        number's full history, so they are built one hash bucket at a time.
+        """
+        summary = UploadSummary()
+        patterns = []
+        if not include_patterns:
+            for batch in archive.scan_batches(columns=PROCESSING_COLUMNS, start=start, end=end,
+                                              mobile_numbers=mobile_numbers):
+                summary.add(batch)
+        else:
+            for bucket in range(archive.buckets):
+                batches = list(archive.scan_batches(columns=PROCESSING_COLUMNS, start=start, end=end,
+                                                    mobile_numbers=mobile_numbers, buckets=[bucket]))
+                if not batches:
+                    continue
+                df = pd.concat(batches, ignore_index=True)
+                summary.add(df)
+                patterns.extend(DataProcessor.build_patterns(*group_offsets(df)))
+            patterns.sort(key=lambda pattern: pattern['mobile_number'])
         return {
-            'most_frequent': contact_freq.index[0] if len(contact_freq) > 0 else None,
-            'contact_count': len(contact_freq),
-            'frequent_contacts': contact_freq[contact_freq >= 3].index.tolist()
+            'patterns': patterns,
+            'stats': summary.stats(),
+            'network_analysis': summary.network_analysis()
         }
-    
+
     @staticmethod
-    def _calculate_stats(df: pd.DataFrame) -> Dict:
-        """Calculate overall statistics"""
-        return {
-            'total_records': len(df),
-            'unique_numbers': df['mobile_number'].nunique(),
-            'unique_towers': df['tower_id'].nunique(),
-            'date_range': {
-                'start': df['timestamp'].min().isoformat(),
-                'end': df['timestamp'].max().isoformat()
-            },
-            'call_stats': {
-                'avg_duration': float(df['call_duration'].mean()),
-                'max_duration': float(df['call_duration'].max()),
-                'total_calls': len(df[df['call_type'].isin(['incoming', 'outgoing'])])
-            }
-        }
-    
+    def build_patterns(sorted_df: pd.DataFrame, starts: np.ndarray, ends: np.ndarray) -> List[Dict]:
+        """Compute per-number aggregates with reduceat over the group offsets"""
+        if len(starts) == 0:
+            return []
+
+        group_sizes = ends - starts
+        group_ids = np.repeat(np.arange(len(starts)), group_sizes)
+
+        timestamps = sorted_df['timestamp']
+        first_seen = timestamps.iloc[starts].tolist()
+        last_seen = timestamps.iloc[ends - 1].tolist()
+
+        tower_pairs = pd.DataFrame({'group': group_ids, 'tower_id': sorted_df['tower_id'].to_numpy()})
+        tower_counts = np.bincount(tower_pairs.drop_duplicates()['group'], minlength=len(starts))
+
+        durations = pd.to_numeric(sorted_df['call_duration'], errors='coerce').to_numpy(dtype=float)
+        present = ~np.isnan(durations)
+        duration_sums = np.add.reduceat(np.where(present, durations, 0.0), starts)
+        duration_counts = np.add.reduceat(present.astype(np.int64), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_durations = duration_sums / duration_counts
+        max_durations = np.fmax.reduceat(durations, starts)
+
+        coordinates = sorted_df[['latitude', 'longitude']].to_numpy(dtype=float).tolist()
+        contact_networks = DataProcessor._analyze_contact_groups(sorted_df['connected_number'], group_ids, len(starts))
+        numbers = sorted_df['mobile_number'].iloc[starts].tolist()
+
+        patterns = []
+        for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+            patterns.append({
+                'mobile_number': numbers[i],
+                'tower_count': int(tower_counts[i]),
+                'first_seen': first_seen[i].isoformat(),
+                'last_seen': last_seen[i].isoformat(),
+                'total_records': int(group_sizes[i]),
+                'movement_path': coordinates[start:end],
+                'avg_call_duration': float(avg_durations[i]),
+                'max_call_duration': float(max_durations[i]),
+                'contact_network': contact_networks[i]
+            })
+        return patterns
+
     @staticmethod
-    def _analyze_network(df: pd.DataFrame) -> Dict:
-        """Analyze communication network patterns"""
-        call_df = df[df['call_type'].isin(['incoming', 'outgoing'])]
-        if len(call_df) == 0:
-            return {}
-            
-        # Create network edges
-        edges = pd.DataFrame({
-            'source': call_df['mobile_number'],
-            'target': call_df['connected_number'],
-            'timestamp': call_df['timestamp']
-        }).dropna()
-        
-        if len(edges) == 0:
-            return {}
-            
-        # Find connected components
-        unique_numbers = set(edges['source']).union(set(edges['target']))
-        connections = {}
-        for num in unique_numbers:
-            connected = set(edges[edges['source'] == num]['target']).union(
-                set(edges[edges['target'] == num]['source']))
-            connections[num] = list(connected)
-            
-        return {
-            'total_nodes': len(unique_numbers),
-            'total_edges': len(edges),
-            'avg_connections': sum(len(c) for c in connections.values()) / len(connections),
-            'most_connected': max(connections.items(), key=lambda x: len(x[1]))[0]
-        }
+    def _analyze_contact_groups(contacts: pd.Series, group_ids: np.ndarray, num_groups: int) -> List[Dict]:
+        """Analyze contact patterns for every group with a single grouped count"""
+        frame = pd.DataFrame({'group': group_ids, 'contact': contacts.to_numpy()})
+        frame = frame[frame['contact'].notna() & (frame['contact'] != '')]
+
+        networks = [{} for _ in range(num_groups)]
+        if frame.empty:
+            return networks
+
+        # sort=False keeps first-appearance order, so ties rank like Series.value_counts
+        counts = frame.groupby(['group', 'contact'], sort=False).size().reset_index(name='count')
+        counts = counts.sort_values(['group', 'count'], ascending=[True, False], kind='stable')
+
+        groups = counts['group'].to_numpy()
+        names = counts['contact'].tolist()
+        frequent = (counts['count'].to_numpy() >= 3)
+        bounds = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1], True])
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            networks[groups[start]] = {
+                'most_frequent': names[start],
+                'contact_count': end - start,
+                'frequent_contacts': [names[j] for j in range(start, end) if frequent[j]]
+            }
+        return networks
 
 # Initialize global instances
 tower_api = CellTowerAPI()
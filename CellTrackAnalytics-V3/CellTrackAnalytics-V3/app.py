@@ -1,17 +1,22 @@
 import os
+import click
 import pandas as pd
 import numpy as np
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.utils import secure_filename
 import logging
 import io
-from datetime import datetime
-from sqlalchemy import func, distinct, create_engine
+import json
+import base64
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import func, distinct, create_engine, tuple_
+from sqlalchemy.orm import joinedload, load_only, aliased
 from sqlalchemy.pool import QueuePool
 
 # Import custom modules
-from ai_models import movement_analyzer, anomaly_detector, predictive_analysis
+from ai_models import movement_analyzer, anomaly_detector
 from api_integration import tower_api, data_processor
 
 # Configure logging
@@ -36,24 +41,61 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 db = SQLAlchemy(app)
 
 # Import models after db initialization
-from models import CellTower, TowerRecord, AnalysisResult
+from models import (CellTower, TowerRecord, AnalysisResult, AnalysisJob, SubscriberStats, TowerDayBitmap, Subscriber,
+                    TowerTransition, TravelAnomaly, TowerStats)
+from jobs import job_queue
+from ingest import (rebuild_subscriber_stats, rebuild_tower_bitmaps, rebuild_tower_transitions, rebuild_travel_anomalies,
+                    rebuild_tower_stats)
+from partitions import prune_records, warn_if_unpartitioned
+from archive import cdr_archive
+from readers import is_supported
+from trajectory import decode_track, expand_path, path_runs
+from analysis_cache import analysis_cache
+from colocation import find_colocations
+from bitmaps import evaluate, subscriber_numbers
+from markov import next_tower_model
+from anomaly_features import subscriber_features, fit_anomaly_model, ensure_anomaly_model
+from spatial_index import (tower_grid, tile_bounds, geohash_cover, geohash_range_filter, longitude_filter,
+                           backfill_geohashes)
+from migrations import upgrade_schema
 
 # Create tables
 with app.app_context():
     try:
         db.create_all()
         logger.info("Database tables created successfully")
+        # Tables from earlier versions are upgraded before anything queries the new columns
+        if upgrade_schema():
+            logger.info("Database schema upgraded")
+        warn_if_unpartitioned()
+        backfill_geohashes()
+        # Databases created before the rollup existed get it built once from the raw records
+        if SubscriberStats.query.first() is None and TowerRecord.query.first() is not None:
+            rebuild_subscriber_stats()
+        if TowerStats.query.first() is None and TowerRecord.query.first() is not None:
+            rebuild_tower_stats()
+        if TowerDayBitmap.query.first() is None and TowerRecord.query.first() is not None:
+            rebuild_tower_bitmaps()
+        if TowerTransition.query.first() is None and TowerRecord.query.first() is not None:
+            rebuild_tower_transitions()
+        job_queue.resume_pending()
     except Exception as e:
         logger.error(f"Error creating database tables: {str(e)}")
         raise
 
-ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
 UPLOAD_FOLDER = '/tmp'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Uploads are spooled to disk and ingested in chunks, so no request size cap is set
+app.config['INGEST_CHUNK_SIZE'] = int(os.environ.get('INGEST_CHUNK_SIZE', 50000))
+app.config['CELL_TOWER_CACHE_PATH'] = os.environ.get('CELL_TOWER_CACHE_PATH', '/tmp/cell_tower_cache.sqlite3')
+app.config['CELL_TOWER_CACHE_TTL'] = float(os.environ.get('CELL_TOWER_CACHE_TTL', 7 * 24 * 3600))
+tower_api.init_app(app)
+
+MAX_MAP_ZOOM = 22
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    # CSV may be gzip/zstd/bz2 compressed, e.g. records.csv.gz
+    return is_supported(filename)
 
 @app.route('/')
 def index():
@@ -61,21 +103,172 @@ def index():
 
 @app.route('/upload')
 def upload_page():
-    # Get all analysis results for displaying upload history
-    analysis_results = AnalysisResult.query.order_by(AnalysisResult.analysis_date.desc()).all()
-    return render_template('upload.html', analysis_results=analysis_results)
+    # Upload history is paged in from /api/analysis/results
+    return render_template('upload.html')
 
 @app.route('/map')
 def map_page():
-    # Get all tower locations for the map
-    tower_records = TowerRecord.query.all()
-    return render_template('map.html', tower_records=tower_records)
+    # Tower data is loaded per viewport from the map API
+    return render_template('map.html')
+
+@app.route('/api/map/tiles/<int:z>/<int:x>/<int:y>')
+def map_tile(z, x, y):
+    if not 0 <= z <= MAX_MAP_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Invalid tile'}), 400
+    south, west, north, east = tile_bounds(z, x, y)
+    return jsonify(tower_grid.aggregate(south, west, north, east, z))
+
+@app.route('/api/map/clusters')
+def map_clusters():
+    try:
+        south = float(request.args['south'])
+        west = float(request.args['west'])
+        north = float(request.args['north'])
+        east = float(request.args['east'])
+        zoom = min(max(int(request.args.get('zoom', 2)), 0), MAX_MAP_ZOOM)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'south, west, north, east and zoom are required'}), 400
+    try:
+        return jsonify(tower_grid.aggregate(south, west, north, east, zoom))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/towers/nearest')
+def nearest_towers():
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        k = min(max(int(request.args.get('k', 5)), 1), 100)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat and lng are required'}), 400
+    return jsonify({'towers': tower_grid.nearest(lat, lng, k)})
+
+@app.route('/api/towers/within')
+def towers_within():
+    try:
+        if 'radius' in request.args:
+            towers = tower_grid.within_radius(
+                float(request.args['lat']), float(request.args['lng']), float(request.args['radius'])
+            )
+        else:
+            towers = tower_grid.within_bbox(
+                float(request.args['south']), float(request.args['west']),
+                float(request.args['north']), float(request.args['east'])
+            )
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Provide lat, lng and radius (metres) or south, west, north and east'}), 400
+    return jsonify({'towers': towers})
 
 @app.route('/analysis')
 def analysis_page():
-    # Get all analysis results for historical view
-    analysis_results = AnalysisResult.query.order_by(AnalysisResult.analysis_date.desc()).all()
-    return render_template('analysis.html', analysis_results=analysis_results)
+    # History rows are paged in from /api/analysis/results; only the total is rendered here
+    total_analyses = db.session.query(func.count(AnalysisResult.id)).scalar()
+    return render_template('analysis.html', total_analyses=total_analyses)
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+# Sortable history columns; each is paired with id to form a unique keyset order
+HISTORY_SORTS = {
+    'analysis_date': AnalysisResult.analysis_date,
+    'mobile_number': AnalysisResult.mobile_number,
+    'tower_count': AnalysisResult.tower_count,
+}
+
+HISTORY_COLUMNS = (
+    AnalysisResult.id, AnalysisResult.analysis_date, AnalysisResult.mobile_number,
+    AnalysisResult.tower_count, AnalysisResult.first_seen, AnalysisResult.last_seen
+)
+
+def serialize_result_summary(r):
+    return {
+        'id': r.id,
+        'analysis_date': r.analysis_date.isoformat() if r.analysis_date else None,
+        'mobile_number': r.mobile_number,
+        'tower_count': r.tower_count,
+        'first_seen': r.first_seen.isoformat(),
+        'last_seen': r.last_seen.isoformat(),
+        'duration_hours': (r.last_seen - r.first_seen).total_seconds() // 3600
+    }
+
+@app.route('/api/analysis/results')
+def analysis_results():
+    """Keyset-paginated analysis history that loads only the summary columns"""
+    sort = request.args.get('sort', 'analysis_date')
+    descending = request.args.get('order', 'desc') != 'asc'
+    if sort not in HISTORY_SORTS:
+        return jsonify({'error': f"sort must be one of {sorted(HISTORY_SORTS)}"}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE))
+        min_towers = request.args.get('min_towers', type=int)
+        after = decode_cursor(request.args['cursor'], as_datetime=sort == 'analysis_date') \
+            if request.args.get('cursor') else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit, min_towers or cursor'}), 400
+
+    # The JSON blob columns are never loaded for list pages
+    query = AnalysisResult.query.options(load_only(*HISTORY_COLUMNS))
+    if request.args.get('mobile_number'):
+        query = query.filter(AnalysisResult.mobile_number == request.args['mobile_number'])
+    if min_towers is not None:
+        query = query.filter(AnalysisResult.tower_count >= min_towers)
+    if request.args.get('start_date'):
+        query = query.filter(AnalysisResult.analysis_date >= request.args['start_date'])
+    if request.args.get('end_date'):
+        query = query.filter(AnalysisResult.analysis_date <= request.args['end_date'])
+
+    column = HISTORY_SORTS[sort]
+    if after is not None:
+        key = tuple_(column, AnalysisResult.id)
+        query = query.filter(key < after if descending else key > after)
+    if descending:
+        query = query.order_by(column.desc(), AnalysisResult.id.desc())
+    else:
+        query = query.order_by(column, AnalysisResult.id)
+
+    # Fetch one extra row to learn whether another page exists
+    results = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor(getattr(results[-1], sort), results[-1].id)
+
+    return jsonify({
+        'results': [serialize_result_summary(r) for r in results],
+        'next_cursor': next_cursor
+    })
+
+def result_runs(result):
+    """Dwell runs of a result; rows stored before movement_track are derived from movement_path"""
+    if result.movement_track:
+        return decode_track(result.movement_track)
+    return path_runs(result.movement_path or [])
+
+@app.route('/api/analysis/results/<int:result_id>')
+def analysis_result_detail(result_id):
+    result = db.session.get(AnalysisResult, result_id)
+    if result is None:
+        return jsonify({'error': 'Analysis result not found'}), 404
+
+    detail = serialize_result_summary(result)
+    detail.update({
+        'common_contacts': result.common_contacts,
+        'location_frequency': result.location_frequency,
+        'runs': result_runs(result)
+    })
+    return jsonify(detail)
+
+@app.route('/api/analysis/<int:result_id>/track')
+def analysis_track(result_id):
+    result = db.session.get(AnalysisResult, result_id)
+    if result is None:
+        return jsonify({'error': 'Analysis result not found'}), 404
+
+    runs = result_runs(result)
+    response = {'id': result.id, 'mobile_number': result.mobile_number, 'runs': runs}
+    if request.args.get('expand') == 'true':
+        response['movement_path'] = expand_path(runs) if result.movement_track else (result.movement_path or [])
+    return jsonify(response)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -87,80 +280,36 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
 
     if file and allowed_file(file.filename):
+        filename = secure_filename(file.filename)
+        path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{filename}")
         try:
-            # Read and process the file
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file)
-            else:
-                df = pd.read_excel(file)
-
-            # Process data using enhanced processor
-            processed_data = data_processor.process_tower_data(df)
-
-            # Store results and perform AI analysis
-            analysis_results = []
-            for pattern in processed_data['patterns']:
-                # Prepare data for AI analysis
-                coordinates = np.array(pattern['movement_path'])
-                timestamps = pd.to_datetime(df[df['mobile_number'] == pattern['mobile_number']]['timestamp']).astype(np.int64) // 10**9
-
-                # Perform AI analysis
-                movement_analysis = movement_analyzer.analyze_movement_patterns(coordinates, timestamps)
-
-                # Create features for anomaly detection
-                features = np.array([[
-                    pattern['tower_count'],
-                    pattern['total_records'],
-                    pattern['avg_call_duration'],
-                    pattern['max_call_duration'],
-                    len(pattern['contact_network'].get('frequent_contacts', []))
-                ]])
-
-                # Detect anomalies
-                is_anomaly = bool(anomaly_detector.detect_anomalies(features)[0])
-
-                # Predict next location
-                if len(coordinates) >= 24:
-                    movement_history = np.array([coordinates[-24:]])
-                    next_location = predictive_analysis.predict_next_location(movement_history)
-                else:
-                    next_location = None
-
-                # Store analysis result
-                result = AnalysisResult(
-                    mobile_number=pattern['mobile_number'],
-                    tower_count=pattern['tower_count'],
-                    first_seen=datetime.fromisoformat(pattern['first_seen']),
-                    last_seen=datetime.fromisoformat(pattern['last_seen']),
-                    movement_path=pattern['movement_path'],
-                    common_contacts=pattern['contact_network'],
-                    location_frequency={str(k): v for k, v in enumerate(movement_analysis['clusters']) if v != -1} if movement_analysis else None
-                )
-                db.session.add(result)
-                analysis_results.append({
-                    'mobile_number': pattern['mobile_number'],
-                    'analysis': {
-                        'movement_patterns': movement_analysis,
-                        'is_anomaly': is_anomaly,
-                        'predicted_next_location': next_location,
-                        'contact_network': pattern['contact_network']
-                    }
-                })
-
-            db.session.commit()
+            # Spool the upload to disk; ingest and analysis run in the job pool
+            file.save(path)
+            mode = 'ingest' if request.form.get('mode') == 'ingest' else 'analyze'
+            job = job_queue.submit(filename, path, mode=mode)
             return jsonify({
-                'analysis_results': analysis_results,
-                'statistics': processed_data['stats'],
-                'network_analysis': processed_data['network_analysis']
-            })
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f"/api/jobs/{job.id}"
+            }), 202
 
         except Exception as e:
             db.session.rollback()
-            logger.error(f"Error processing file: {str(e)}")
+            if os.path.exists(path):
+                os.remove(path)
+            logger.error(f"Error queueing file: {str(e)}")
             return jsonify({'error': 'Error processing file'}), 500
 
     return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/api/jobs/<int:job_id>')
+def job_status(job_id):
+    job = db.session.get(AnalysisJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job_queue.check_orphaned(job)
+    return jsonify(job.to_dict())
+
 @app.route('/export', methods=['POST'])
 def export_data():
     try:
@@ -184,114 +333,181 @@ def export_data():
 def search_page():
     return render_template('search.html')
 
+SEARCH_PAGE_SIZE = 500
+SEARCH_MAX_PAGE_SIZE = 5000
+
+def build_search_query(search_params):
+    """Translate search parameters into a TowerRecord query"""
+    search_type = search_params.get('type')
+    query = TowerRecord.query
+
+    if search_type == 'mobile':
+        query = query.filter_by(mobile_number=search_params.get('value'))
+    elif search_type == 'imei':
+        query = query.filter_by(imei=search_params.get('value'))
+    elif search_type == 'tower':
+        query = query.filter_by(tower_id=search_params.get('value'))
+    elif search_type == 'common_locations':
+        # Find numbers that appear in multiple locations
+        min_locations = search_params.get('min_locations', 2)
+        query = query.join(Subscriber, Subscriber.id == TowerRecord.subscriber_id)\
+            .join(SubscriberStats, SubscriberStats.mobile_number == Subscriber.mobile_number)\
+            .filter(SubscriberStats.tower_count >= min_locations)
+    elif search_type == 'frequent_callers':
+        # Find numbers frequently calling a target number
+        target = search_params.get('target_number')
+        min_calls = search_params.get('min_calls', 5)
+        call_filter = (
+            TowerRecord.connected_number == target,
+            TowerRecord.call_type.in_(['incoming', 'outgoing'])
+        )
+        subquery = db.session.query(TowerRecord.subscriber_id).filter(*call_filter)\
+            .group_by(TowerRecord.subscriber_id).having(func.count() >= min_calls).subquery()
+
+        query = query.filter(*call_filter).join(subquery, TowerRecord.subscriber_id == subquery.c.subscriber_id)
+    elif search_type == 'geo_fence':
+        # Search within geographical bounds
+        bounds = search_params.get('bounds', {})
+        if bounds:
+            # Geohash prefix ranges narrow the scan via the index; the exact box is applied after
+            prefixes = geohash_cover(bounds['south'], bounds['west'], bounds['north'], bounds['east'])
+            query = query.join(CellTower).filter(
+                geohash_range_filter(CellTower.geohash, prefixes),
+                CellTower.latitude.between(bounds['south'], bounds['north']),
+                longitude_filter(CellTower.longitude, bounds['west'], bounds['east'])
+            )
+    elif search_type == 'call_duration':
+        # Filter by call duration
+        min_duration = search_params.get('min_duration')
+        max_duration = search_params.get('max_duration')
+        if min_duration is not None:
+            query = query.filter(TowerRecord.call_duration >= min_duration)
+        if max_duration is not None:
+            query = query.filter(TowerRecord.call_duration <= max_duration)
+    elif search_type == 'high_volume':
+        # Find numbers with high call volume
+        threshold = search_params.get('threshold', 50)
+        query = query.join(Subscriber, Subscriber.id == TowerRecord.subscriber_id)\
+            .join(SubscriberStats, SubscriberStats.mobile_number == Subscriber.mobile_number)\
+            .filter(SubscriberStats.record_count >= threshold)
+
+    # Apply date range filter if provided
+    if search_params.get('start_date'):
+        query = query.filter(TowerRecord.timestamp >= search_params.get('start_date'))
+    if search_params.get('end_date'):
+        query = query.filter(TowerRecord.timestamp <= search_params.get('end_date'))
+
+    # Keyset order; the tower and dimension joins are eager-loaded to avoid lazy loads per row
+    return query.options(
+        joinedload(TowerRecord.tower),
+        joinedload(TowerRecord.subscriber),
+        joinedload(TowerRecord.contact),
+        joinedload(TowerRecord.device)
+    ).order_by(TowerRecord.timestamp, TowerRecord.id)
+
+def serialize_record(r):
+    return {
+        'mobile_number': r.mobile_number,
+        'imei': r.imei,
+        'tower_id': r.tower_id,
+        'timestamp': r.timestamp.isoformat(),
+        'duration': r.call_duration,
+        'type': r.call_type,
+        'connected_number': r.connected_number,
+        'location': {'lat': r.tower.latitude, 'lng': r.tower.longitude}
+    }
+
+def encode_cursor(value, record_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([value, record_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+def decode_cursor(token, as_datetime=True):
+    value, record_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    return (datetime.fromisoformat(value) if as_datetime else value), int(record_id)
+
 @app.route('/api/search', methods=['POST'])
 def search_data():
     try:
         search_params = request.json
-        search_type = search_params.get('type')
-        query = TowerRecord.query
-
-        if search_type == 'mobile':
-            query = query.filter_by(mobile_number=search_params.get('value'))
-        elif search_type == 'imei':
-            query = query.filter_by(imei=search_params.get('value'))
-        elif search_type == 'tower':
-            query = query.filter_by(tower_id=search_params.get('value'))
-        elif search_type == 'common_locations':
-            # Find numbers that appear in multiple locations
-            min_locations = search_params.get('min_locations', 2)
-            subquery = db.session.query(
-                TowerRecord.mobile_number,
-                func.count(distinct(TowerRecord.tower_id)).label('tower_count')
-            ).group_by(TowerRecord.mobile_number).having(
-                func.count(distinct(TowerRecord.tower_id)) >= min_locations
-            ).subquery()
-
-            query = query.join(subquery, TowerRecord.mobile_number == subquery.c.mobile_number)
-        elif search_type == 'frequent_callers':
-            # Find numbers frequently calling a target number
-            target = search_params.get('target_number')
-            min_calls = search_params.get('min_calls', 5)
-            query = query.filter(
-                TowerRecord.connected_number == target,
-                TowerRecord.call_type.in_(['incoming', 'outgoing'])
-            ).group_by(TowerRecord.mobile_number).having(func.count() >= min_calls)
-        elif search_type == 'geo_fence':
-            # Search within geographical bounds
-            bounds = search_params.get('bounds', {})
-            if bounds:
-                query = query.join(CellTower).filter(
-                    CellTower.latitude.between(bounds['south'], bounds['north']),
-                    CellTower.longitude.between(bounds['west'], bounds['east'])
-                )
-        elif search_type == 'call_duration':
-            # Filter by call duration
-            min_duration = search_params.get('min_duration')
-            max_duration = search_params.get('max_duration')
-            if min_duration is not None:
-                query = query.filter(TowerRecord.call_duration >= min_duration)
-            if max_duration is not None:
-                query = query.filter(TowerRecord.call_duration <= max_duration)
-        elif search_type == 'high_volume':
-            # Find numbers with high call volume
-            threshold = search_params.get('threshold', 50)
-            subquery = db.session.query(
-                TowerRecord.mobile_number,
-                func.count().label('call_count')
-            ).group_by(TowerRecord.mobile_number).having(
-                func.count() >= threshold
-            ).subquery()
-
-            query = query.join(subquery, TowerRecord.mobile_number == subquery.c.mobile_number)
-
-        # Apply date range filter if provided
-        if search_params.get('start_date'):
-            query = query.filter(TowerRecord.timestamp >= search_params.get('start_date'))
-        if search_params.get('end_date'):
-            query = query.filter(TowerRecord.timestamp <= search_params.get('end_date'))
-
-        # Execute query and format results
-        results = query.all()
-        return jsonify([{
-            'mobile_number': r.mobile_number,
-            'imei': r.imei,
-            'tower_id': r.tower_id,
-            'timestamp': r.timestamp.isoformat(),
-            'duration': r.call_duration,
-            'type': r.call_type,
-            'connected_number': r.connected_number,
-            'location': {'lat': r.tower.latitude, 'lng': r.tower.longitude}
-        } for r in results])
+        query = build_search_query(search_params)
+
+        if search_params.get('stream') or request.args.get('format') == 'ndjson':
+            # Rows are pulled from a server-side cursor and written as they arrive
+            records = query.execution_options(stream_results=True).yield_per(1000)
+
+            def generate():
+                for r in records:
+                    yield json.dumps(serialize_record(r)) + '\n'
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        limit = max(1, min(int(search_params.get('limit', SEARCH_PAGE_SIZE)), SEARCH_MAX_PAGE_SIZE))
+        if search_params.get('cursor'):
+            try:
+                after = decode_cursor(search_params['cursor'])
+            except (ValueError, TypeError):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.filter(tuple_(TowerRecord.timestamp, TowerRecord.id) > after)
+
+        # Fetch one extra row to learn whether another page exists
+        results = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor(results[-1].timestamp, results[-1].id)
+
+        return jsonify({
+            'results': [serialize_record(r) for r in results],
+            'next_cursor': next_cursor
+        })
 
     except Exception as e:
         logging.error(f"Search error: {str(e)}")
         return jsonify({'error': 'Search failed'}), 500
 
+def movement_records(mobile_number, after=None):
+    """Coordinates and epoch seconds of a number's records in (timestamp, id) order after a key"""
+    query = db.session.query(
+        TowerRecord.timestamp, TowerRecord.id, CellTower.latitude, CellTower.longitude
+    ).join(CellTower, TowerRecord.tower_id == CellTower.id).filter(TowerRecord.mobile_number == mobile_number)
+    if after is not None:
+        query = query.filter(tuple_(TowerRecord.timestamp, TowerRecord.id) > after)
+    rows = query.order_by(TowerRecord.timestamp, TowerRecord.id).all()
+
+    coordinates = np.array([[row.latitude, row.longitude] for row in rows], dtype=float).reshape(-1, 2)
+    # Naive stored timestamps are UTC; same epoch conversion as the upload path, whatever the host TZ
+    timestamps = np.array([row.timestamp for row in rows], dtype='datetime64[s]').astype(np.int64)
+    last_key = (rows[-1].timestamp, rows[-1].id) if rows else after
+    return coordinates, timestamps, last_key
+
 @app.route('/api/analyze/movement', methods=['POST'])
 def analyze_movement():
     try:
         data = request.json
         mobile_number = data.get('mobile_number')
 
-        # Get movement data from database
-        records = TowerRecord.query.filter_by(mobile_number=mobile_number).order_by(TowerRecord.timestamp).all()
-
-        if not records:
-            return jsonify({'error': 'No data found'}), 404
+        # Unchanged subscribers are served from the cache; otherwise only records
+        # after the cached detector state are read and folded in
+        stats = db.session.get(SubscriberStats, mobile_number)
 
-        # Prepare data for analysis
-        coordinates = np.array([[r.tower.latitude, r.tower.longitude] for r in records])
-        timestamps = np.array([int(r.timestamp.timestamp()) for r in records])
+        def compute():
+            analysis, latest_location = movement_analyzer.analyze_subscriber(
+                mobile_number,
+                lambda after: movement_records(mobile_number, after),
+                expected_count=stats.record_count if stats else None
+            )
+            return {'analysis': analysis, 'latest_location': latest_location} if analysis else None
 
-        # Perform movement pattern analysis
-        analysis = movement_analyzer.analyze_movement_patterns(coordinates, timestamps)
+        cached, _ = analysis_cache.get_or_compute('movement', mobile_number, movement_analyzer.VERSION, stats, compute)
+        if cached is None:
+            return jsonify({'error': 'No data found'}), 404
+        analysis = cached['analysis']
+        latest_location = cached['latest_location']
 
         # Get nearby towers using API
-        if len(coordinates) > 0:
-            latest_location = coordinates[-1]
-            nearby_towers = tower_api.get_nearby_towers(latest_location[0], latest_location[1])
-        else:
-            nearby_towers = []
+        nearby_towers = tower_api.get_nearby_towers(latest_location[0], latest_location[1])
 
         return jsonify({
             'movement_analysis': analysis,
@@ -304,78 +520,130 @@ def analyze_movement():
 
 @app.route('/api/predict/location', methods=['POST'])
 def predict_location():
+    """Most likely next towers from the subscriber's latest tower, from the Markov transition model"""
     try:
         data = request.json
         mobile_number = data.get('mobile_number')
+        k = max(1, min(int(data.get('k', 3)), 20))
 
-        # Get recent movement history
-        records = TowerRecord.query.filter_by(mobile_number=mobile_number)\
-            .order_by(TowerRecord.timestamp.desc())\
-            .limit(24)\
-            .all()
+        stats = db.session.get(SubscriberStats, mobile_number)
+        if stats is None or stats.last_tower_id is None:
+            return jsonify({'error': 'No data found'}), 404
 
-        if len(records) < 24:
+        hour = stats.last_seen.hour if data.get('by_hour', True) else None
+        prediction = next_tower_model.predict(mobile_number, stats.last_tower_id, hour, k)
+        if prediction is None:
             return jsonify({'error': 'Insufficient data for prediction'}), 400
 
-        # Prepare movement history
-        movement_history = np.array([[r.tower.latitude, r.tower.longitude] for r in records[::-1]])
-        movement_history = movement_history.reshape(1, 24, 2)
-
-        # Predict next location
-        prediction = predictive_analysis.predict_next_location(movement_history)
-
-        return jsonify(prediction)
+        current = db.session.get(CellTower, stats.last_tower_id)
+        return jsonify({
+            'current_tower': {'tower_id': current.tower_id, 'latitude': current.latitude, 'longitude': current.longitude},
+            'last_seen': stats.last_seen.isoformat(),
+            **prediction
+        })
 
     except Exception as e:
         logger.error(f"Error predicting location: {str(e)}")
         return jsonify({'error': 'Prediction failed'}), 500
 
+@app.route('/api/colocation', methods=['POST'])
+def colocation():
+    """Rank numbers seen on the target's towers within +/- window_minutes of it"""
+    try:
+        data = request.json or {}
+        mobile_number = data.get('mobile_number')
+        if not mobile_number:
+            return jsonify({'error': 'mobile_number is required'}), 400
+        try:
+            window_minutes = float(data.get('window_minutes', 15))
+            limit = max(1, min(int(data.get('limit', 50)), 1000))
+            min_count = max(1, int(data.get('min_count', 1)))
+            start = datetime.fromisoformat(data['start_date']) if data.get('start_date') else None
+            end = datetime.fromisoformat(data['end_date']) if data.get('end_date') else None
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid parameters'}), 400
+        if window_minutes <= 0:
+            return jsonify({'error': 'window_minutes must be positive'}), 400
+
+        return jsonify(find_colocations(mobile_number, window_minutes, start, end, limit, min_count))
+    except Exception as e:
+        logger.error(f"Co-location error: {str(e)}")
+        return jsonify({'error': 'Co-location analysis failed'}), 500
+
+@app.route('/api/towers/presence', methods=['POST'])
+def tower_presence():
+    """Numbers matching a boolean expression over tower-day presence, e.g.
+    {"and": [{"tower": "A", "date": "2024-01-01"}, {"tower": "B", "date": "2024-01-03"}, {"not": {"tower": "C"}}]}
+    """
+    try:
+        data = request.json or {}
+        limit = max(0, min(int(data.get('limit', 1000)), 100000))
+        try:
+            matched = evaluate(data.get('expression'))
+        except (ValueError, TypeError, KeyError) as e:
+            return jsonify({'error': f"Invalid expression: {str(e)}"}), 400
+
+        ids = matched.to_array()
+        return jsonify({
+            'count': int(len(ids)),
+            'mobile_numbers': subscriber_numbers(ids[:limit].tolist()),
+            'truncated': bool(len(ids) > limit)
+        })
+    except Exception as e:
+        logger.error(f"Tower presence query error: {str(e)}")
+        return jsonify({'error': 'Presence query failed'}), 500
+
+@app.route('/api/archive/analyze', methods=['POST'])
+def analyze_archive():
+    """Run the upload analysis over archived records without re-uploading them"""
+    try:
+        data = request.json or {}
+        result = data_processor.process_archive(
+            cdr_archive,
+            start=data.get('start_date'),
+            end=data.get('end_date'),
+            mobile_numbers=data.get('mobile_numbers'),
+            include_patterns=bool(data.get('include_patterns'))
+        )
+        return jsonify({
+            'statistics': result['stats'],
+            'network_analysis': result['network_analysis'],
+            'patterns': result['patterns'] if data.get('include_patterns') else None
+        })
+    except Exception as e:
+        logger.error(f"Archive analysis error: {str(e)}")
+        return jsonify({'error': 'Archive analysis failed'}), 500
+
 @app.route('/api/detect/anomalies', methods=['POST'])
 def detect_anomalies():
     try:
         data = request.json
         mobile_numbers = data.get('mobile_numbers', [])
 
-        results = []
-        for number in mobile_numbers:
-            # Get user activity data
-            records = TowerRecord.query.filter_by(mobile_number=number).all()
-            if not records:
-                continue
-
-            # Calculate features
-            tower_count = db.session.query(func.count(distinct(TowerRecord.tower_id)))\
-                .filter(TowerRecord.mobile_number == number).scalar()
-            total_records = len(records)
-            avg_duration = db.session.query(func.avg(TowerRecord.call_duration))\
-                .filter(TowerRecord.mobile_number == number).scalar() or 0
-            max_duration = db.session.query(func.max(TowerRecord.call_duration))\
-                .filter(TowerRecord.mobile_number == number).scalar() or 0
-            contact_count = db.session.query(func.count(distinct(TowerRecord.connected_number)))\
-                .filter(TowerRecord.mobile_number == number).scalar()
-
-            features = np.array([[
-                tower_count,
-                total_records,
-                avg_duration,
-                max_duration,
-                contact_count
-            ]])
-
-            # Detect anomalies
-            is_anomaly = bool(anomaly_detector.detect_anomalies(features)[0])
-
-            results.append({
-                'mobile_number': number,
-                'is_anomaly': is_anomaly,
-                'features': {
-                    'tower_count': int(tower_count),
-                    'total_records': int(total_records),
-                    'avg_call_duration': float(avg_duration),
-                    'max_call_duration': float(max_duration),
-                    'contact_count': int(contact_count)
-                }
-            })
+        # Lifetime features from the subscriber_stats rollup, the same source the model is fitted on
+        feature_map = subscriber_features(mobile_numbers)
+        numbers = [number for number in dict.fromkeys(mobile_numbers) if number in feature_map]
+        feature_rows = [feature_map[number] for number in numbers]
+
+        if not numbers:
+            return jsonify({'results': []})
+
+        # Score every number against the population model in one pass
+        features = np.array(feature_rows, dtype=float)
+        ensure_anomaly_model()
+        is_anomaly = anomaly_detector.detect_anomalies(features)
+
+        results = [{
+            'mobile_number': number,
+            'is_anomaly': bool(flag),
+            'features': {
+                'tower_count': int(row[0]),
+                'total_records': int(row[1]),
+                'avg_call_duration': float(row[2]),
+                'max_call_duration': float(row[3]),
+                'contact_count': int(row[4])
+            }
+        } for number, flag, row in zip(numbers, is_anomaly, features)]
 
         return jsonify({'results': results})
 
@@ -383,5 +651,118 @@ def detect_anomalies():
         logger.error(f"Error detecting anomalies: {str(e)}")
         return jsonify({'error': 'Anomaly detection failed'}), 500
 
+@app.route('/api/detect/travel', methods=['POST'])
+def detect_travel():
+    """Impossible-travel jumps flagged at ingest, fastest first"""
+    try:
+        data = request.json or {}
+        try:
+            mobile_numbers = data.get('mobile_numbers') or ([data['mobile_number']] if data.get('mobile_number') else [])
+            min_speed = float(data['min_speed_kmh']) if data.get('min_speed_kmh') is not None else None
+            limit = max(1, min(int(data.get('limit', 100)), 10000))
+            start = datetime.fromisoformat(data['start_date']) if data.get('start_date') else None
+            end = datetime.fromisoformat(data['end_date']) if data.get('end_date') else None
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid parameters'}), 400
+
+        from_tower, to_tower = aliased(CellTower), aliased(CellTower)
+        query = db.session.query(TravelAnomaly, Subscriber.mobile_number, from_tower.tower_id, to_tower.tower_id)\
+            .join(Subscriber, Subscriber.id == TravelAnomaly.subscriber_id)\
+            .join(from_tower, from_tower.id == TravelAnomaly.from_tower_id)\
+            .join(to_tower, to_tower.id == TravelAnomaly.to_tower_id)
+        if mobile_numbers:
+            query = query.filter(Subscriber.mobile_number.in_(mobile_numbers))
+        if data.get('severity'):
+            query = query.filter(TravelAnomaly.severity == data['severity'])
+        if min_speed is not None:
+            query = query.filter(TravelAnomaly.speed_kmh >= min_speed)
+        if start is not None:
+            query = query.filter(TravelAnomaly.arrived_at >= start)
+        if end is not None:
+            query = query.filter(TravelAnomaly.arrived_at <= end)
+
+        results = [{
+            'mobile_number': mobile_number,
+            'from_tower': from_tower_id,
+            'to_tower': to_tower_id,
+            'departed_at': anomaly.departed_at.isoformat(),
+            'arrived_at': anomaly.arrived_at.isoformat(),
+            'distance_km': round(anomaly.distance_m / 1000, 3),
+            'speed_kmh': round(anomaly.speed_kmh, 1),
+            'severity': anomaly.severity
+        } for anomaly, mobile_number, from_tower_id, to_tower_id in
+            query.order_by(TravelAnomaly.speed_kmh.desc()).limit(limit).all()]
+
+        return jsonify({'results': results})
+
+    except Exception as e:
+        logger.error(f"Error detecting impossible travel: {str(e)}")
+        return jsonify({'error': 'Travel anomaly detection failed'}), 500
+
+@app.cli.command('rebuild-subscriber-stats')
+def rebuild_subscriber_stats_command():
+    """Recompute the subscriber_stats rollup from tower_records"""
+    rebuilt = rebuild_subscriber_stats()
+    click.echo(f"Rebuilt stats for {rebuilt} subscribers")
+
+@app.cli.command('rebuild-tower-bitmaps')
+def rebuild_tower_bitmaps_command():
+    """Recompute the per tower-day subscriber bitmaps from tower_records"""
+    rebuilt = rebuild_tower_bitmaps()
+    click.echo(f"Rebuilt {rebuilt} tower-day bitmaps")
+
+@app.cli.command('rebuild-tower-transitions')
+def rebuild_tower_transitions_command():
+    """Recount the next-tower transition matrices from tower_records"""
+    rebuilt = rebuild_tower_transitions()
+    click.echo(f"Rebuilt {rebuilt} tower transitions")
+
+@app.cli.command('rebuild-travel-anomalies')
+def rebuild_travel_anomalies_command():
+    """Re-run impossible-travel detection over tower_records with the current speed thresholds"""
+    flagged = rebuild_travel_anomalies()
+    click.echo(f"Flagged {flagged} travel anomalies")
+
+@app.cli.command('fit-anomaly-model')
+def fit_anomaly_model_command():
+    """Refit the anomaly model on every subscriber in subscriber_stats, e.g. nightly from cron"""
+    fitted = fit_anomaly_model()
+    click.echo(f"Fitted anomaly model on {fitted} subscribers" if fitted else "Too few subscribers to fit")
+
+@app.cli.command('prune-records')
+@click.option('--days', type=int, default=int(os.environ.get('RECORD_RETENTION_DAYS', 365)),
+              help='Keep records newer than this many days')
+def prune_records_command(days):
+    """Apply the record retention policy, dropping expired monthly partitions
+
+    On PostgreSQL a tower_records table created before partitioning is not converted;
+    its expired rows are deleted one by one and a warning is logged.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    result = prune_records(cutoff)
+    # Rows derived from the removed history go with it, committed before the rollups are rebuilt
+    TowerDayBitmap.query.filter(TowerDayBitmap.day < cutoff.date()).delete(synchronize_session=False)
+    TravelAnomaly.query.filter(TravelAnomaly.departed_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    # Rollups, bitmaps, map aggregates and cached analyses still count the removed history
+    rebuild_subscriber_stats()
+    rebuild_tower_stats()
+    rebuild_tower_bitmaps(cutoff.date(), cutoff.date())
+    rebuild_tower_transitions()
+    archived_days = cdr_archive.prune(cutoff)
+    tower_grid.invalidate()
+    # Cached results and the detector states they were folded from both cover the removed records
+    analysis_cache.clear()
+    movement_analyzer.clear()
+    click.echo(f"Dropped {len(result['dropped_partitions'])} partitions, deleted {result['deleted_rows']} rows, "
+               f"removed {archived_days} archived days")
+
+@app.cli.command('import-opencellid')
+@click.argument('csv_path')
+def import_opencellid(csv_path):
+    """Load an OpenCelliD export so tower lookups can be served offline"""
+    imported = tower_api.cache.import_opencellid(csv_path)
+    click.echo(f"Imported {imported} cells")
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
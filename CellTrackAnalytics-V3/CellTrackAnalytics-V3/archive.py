@@ -0,0 +1,207 @@
+import logging
+import os
+import shutil
+import uuid
+from datetime import date, datetime
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+ARCHIVE_COLUMNS = [
+    'mobile_number', 'imei', 'timestamp', 'tower_id', 'latitude', 'longitude',
+    'call_duration', 'call_type', 'connected_number', 'ip_address'
+]
+
+# Column subsets the readers project, so scans only decode what they use
+PROCESSING_COLUMNS = [
+    'mobile_number', 'timestamp', 'tower_id', 'latitude', 'longitude',
+    'call_duration', 'call_type', 'connected_number'
+]
+
+HASH_BUCKETS = 8
+
+# Committed chunks are buffered up to this many rows per write, to avoid many tiny files
+FLUSH_ROWS = 500000
+
+
+def _schema():
+    return pa.schema([
+        ('mobile_number', pa.string()),
+        ('imei', pa.string()),
+        ('timestamp', pa.timestamp('us')),
+        ('tower_id', pa.string()),
+        ('latitude', pa.float64()),
+        ('longitude', pa.float64()),
+        ('call_duration', pa.int64()),
+        ('call_type', pa.string()),
+        ('connected_number', pa.string()),
+        ('ip_address', pa.string()),
+    ])
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([('date', pa.date32()), ('bucket', pa.int16())]), flavor='hive')
+
+
+def number_buckets(numbers, buckets: int = HASH_BUCKETS) -> np.ndarray:
+    """Stable hash bucket per mobile number, used both for writing and for pruning reads"""
+    hashes = pd.util.hash_pandas_object(pd.Series(numbers, dtype=object).astype(str), index=False)
+    return (hashes.to_numpy() % np.uint64(buckets)).astype(np.int16)
+
+
+class CDRArchive:
+    """Parquet dataset of ingested records, partitioned by day and hashed mobile number"""
+
+    def __init__(self, root: str, buckets: int = HASH_BUCKETS):
+        self.root = root
+        self.buckets = buckets
+
+    def writer(self) -> 'ArchiveWriter':
+        return ArchiveWriter(self)
+
+    def write(self, frame: pd.DataFrame):
+        """Append a frame of validated records as new Parquet files"""
+        if frame.empty:
+            return
+        frame = frame.reindex(columns=ARCHIVE_COLUMNS)
+        table = pa.Table.from_pandas(frame.assign(
+            timestamp=pd.to_datetime(frame['timestamp']),
+            call_duration=pd.to_numeric(frame['call_duration'], errors='coerce').round().astype('Int64')
+        ), schema=_schema(), preserve_index=False)
+        table = table.append_column('date', pa.array(pd.to_datetime(frame['timestamp']).dt.date, pa.date32()))
+        table = table.append_column('bucket', pa.array(number_buckets(frame['mobile_number'], self.buckets)))
+
+        os.makedirs(self.root, exist_ok=True)
+        ds.write_dataset(
+            table, self.root,
+            format='parquet',
+            partitioning=_partitioning(),
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore',
+            max_rows_per_group=128 * 1024
+        )
+
+    def dataset(self):
+        # Memory-mapped reads avoid copying column chunks through a file buffer
+        return ds.dataset(
+            self.root, format='parquet', partitioning=_partitioning(),
+            filesystem=fs.LocalFileSystem(use_mmap=True)
+        )
+
+    def _filter(self, start: Optional[datetime], end: Optional[datetime], mobile_numbers: Optional[List[str]],
+                tower_ids: Optional[List[str]], buckets: Optional[List[int]] = None):
+        # Partition columns prune whole directories; the row predicates use row-group statistics
+        conditions = []
+        if start is not None:
+            start = pd.Timestamp(start)
+            conditions += [ds.field('date') >= start.date(), ds.field('timestamp') >= start.to_pydatetime()]
+        if end is not None:
+            end = pd.Timestamp(end)
+            conditions += [ds.field('date') <= end.date(), ds.field('timestamp') <= end.to_pydatetime()]
+        if mobile_numbers is not None:
+            buckets = np.unique(number_buckets(mobile_numbers, self.buckets)).tolist()
+            conditions += [ds.field('bucket').isin(buckets),
+                           ds.field('mobile_number').isin([str(number) for number in mobile_numbers])]
+        if tower_ids is not None:
+            conditions.append(ds.field('tower_id').isin([str(tower_id) for tower_id in tower_ids]))
+        if buckets is not None:
+            conditions.append(ds.field('bucket').isin(buckets))
+
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def scan_batches(self, columns: Optional[List[str]] = None, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, mobile_numbers: Optional[List[str]] = None,
+                     tower_ids: Optional[List[str]] = None, buckets: Optional[List[int]] = None
+                     ) -> Iterator[pd.DataFrame]:
+        """Yield the requested columns of the matching records one record batch at a time
+
+        Every record of a number is in the same hash bucket, so scanning bucket by bucket
+        sees each number's complete history while holding only part of the range.
+        """
+        if not os.path.isdir(self.root):
+            return
+        scanner = self.dataset().scanner(
+            columns=columns or ARCHIVE_COLUMNS, filter=self._filter(start, end, mobile_numbers, tower_ids, buckets)
+        )
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+    def prune(self, cutoff: datetime) -> int:
+        """Remove archived records older than the cutoff, deleting whole day partitions where possible
+
+        Returns the number of day partitions deleted.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = pd.Timestamp(cutoff)
+        removed = 0
+        for name in os.listdir(self.root):
+            key, _, value = name.partition('=')
+            if key != 'date':
+                continue
+            day = date.fromisoformat(value)
+            if day < cutoff.date():
+                shutil.rmtree(os.path.join(self.root, name))
+                removed += 1
+            elif day == cutoff.date() and cutoff != cutoff.normalize():
+                self._trim_day(os.path.join(self.root, name), day, cutoff)
+        return removed
+
+    def _trim_day(self, path: str, day: date, cutoff: pd.Timestamp):
+        # The kept records are rewritten as new files before the day's old files are removed
+        old_files = [os.path.join(directory, name) for directory, _, names in os.walk(path) for name in names]
+        kept = self.dataset().to_table(
+            columns=ARCHIVE_COLUMNS,
+            filter=(ds.field('date') == day) & (ds.field('timestamp') >= cutoff.to_pydatetime())
+        ).to_pandas()
+        if kept.empty:
+            shutil.rmtree(path)
+            return
+        self.write(kept)
+        for old_file in old_files:
+            os.remove(old_file)
+
+
+class ArchiveWriter:
+    """Buffers committed ingest chunks and writes them to the archive in large batches"""
+
+    def __init__(self, archive: CDRArchive, flush_rows: int = FLUSH_ROWS):
+        self.archive = archive
+        self.flush_rows = flush_rows
+        self.pending: List[pd.DataFrame] = []
+        self.pending_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # Everything buffered was already committed to the database, so flush even on error
+        self.flush()
+
+    def write(self, frame: pd.DataFrame):
+        self.pending.append(frame.reindex(columns=ARCHIVE_COLUMNS))
+        self.pending_rows += len(frame)
+        if self.pending_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            self.archive.write(pd.concat(self.pending, ignore_index=True))
+        except Exception as e:
+            logging.error(f"Error writing CDR archive: {str(e)}")
+        self.pending = []
+        self.pending_rows = 0
+
+
+# Initialize global instance
+cdr_archive = CDRArchive(root=os.environ.get('CDR_ARCHIVE_PATH', '/tmp/cdr_archive'))
@@ -0,0 +1,254 @@
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app import db
+from models import CellTower, Subscriber, TowerDayBitmap
+
+# Containers hold the low 16 bits of ids sharing the same high 16 bits
+CONTAINER_SIZE = 1 << 16
+# Above this many members a container is stored as a 2^16-bit bitmap instead of a sorted array
+ARRAY_MAX = 4096
+BITMAP_WORDS = CONTAINER_SIZE // 64
+
+ARRAY_KIND, BITMAP_KIND = 0, 1
+
+
+def _to_words(container: np.ndarray) -> np.ndarray:
+    if container.dtype == np.uint64:
+        return container
+    words = np.zeros(BITMAP_WORDS, dtype=np.uint64)
+    values = container.astype(np.uint64)
+    np.bitwise_or.at(words, values >> np.uint64(6), np.uint64(1) << (values & np.uint64(63)))
+    return words
+
+
+def _to_values(container: np.ndarray) -> np.ndarray:
+    if container.dtype == np.uint16:
+        return container
+    bits = np.unpackbits(container.astype('<u8').view(np.uint8), bitorder='little')
+    return np.flatnonzero(bits).astype(np.uint16)
+
+
+def _contains(words: np.ndarray, values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.uint64)
+    return ((words[values >> np.uint64(6)] >> (values & np.uint64(63))) & np.uint64(1)) == 1
+
+
+def _cardinality(container: np.ndarray) -> int:
+    if container.dtype == np.uint16:
+        return len(container)
+    return int(np.unpackbits(container.astype('<u8').view(np.uint8)).sum())
+
+
+def _compact(container: np.ndarray) -> Optional[np.ndarray]:
+    """Pick the smaller representation; None for an empty container"""
+    count = _cardinality(container)
+    if count == 0:
+        return None
+    if container.dtype == np.uint64 and count <= ARRAY_MAX:
+        return _to_values(container)
+    if container.dtype == np.uint16 and count > ARRAY_MAX:
+        return _to_words(container)
+    return container
+
+
+class RoaringBitmap:
+    """Compressed set of 32-bit ids, split into sorted-array or bitmap containers by high 16 bits
+
+    Follows the roaring layout (without run containers) so sparse and dense id ranges both
+    stay small and set operations work container by container.
+    """
+
+    def __init__(self, containers: Optional[Dict[int, np.ndarray]] = None):
+        self.containers: Dict[int, np.ndarray] = containers or {}
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int]) -> 'RoaringBitmap':
+        ids = np.unique(np.asarray(ids if isinstance(ids, np.ndarray) else list(ids), dtype=np.int64)).astype(np.uint32)
+        if len(ids) == 0:
+            return cls()
+        high = ids >> 16
+        if high[0] == high[-1]:
+            return cls({int(high[0]): _compact((ids & 0xFFFF).astype(np.uint16))})
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(high)) + 1])
+        ends = np.append(starts[1:], len(ids))
+        containers = {}
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            containers[int(high[start])] = _compact((ids[start:end] & 0xFFFF).astype(np.uint16))
+        return cls(containers)
+
+    def to_array(self) -> np.ndarray:
+        if not self.containers:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([
+            (key << 16) + _to_values(self.containers[key]).astype(np.int64) for key in sorted(self.containers)
+        ])
+
+    def __len__(self) -> int:
+        return sum(_cardinality(container) for container in self.containers.values())
+
+    def __contains__(self, value: int) -> bool:
+        container = self.containers.get(value >> 16)
+        if container is None:
+            return False
+        low = np.array([value & 0xFFFF], dtype=np.uint16)
+        if container.dtype == np.uint64:
+            return bool(_contains(container, low)[0])
+        position = np.searchsorted(container, low[0])
+        return bool(position < len(container) and container[position] == low[0])
+
+    def __or__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        containers = dict(self.containers)
+        for key, theirs in other.containers.items():
+            ours = containers.get(key)
+            if ours is None:
+                containers[key] = theirs
+            elif ours.dtype == np.uint16 and theirs.dtype == np.uint16:
+                containers[key] = _compact(np.union1d(ours, theirs))
+            else:
+                containers[key] = _compact(_to_words(ours) | _to_words(theirs))
+        return RoaringBitmap(containers)
+
+    def __and__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        containers = {}
+        for key in self.containers.keys() & other.containers.keys():
+            ours, theirs = self.containers[key], other.containers[key]
+            if ours.dtype == np.uint16 and theirs.dtype == np.uint16:
+                result = np.intersect1d(ours, theirs, assume_unique=True)
+            elif ours.dtype == np.uint16:
+                result = ours[_contains(theirs, ours)]
+            elif theirs.dtype == np.uint16:
+                result = theirs[_contains(ours, theirs)]
+            else:
+                result = ours & theirs
+            result = _compact(result)
+            if result is not None:
+                containers[key] = result
+        return RoaringBitmap(containers)
+
+    def __sub__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        containers = {}
+        for key, ours in self.containers.items():
+            theirs = other.containers.get(key)
+            if theirs is None:
+                result = ours
+            elif ours.dtype == np.uint16 and theirs.dtype == np.uint16:
+                result = np.setdiff1d(ours, theirs, assume_unique=True)
+            elif ours.dtype == np.uint16:
+                result = ours[~_contains(theirs, ours)]
+            else:
+                result = ours & ~_to_words(theirs)
+            result = _compact(result)
+            if result is not None:
+                containers[key] = result
+        return RoaringBitmap(containers)
+
+    def serialize(self) -> bytes:
+        """Per container: key, kind and length as little-endian uint32, then the container data"""
+        parts = []
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            kind = ARRAY_KIND if container.dtype == np.uint16 else BITMAP_KIND
+            parts.append(np.array([key, kind, len(container)], dtype='<u4').tobytes())
+            parts.append(container.astype('<u2' if kind == ARRAY_KIND else '<u8').tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def deserialize(cls, data: bytes) -> 'RoaringBitmap':
+        containers = {}
+        offset = 0
+        while offset < len(data):
+            key, kind, length = np.frombuffer(data, dtype='<u4', count=3, offset=offset).tolist()
+            offset += 12
+            dtype, width = ('<u2', 2) if kind == ARRAY_KIND else ('<u8', 8)
+            values = np.frombuffer(data, dtype=dtype, count=length, offset=offset)
+            containers[key] = values.astype(np.uint16 if kind == ARRAY_KIND else np.uint64)
+            offset += length * width
+        return cls(containers)
+
+
+def _parse_day(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    return value if isinstance(value, date) else datetime.fromisoformat(str(value)).date()
+
+
+def tower_bitmap(tower_id: str, start=None, end=None) -> RoaringBitmap:
+    """Subscribers seen on a tower on any day in [start, end]; no dates means every day"""
+    tower = CellTower.query.filter_by(tower_id=str(tower_id)).first()
+    if tower is None:
+        raise ValueError(f"Unknown tower: {tower_id}")
+    query = db.session.query(TowerDayBitmap.bitmap).filter(TowerDayBitmap.tower_id == tower.id)
+    if start is not None:
+        query = query.filter(TowerDayBitmap.day >= _parse_day(start))
+    if end is not None:
+        query = query.filter(TowerDayBitmap.day <= _parse_day(end))
+
+    result = RoaringBitmap()
+    for (data,) in query.all():
+        result |= RoaringBitmap.deserialize(data)
+    return result
+
+
+def all_subscribers() -> RoaringBitmap:
+    return RoaringBitmap.from_ids([row[0] for row in db.session.query(Subscriber.id).all()])
+
+
+def evaluate(expression: Dict) -> RoaringBitmap:
+    """Evaluate a set expression of tower/day terms
+
+    Terms are {"tower": id, "date": day} or {"tower": id, "start_date": ..., "end_date": ...};
+    they combine with {"and": [...]}, {"or": [...]} and {"not": expr}. Inside "and", "not"
+    terms are subtracted from the others; elsewhere they are taken against every subscriber.
+    """
+    if not isinstance(expression, dict):
+        raise ValueError('Expression must be an object')
+
+    if 'and' in expression:
+        terms = expression['and']
+        if not terms:
+            raise ValueError('"and" needs at least one term')
+        included = [term for term in terms if not (isinstance(term, dict) and 'not' in term)]
+        excluded = [term['not'] for term in terms if isinstance(term, dict) and 'not' in term]
+        # Evaluate the smallest sets first so intersections shrink quickly
+        sets = sorted((evaluate(term) for term in included), key=len)
+        result = sets[0] if sets else all_subscribers()
+        for other in sets[1:]:
+            if not result.containers:
+                break
+            result &= other
+        for term in excluded:
+            if not result.containers:
+                break
+            result -= evaluate(term)
+        return result
+
+    if 'or' in expression:
+        result = RoaringBitmap()
+        for term in expression['or']:
+            result |= evaluate(term)
+        return result
+
+    if 'not' in expression:
+        return all_subscribers() - evaluate(expression['not'])
+
+    if 'tower' in expression:
+        if 'date' in expression:
+            return tower_bitmap(expression['tower'], expression['date'], expression['date'])
+        return tower_bitmap(expression['tower'], expression.get('start_date'), expression.get('end_date'))
+
+    raise ValueError(f"Unsupported expression: {sorted(expression)}")
+
+
+def subscriber_numbers(ids: List[int]) -> List[str]:
+    """Map subscriber ids back to mobile numbers, keeping the given order"""
+    numbers = {}
+    for start in range(0, len(ids), 1000):
+        numbers.update(
+            db.session.query(Subscriber.id, Subscriber.mobile_number)
+            .filter(Subscriber.id.in_(ids[start:start + 1000]))
+            .all()
+        )
+    return [numbers[subscriber_id] for subscriber_id in ids if subscriber_id in numbers]
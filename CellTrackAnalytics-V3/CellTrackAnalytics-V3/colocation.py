@@ -0,0 +1,127 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, or_
+
+from app import db
+from models import TowerRecord, Subscriber
+from bitmaps import subscriber_numbers
+
+# Tower/time ranges per candidate query; each becomes one (tower_id, timestamp) index range scan
+RANGES_PER_QUERY = 200
+
+
+def _epoch_seconds(values) -> np.ndarray:
+    return np.asarray(values, dtype='datetime64[s]').astype(np.int64)
+
+
+def _as_datetime(seconds: int) -> datetime:
+    return pd.Timestamp(seconds, unit='s').to_pydatetime()
+
+
+def merge_windows(towers: np.ndarray, seconds: np.ndarray, window: int) -> List[Tuple[int, int, int]]:
+    """Merge each target ping's [t - window, t + window] into disjoint (tower, start, end) ranges"""
+    order = np.lexsort((seconds, towers))
+    towers, seconds = towers[order], seconds[order]
+    # A new range starts at a new tower or where the gap to the previous ping exceeds both windows
+    breaks = np.r_[True, (towers[1:] != towers[:-1]) | (np.diff(seconds) > 2 * window)]
+    starts = np.flatnonzero(breaks)
+    ends = np.r_[starts[1:], len(seconds)] - 1
+    return list(zip(towers[starts].tolist(), (seconds[starts] - window).tolist(), (seconds[ends] + window).tolist()))
+
+
+def sweep(target_towers: np.ndarray, target_seconds: np.ndarray, towers: np.ndarray, seconds: np.ndarray,
+          window: int) -> np.ndarray:
+    """Gap in seconds to the nearest target ping on the same tower, or -1 when none is within window
+
+    Both sides are mapped onto one sorted (tower, time) key axis, so every candidate finds its
+    neighbours with a binary search instead of a self-join.
+    """
+    if len(seconds) == 0 or len(target_seconds) == 0:
+        return np.full(len(seconds), -1, dtype=np.int64)
+
+    origin = min(target_seconds.min(), seconds.min())
+    # Wide enough that windows on different towers can never overlap
+    stride = int(max(target_seconds.max(), seconds.max()) - origin) + 2 * window + 1
+    tower_codes, _ = pd.factorize(np.concatenate([target_towers, towers]))
+    target_keys = np.sort(tower_codes[:len(target_towers)] * stride + (target_seconds - origin))
+    keys = tower_codes[len(target_towers):] * stride + (seconds - origin)
+
+    position = np.searchsorted(target_keys, keys)
+    after = np.abs(target_keys[np.minimum(position, len(target_keys) - 1)] - keys)
+    before = np.abs(keys - target_keys[np.maximum(position - 1, 0)])
+    gaps = np.minimum(after, before)
+    return np.where(gaps <= window, gaps, -1)
+
+
+def find_colocations(mobile_number: str, window_minutes: float = 15, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, limit: int = 50, min_count: int = 1) -> Dict:
+    """Rank numbers seen on the same tower as the target within +/- window_minutes"""
+    window = int(window_minutes * 60)
+    result = {'mobile_number': mobile_number, 'window_minutes': window_minutes,
+              'target_records': 0, 'towers_checked': 0, 'results': []}
+    subscriber = Subscriber.query.filter_by(mobile_number=mobile_number).first()
+    if subscriber is None:
+        return result
+
+    query = db.session.query(TowerRecord.tower_id, TowerRecord.timestamp)\
+        .filter(TowerRecord.subscriber_id == subscriber.id)
+    if start is not None:
+        query = query.filter(TowerRecord.timestamp >= start)
+    if end is not None:
+        query = query.filter(TowerRecord.timestamp <= end)
+    target = query.all()
+    result['target_records'] = len(target)
+    if not target:
+        return result
+
+    target_towers = np.array([row[0] for row in target], dtype=np.int64)
+    target_seconds = _epoch_seconds([row[1] for row in target])
+    ranges = merge_windows(target_towers, target_seconds, window)
+    result['towers_checked'] = len(np.unique(target_towers))
+
+    matches = []
+    for batch_start in range(0, len(ranges), RANGES_PER_QUERY):
+        conditions = [
+            and_(TowerRecord.tower_id == tower_id,
+                 TowerRecord.timestamp.between(_as_datetime(low), _as_datetime(high)))
+            for tower_id, low, high in ranges[batch_start:batch_start + RANGES_PER_QUERY]
+        ]
+        rows = db.session.query(TowerRecord.subscriber_id, TowerRecord.tower_id, TowerRecord.timestamp)\
+            .filter(or_(*conditions), TowerRecord.subscriber_id != subscriber.id).all()
+        if not rows:
+            continue
+
+        candidates = pd.DataFrame(rows, columns=['subscriber_id', 'tower_id', 'timestamp'])
+        gaps = sweep(target_towers, target_seconds, candidates['tower_id'].to_numpy(dtype=np.int64),
+                     _epoch_seconds(candidates['timestamp']), window)
+        matches.append(candidates.assign(gap=gaps)[gaps >= 0])
+
+    if not matches:
+        return result
+
+    matched = pd.concat(matches, ignore_index=True)
+    ranked = matched.groupby('subscriber_id').agg(
+        co_occurrences=('gap', 'size'),
+        towers=('tower_id', 'nunique'),
+        min_gap_seconds=('gap', 'min'),
+        first_seen=('timestamp', 'min'),
+        last_seen=('timestamp', 'max')
+    )
+    ranked = ranked[ranked['co_occurrences'] >= min_count]\
+        .sort_values(['co_occurrences', 'towers', 'min_gap_seconds'], ascending=[False, False, True])\
+        .head(limit)
+
+    # Numbers are only resolved for the ranked page
+    numbers = dict(zip(ranked.index.tolist(), subscriber_numbers(ranked.index.tolist())))
+    result['results'] = [{
+        'mobile_number': numbers[subscriber_id],
+        'co_occurrences': int(row.co_occurrences),
+        'towers': int(row.towers),
+        'min_gap_seconds': int(row.min_gap_seconds),
+        'first_seen': row.first_seen.isoformat(),
+        'last_seen': row.last_seen.isoformat()
+    } for subscriber_id, row in ranked.iterrows()]
+    return result
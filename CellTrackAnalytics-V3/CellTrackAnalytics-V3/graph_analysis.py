@@ -0,0 +1,92 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class ContactGraph:
+    """Undirected contact graph stored as a CSR adjacency index"""
+
+    def __init__(self, sources, targets, num_calls: Optional[int] = None):
+        """Build from call endpoints; num_calls overrides the call count when repeats were already collapsed"""
+        sources = np.asarray(sources)
+        targets = np.asarray(targets)
+        codes, numbers = pd.factorize(np.concatenate([sources, targets]))
+        self.numbers = numbers.tolist()
+        self.num_nodes = len(numbers)
+        self.num_calls = len(sources) if num_calls is None else num_calls
+
+        # Collapse repeated calls and both call directions into unique undirected pairs
+        src, dst = codes[:len(sources)].astype(np.int64), codes[len(sources):].astype(np.int64)
+        pair_keys = np.unique(np.minimum(src, dst) * self.num_nodes + np.maximum(src, dst))
+        self.edge_low, self.edge_high = np.divmod(pair_keys, self.num_nodes)
+
+        # Self-calls contribute a single adjacency entry rather than two
+        distinct = self.edge_low != self.edge_high
+        rows = np.concatenate([self.edge_low, self.edge_high[distinct]])
+        cols = np.concatenate([self.edge_high, self.edge_low[distinct]])
+        order = np.argsort(rows, kind='stable')
+        self.indices = cols[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=self.num_nodes))])
+        self.degrees = np.diff(self.indptr)
+
+    def neighbors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def connected_components(self) -> np.ndarray:
+        """Label every node with its component root using array-based union-find"""
+        parent = np.arange(self.num_nodes)
+        low, high = self.edge_low, self.edge_high
+        while True:
+            root_low, root_high = parent[low], parent[high]
+            pending = root_low != root_high
+            if not pending.any():
+                return parent
+
+            # Union: hook the larger root under the smaller one, so no cycles can form
+            np.minimum.at(parent, np.maximum(root_low, root_high)[pending], np.minimum(root_low, root_high)[pending])
+
+            # Find: pointer jumping until every node points straight at its root
+            while True:
+                grandparent = parent[parent]
+                if np.array_equal(grandparent, parent):
+                    break
+                parent = grandparent
+
+    def component_sizes(self) -> np.ndarray:
+        """Sizes of all components, largest first"""
+        counts = np.bincount(self.connected_components(), minlength=self.num_nodes)
+        return np.sort(counts[counts > 0])[::-1]
+
+    def degree_distribution(self) -> Dict[str, int]:
+        degrees, counts = np.unique(self.degrees, return_counts=True)
+        return {str(degree): int(count) for degree, count in zip(degrees.tolist(), counts.tolist())}
+
+    def top_hubs(self, k: int = 10) -> List[Dict]:
+        """Numbers with the most distinct contacts, highest degree first, ties in first-appearance order"""
+        k = min(k, self.num_nodes)
+        if k == 0:
+            return []
+        # Every node tied with the k-th degree stays a candidate, so ties are not cut arbitrarily
+        threshold = np.partition(self.degrees, self.num_nodes - k)[self.num_nodes - k]
+        candidates = np.flatnonzero(self.degrees >= threshold)
+        ranked = candidates[np.lexsort((candidates, -self.degrees[candidates]))][:k]
+        return [{'number': self.numbers[node], 'degree': int(self.degrees[node])} for node in ranked]
+
+    def summary(self, top_k: int = 10) -> Dict:
+        sizes = self.component_sizes()
+        hubs = self.top_hubs(top_k)
+        return {
+            'total_nodes': self.num_nodes,
+            'total_edges': self.num_calls,
+            'unique_connections': len(self.edge_low),
+            'avg_connections': float(self.degrees.mean()),
+            'most_connected': hubs[0]['number'],
+            'top_hubs': hubs,
+            'degree_distribution': self.degree_distribution(),
+            'connected_components': {
+                'count': len(sizes),
+                'largest': int(sizes[0]),
+                'sizes': sizes[:top_k].tolist()
+            }
+        }
@@ -0,0 +1,593 @@
+import io
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, func, or_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import aliased
+
+from app import db
+from models import (CellTower, TowerRecord, SubscriberStats, SubscriberTower, SubscriberContact, Subscriber,
+                    Device, TowerDayBitmap, TowerTransition, TravelAnomaly, TowerStats)
+from spatial_index import tower_grid, encode_geohash
+from partitions import ensure_partitions
+from archive import cdr_archive
+from analysis_cache import analysis_cache
+from readers import CDRReader, DEFAULT_CHUNK_SIZE
+from bitmaps import RoaringBitmap
+from markov import transition_counts
+from ai_models import speed_detector
+
+# Upload columns kept on the in-memory frame; numbers and IMEIs are stored as dimension keys
+SOURCE_COLUMNS = [
+    'mobile_number', 'imei', 'timestamp', 'tower_id', 'call_duration',
+    'call_type', 'connected_number', 'ip_address', 'created_at'
+]
+
+RECORD_COLUMNS = [
+    'subscriber_id', 'device_id', 'timestamp', 'tower_id', 'call_duration',
+    'call_type', 'connected_id', 'ip_address', 'created_at'
+]
+
+ProgressCallback = Callable[[Dict], None]
+
+
+def _batched(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _upsert_insert(table):
+    """Dialect INSERT supporting ON CONFLICT, or None where the backend has no upsert"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    return None
+
+
+def insert_ignore(table, rows: List[Dict], conflict_columns: List[str], returning: Optional[List[str]] = None):
+    """Insert rows, skipping those that collide with an existing unique key
+
+    With returning, the given columns of the rows actually inserted are returned.
+    """
+    if not rows:
+        return []
+    stmt = _upsert_insert(table)
+    stmt = table.insert() if stmt is None else stmt.on_conflict_do_nothing(index_elements=conflict_columns)
+    if returning:
+        return db.session.execute(stmt.returning(*[table.c[column] for column in returning]), rows).all()
+    db.session.execute(stmt, rows)
+    return []
+
+
+def upsert_add(table, rows: List[Dict], conflict_columns: List[str], add_columns: List[str]):
+    """Insert rows, adding add_columns onto the values of rows that already exist"""
+    if not rows:
+        return
+    stmt = _upsert_insert(table)
+    if stmt is None:
+        stmt = table.insert()
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: table.c[column] + stmt.excluded[column] for column in add_columns}
+        )
+    db.session.execute(stmt, rows)
+
+
+def _records(frame: pd.DataFrame) -> List[Dict]:
+    """Convert a frame to DB-API friendly dicts with NaN/NaT mapped to None"""
+    frame = frame.astype(object)
+    return frame.where(frame.notna(), None).to_dict('records')
+
+
+def _new_pair_counts(model, pairs: pd.DataFrame, conflict_columns: List[str]) -> pd.Series:
+    """Insert distinct pairs, counting per number only the pairs this call actually added"""
+    inserted = insert_ignore(model.__table__, _records(pairs.sort_values(conflict_columns)), conflict_columns,
+                             returning=['mobile_number'])
+    return pd.Series([row.mobile_number for row in inserted], dtype=object).value_counts()
+
+
+def update_subscriber_stats(frame: pd.DataFrame):
+    """Fold a chunk of inserted records (tower_id already mapped to cell_towers.id) into subscriber_stats"""
+    towers = frame[['mobile_number', 'tower_id']].dropna().drop_duplicates()
+    new_towers = _new_pair_counts(SubscriberTower, towers, ['mobile_number', 'tower_id'])
+    contacts = frame[['mobile_number', 'connected_number']].dropna().drop_duplicates()
+    new_contacts = _new_pair_counts(SubscriberContact, contacts, ['mobile_number', 'connected_number'])
+
+    chunk_stats = frame.assign(
+        call_duration=frame['call_duration'].to_numpy(dtype=float, na_value=np.nan)
+    ).sort_values('timestamp', kind='stable').groupby('mobile_number', observed=True).agg(
+        record_count=('timestamp', 'size'),
+        duration_sum=('call_duration', 'sum'),
+        duration_count=('call_duration', 'count'),
+        duration_max=('call_duration', 'max'),
+        first_seen=('timestamp', 'min'),
+        last_seen=('timestamp', 'max'),
+        last_tower_id=('tower_id', 'last')
+    )
+    # A categorical tower column would reject stored towers that are not in this chunk
+    chunk_stats['last_tower_id'] = chunk_stats['last_tower_id'].astype('Int64')
+    chunk_stats['tower_count'] = new_towers.reindex(chunk_stats.index, fill_value=0)
+    chunk_stats['contact_count'] = new_contacts.reindex(chunk_stats.index, fill_value=0)
+    chunk_stats[['record_count', 'duration_sum', 'duration_count', 'tower_count', 'contact_count']] = \
+        chunk_stats[['record_count', 'duration_sum', 'duration_count', 'tower_count', 'contact_count']].astype('int64')
+    chunk_stats['duration_max'] = chunk_stats['duration_max'].round().astype('Int64')
+    chunk_stats['updated_at'] = datetime.utcnow()
+    rows = _records(chunk_stats.reset_index())
+
+    table = SubscriberStats.__table__
+    stmt = _upsert_insert(table)
+    if stmt is None:
+        db.session.execute(table.insert(), rows)
+        return
+    # Merge in the database so concurrent ingests of the same numbers cannot race on new rows
+    greatest, least = (func.greatest, func.least) if db.engine.dialect.name == 'postgresql' else (func.max, func.min)
+    stored, incoming = table.c, stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['mobile_number'],
+        set_={
+            **{column: stored[column] + incoming[column] for column in
+               ['record_count', 'duration_sum', 'duration_count', 'tower_count', 'contact_count']},
+            'duration_max': greatest(func.coalesce(stored.duration_max, incoming.duration_max),
+                                     func.coalesce(incoming.duration_max, stored.duration_max)),
+            'first_seen': least(func.coalesce(stored.first_seen, incoming.first_seen),
+                                func.coalesce(incoming.first_seen, stored.first_seen)),
+            # Records older than the stored last_seen keep the stored last tower
+            'last_tower_id': case(
+                (or_(stored.last_seen.is_(None), incoming.last_seen >= stored.last_seen), incoming.last_tower_id),
+                else_=stored.last_tower_id
+            ),
+            'last_seen': greatest(func.coalesce(stored.last_seen, incoming.last_seen),
+                                  func.coalesce(incoming.last_seen, stored.last_seen)),
+            'updated_at': incoming.updated_at,
+        }
+    )
+    db.session.execute(stmt, rows)
+
+
+def rebuild_subscriber_stats() -> int:
+    """Recompute subscriber_stats and its pair tables from tower_records"""
+    SubscriberStats.query.delete()
+    SubscriberTower.query.delete()
+    SubscriberContact.query.delete()
+
+    # Distinct and grouped work runs on the integer keys; numbers are joined in once per row of output
+    tower_pairs = db.session.query(TowerRecord.subscriber_id, TowerRecord.tower_id)\
+        .filter(TowerRecord.tower_id.isnot(None)).distinct().subquery()
+    db.session.execute(SubscriberTower.__table__.insert().from_select(
+        ['mobile_number', 'tower_id'],
+        db.session.query(Subscriber.mobile_number, tower_pairs.c.tower_id)
+        .join(tower_pairs, tower_pairs.c.subscriber_id == Subscriber.id)
+    ))
+    contact = aliased(Subscriber)
+    contact_pairs = db.session.query(TowerRecord.subscriber_id, TowerRecord.connected_id)\
+        .filter(TowerRecord.connected_id.isnot(None)).distinct().subquery()
+    db.session.execute(SubscriberContact.__table__.insert().from_select(
+        ['mobile_number', 'connected_number'],
+        db.session.query(Subscriber.mobile_number, contact.mobile_number)
+        .join(contact_pairs, contact_pairs.c.subscriber_id == Subscriber.id)
+        .join(contact, contact.id == contact_pairs.c.connected_id)
+    ))
+
+    tower_counts = db.session.query(
+        SubscriberTower.mobile_number, func.count().label('n')
+    ).group_by(SubscriberTower.mobile_number).subquery()
+    contact_counts = db.session.query(
+        SubscriberContact.mobile_number, func.count().label('n')
+    ).group_by(SubscriberContact.mobile_number).subquery()
+    grouped = db.session.query(
+        TowerRecord.subscriber_id,
+        func.count().label('record_count'),
+        func.coalesce(func.sum(TowerRecord.call_duration), 0).label('duration_sum'),
+        func.count(TowerRecord.call_duration).label('duration_count'),
+        func.max(TowerRecord.call_duration).label('duration_max'),
+        func.min(TowerRecord.timestamp).label('first_seen'),
+        func.max(TowerRecord.timestamp).label('last_seen')
+    ).group_by(TowerRecord.subscriber_id).subquery()
+    totals = db.session.query(
+        Subscriber.mobile_number,
+        grouped.c.record_count, grouped.c.duration_sum, grouped.c.duration_count,
+        grouped.c.duration_max, grouped.c.first_seen, grouped.c.last_seen
+    ).join(grouped, grouped.c.subscriber_id == Subscriber.id).subquery()
+
+    db.session.execute(SubscriberStats.__table__.insert().from_select(
+        ['mobile_number', 'record_count', 'duration_sum', 'duration_count', 'duration_max',
+         'first_seen', 'last_seen', 'tower_count', 'contact_count', 'updated_at'],
+        db.session.query(
+            totals,
+            func.coalesce(tower_counts.c.n, 0),
+            func.coalesce(contact_counts.c.n, 0),
+            func.now()
+        ).outerjoin(tower_counts, tower_counts.c.mobile_number == totals.c.mobile_number)
+        .outerjoin(contact_counts, contact_counts.c.mobile_number == totals.c.mobile_number)
+    ))
+
+    # Latest record per subscriber, read backwards from idx_subscriber_timestamp
+    latest_tower = db.session.query(TowerRecord.tower_id)\
+        .join(Subscriber, Subscriber.id == TowerRecord.subscriber_id)\
+        .filter(Subscriber.mobile_number == SubscriberStats.mobile_number)\
+        .order_by(TowerRecord.timestamp.desc(), TowerRecord.id.desc())\
+        .limit(1).correlate(SubscriberStats).scalar_subquery()
+    SubscriberStats.query.update({SubscriberStats.last_tower_id: latest_tower}, synchronize_session=False)
+    db.session.commit()
+    return SubscriberStats.query.count()
+
+
+def update_tower_stats(frame: pd.DataFrame):
+    """Add a chunk's per-tower record counts onto tower_stats"""
+    counts = frame.groupby('tower_id', observed=True).size().reset_index(name='record_count')
+    upsert_add(TowerStats.__table__, _records(counts), ['tower_id'], ['record_count'])
+
+
+def rebuild_tower_stats() -> int:
+    """Recompute tower_stats from tower_records with one grouped aggregate"""
+    TowerStats.query.delete()
+    db.session.execute(TowerStats.__table__.insert().from_select(
+        ['tower_id', 'record_count'],
+        db.session.query(TowerRecord.tower_id, func.count()).group_by(TowerRecord.tower_id).statement
+    ))
+    db.session.commit()
+    return TowerStats.query.count()
+
+
+def dimension_ids(model, column: str, values: List[str]) -> Dict[str, int]:
+    """Surrogate keys of the given natural values, registering unseen ones in the dimension table"""
+    natural = getattr(model, column)
+    values = list(dict.fromkeys(str(value) for value in values))
+    ids = {}
+    for batch in _batched(values, 1000):
+        ids.update(db.session.query(natural, model.id).filter(natural.in_(batch)).all())
+
+    missing = [value for value in values if value not in ids]
+    insert_ignore(model.__table__, [{column: value} for value in missing], [column])
+    for batch in _batched(missing, 1000):
+        ids.update(db.session.query(natural, model.id).filter(natural.in_(batch)).all())
+    return ids
+
+
+def update_tower_bitmaps(frame: pd.DataFrame):
+    """OR the subscribers of a chunk (tower_id and subscriber_id already mapped) into their tower-day bitmaps"""
+    members = pd.DataFrame({
+        'tower_id': frame['tower_id'].to_numpy(dtype=np.int64),
+        'day': frame['timestamp'].dt.normalize().to_numpy(),
+        'subscriber_id': frame['subscriber_id'].to_numpy(dtype=np.int64)
+    }).drop_duplicates().sort_values(['tower_id', 'day'])
+    _merge_bitmaps(members)
+
+
+def _merge_bitmaps(members: pd.DataFrame):
+    """Fold (tower_id, day, subscriber_id) rows sorted by tower and day into tower_day_bitmaps"""
+    towers = members['tower_id'].to_numpy(dtype=np.int64)
+    days = members['day'].to_numpy().astype('datetime64[D]')
+    starts = np.flatnonzero(np.r_[True, (towers[1:] != towers[:-1]) | (days[1:] != days[:-1])])
+    ends = np.append(starts[1:], len(towers))
+    keys = list(zip(towers[starts].tolist(), days[starts].tolist()))
+    subscriber_column = members['subscriber_id'].to_numpy(dtype=np.int64)
+    positions = [slice(start, end) for start, end in zip(starts.tolist(), ends.tolist())]
+
+    for start in range(0, len(keys), 1000):
+        batch = keys[start:start + 1000]
+        # Claim missing tower-days with empty bitmaps, then lock them all so concurrent ingests serialize
+        empty = RoaringBitmap().serialize()
+        insert_ignore(TowerDayBitmap.__table__,
+                      [{'tower_id': tower, 'day': day, 'cardinality': 0, 'bitmap': empty} for tower, day in batch],
+                      ['tower_id', 'day'])
+        existing = dict(
+            ((row.tower_id, row.day), row.bitmap) for row in
+            db.session.query(TowerDayBitmap.tower_id, TowerDayBitmap.day, TowerDayBitmap.bitmap)
+            .filter(tuple_(TowerDayBitmap.tower_id, TowerDayBitmap.day).in_(batch))
+            .with_for_update()
+            .all()
+        )
+        updates = []
+        for key, position in zip(batch, positions[start:start + 1000]):
+            bitmap = RoaringBitmap.from_ids(subscriber_column[position]) | RoaringBitmap.deserialize(existing[key])
+            updates.append({'tower_id': key[0], 'day': key[1], 'cardinality': len(bitmap), 'bitmap': bitmap.serialize()})
+        db.session.bulk_update_mappings(TowerDayBitmap, updates)
+
+
+def rebuild_tower_bitmaps(start: Optional[date] = None, end: Optional[date] = None,
+                          batch_size: int = 500000) -> int:
+    """Recompute tower_day_bitmaps for days in [start, end] (all days by default) from tower_records"""
+    bitmaps = TowerDayBitmap.query
+    records = db.session.query(TowerRecord.tower_id, TowerRecord.timestamp, TowerRecord.subscriber_id)
+    if start is not None:
+        bitmaps = bitmaps.filter(TowerDayBitmap.day >= start)
+        records = records.filter(TowerRecord.timestamp >= datetime.combine(start, datetime.min.time()))
+    if end is not None:
+        bitmaps = bitmaps.filter(TowerDayBitmap.day <= end)
+        records = records.filter(TowerRecord.timestamp < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    bitmaps.delete(synchronize_session=False)
+
+    # Rows are streamed in batches so memory stays bounded on large tables
+    for rows in db.session.execute(records.statement.execution_options(yield_per=batch_size)).partitions():
+        _merge_bitmaps(_bitmap_members(rows))
+    db.session.commit()
+    return TowerDayBitmap.query.count()
+
+
+def _bitmap_members(rows: List) -> pd.DataFrame:
+    members = pd.DataFrame(rows, columns=['tower_id', 'timestamp', 'subscriber_id'])
+    members['day'] = pd.to_datetime(members.pop('timestamp')).dt.normalize()
+    return members.drop_duplicates().sort_values(['tower_id', 'day'])
+
+
+def previous_pings(frame: pd.DataFrame) -> pd.DataFrame:
+    """Each chunk subscriber's last stored ping (subscriber_id, tower_id, timestamp) from subscriber_stats
+
+    Read before update_subscriber_stats folds the chunk in, so it links the chunk to earlier loads.
+    """
+    numbers = frame[['mobile_number', 'subscriber_id']].drop_duplicates('mobile_number')
+    previous = []
+    for batch in _batched(numbers['mobile_number'].astype(str).tolist(), 1000):
+        previous.extend(
+            db.session.query(SubscriberStats.mobile_number, SubscriberStats.last_tower_id, SubscriberStats.last_seen)
+            .filter(SubscriberStats.mobile_number.in_(batch), SubscriberStats.last_tower_id.isnot(None))
+            .all()
+        )
+    previous = pd.DataFrame(previous, columns=['mobile_number', 'tower_id', 'timestamp'])
+    previous['subscriber_id'] = previous['mobile_number'].map(
+        dict(zip(numbers['mobile_number'].astype(str), numbers['subscriber_id']))
+    )
+    previous['timestamp'] = pd.to_datetime(previous['timestamp'])
+    return previous[['subscriber_id', 'tower_id', 'timestamp']]
+
+
+def _with_previous(frame: pd.DataFrame, previous: pd.DataFrame):
+    """Stack previous pings (uncounted) ahead of the chunk as numpy arrays"""
+    columns = ['subscriber_id', 'tower_id', 'timestamp']
+    stacked = pd.concat([previous[columns], frame[columns]], ignore_index=True)
+    counted = np.r_[np.zeros(len(previous), dtype=bool), np.ones(len(frame), dtype=bool)]
+    return stacked, counted
+
+
+def update_tower_transitions(frame: pd.DataFrame, previous: pd.DataFrame):
+    """Fold a chunk's tower-to-tower moves into tower_transitions
+
+    Each subscriber's previous ping links the chunk to earlier loads. Chunks older than that
+    (backfills) are linked approximately; rebuild_tower_transitions() recounts exactly.
+    """
+    stacked, counted = _with_previous(frame, previous)
+    counts = transition_counts(
+        stacked['subscriber_id'].to_numpy(dtype=np.int64), stacked['tower_id'].to_numpy(dtype=np.int64),
+        stacked['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64),
+        counted=counted
+    )
+    upsert_add(TowerTransition.__table__, _records(counts), ['subscriber_id', 'hour', 'from_tower_id', 'to_tower_id'],
+               ['moves'])
+
+
+def _tower_coordinates(tower_ids) -> pd.DataFrame:
+    """Stored latitude/longitude of cell_towers rows, indexed by id"""
+    tower_ids = pd.unique(np.asarray(tower_ids, dtype=np.int64)).tolist()
+    rows = []
+    for batch in _batched(tower_ids, 1000):
+        rows.extend(
+            db.session.query(CellTower.id, CellTower.latitude, CellTower.longitude)
+            .filter(CellTower.id.in_(batch))
+            .all()
+        )
+    return pd.DataFrame(rows, columns=['id', 'latitude', 'longitude']).set_index('id')
+
+
+def _insert_travel_anomalies(pings: pd.DataFrame, counted: np.ndarray) -> int:
+    """Run the speed detector over (subscriber_id, tower_id, timestamp, latitude, longitude) pings"""
+    jumps = speed_detector.detect(
+        pings['subscriber_id'].to_numpy(dtype=np.int64), pings['latitude'].to_numpy(dtype=float),
+        pings['longitude'].to_numpy(dtype=float), pings['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64),
+        counted=counted
+    )
+    if jumps.empty:
+        return 0
+
+    origin = pings.iloc[jumps['origin'].to_numpy(dtype=np.int64)]
+    arrival = pings.iloc[jumps['position'].to_numpy(dtype=np.int64)]
+    anomalies = pd.DataFrame({
+        'subscriber_id': arrival['subscriber_id'].to_numpy(dtype=np.int64),
+        'from_tower_id': origin['tower_id'].to_numpy(dtype=np.int64),
+        'to_tower_id': arrival['tower_id'].to_numpy(dtype=np.int64),
+        'departed_at': origin['timestamp'].to_numpy(),
+        'arrived_at': arrival['timestamp'].to_numpy(),
+        'distance_m': jumps['distance_m'].to_numpy(dtype=float),
+        'speed_kmh': jumps['speed_kmh'].to_numpy(dtype=float),
+        'severity': jumps['severity'].to_numpy()
+    })
+    db.session.execute(TravelAnomaly.__table__.insert(), _records(anomalies))
+    return len(anomalies)
+
+
+def update_travel_anomalies(frame: pd.DataFrame, previous: pd.DataFrame) -> int:
+    """Flag a chunk's impossible-travel jumps, including the jump from each subscriber's previous ping
+
+    Like transitions, backfills older than the previous ping are checked approximately until
+    rebuild_travel_anomalies() runs.
+    """
+    stacked, counted = _with_previous(frame, previous)
+    if len(stacked) < 2:
+        return 0
+    stacked['tower_id'] = stacked['tower_id'].astype(np.int64)
+    pings = stacked.join(_tower_coordinates(stacked['tower_id']), on='tower_id')
+    return _insert_travel_anomalies(pings, counted)
+
+
+def rebuild_travel_anomalies(batch_size: int = 500000) -> int:
+    """Re-run impossible-travel detection in one ordered pass over tower_records, e.g. after changing thresholds"""
+    TravelAnomaly.query.delete()
+    records = db.session.query(TowerRecord.subscriber_id, TowerRecord.tower_id, TowerRecord.timestamp,
+                               CellTower.latitude, CellTower.longitude)\
+        .join(CellTower, CellTower.id == TowerRecord.tower_id)\
+        .order_by(TowerRecord.subscriber_id, TowerRecord.timestamp, TowerRecord.id)
+
+    flagged = 0
+    carry = None  # Last ping of the previous batch, the origin of a jump that spans batches
+    for rows in db.session.execute(records.statement.execution_options(yield_per=batch_size)).partitions():
+        batch = pd.DataFrame(rows, columns=['subscriber_id', 'tower_id', 'timestamp', 'latitude', 'longitude'])
+        batch['timestamp'] = pd.to_datetime(batch['timestamp'])
+        counted = np.ones(len(batch), dtype=bool)
+        if carry is not None:
+            batch = pd.concat([carry, batch], ignore_index=True)
+            counted = np.r_[False, counted]
+        flagged += _insert_travel_anomalies(batch, counted)
+        carry = batch.iloc[[-1]]
+    db.session.commit()
+    return flagged
+
+
+def rebuild_tower_transitions(batch_size: int = 500000) -> int:
+    """Recount tower_transitions in one ordered pass over tower_records"""
+    TowerTransition.query.delete()
+    records = db.session.query(TowerRecord.subscriber_id, TowerRecord.tower_id, TowerRecord.timestamp)\
+        .order_by(TowerRecord.subscriber_id, TowerRecord.timestamp, TowerRecord.id)
+
+    carry = None  # Last record of the previous batch, the origin of a move that spans batches
+    for rows in db.session.execute(records.statement.execution_options(yield_per=batch_size)).partitions():
+        batch = pd.DataFrame(rows, columns=['subscriber_id', 'tower_id', 'timestamp'])
+        counted = np.ones(len(batch), dtype=bool)
+        if carry is not None:
+            batch = pd.concat([carry, batch], ignore_index=True)
+            counted = np.r_[False, counted]
+        counts = transition_counts(
+            batch['subscriber_id'].to_numpy(), batch['tower_id'].to_numpy(),
+            pd.to_datetime(batch['timestamp']).to_numpy(dtype='datetime64[s]').astype(np.int64),
+            counted=counted
+        )
+        upsert_add(TowerTransition.__table__, _records(counts),
+                   ['subscriber_id', 'hour', 'from_tower_id', 'to_tower_id'], ['moves'])
+        carry = batch.iloc[[-1]]
+    db.session.commit()
+    return TowerTransition.query.count()
+
+
+class TowerIngestor:
+    """Streams CDR files into cell_towers/tower_records in bounded chunks"""
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.tower_ids: Dict[str, int] = {}  # external tower_id -> cell_towers.id
+        self.dimension_keys: Dict[str, Dict[str, int]] = {}  # dimension table -> natural value -> id
+
+    def ingest_file(self, path: str, progress: Optional[ProgressCallback] = None) -> Dict:
+        """Ingest a CSV/Excel file chunk by chunk, committing after each chunk and archiving it to Parquet"""
+        started = time.monotonic()
+        total_bytes = os.path.getsize(path)
+        summary = {'rows': 0, 'chunks': 0, 'towers_created': 0, 'bytes_total': total_bytes}
+
+        reader = CDRReader(chunk_size=self.chunk_size)
+        with open(path, 'rb') as handle, cdr_archive.writer() as archive_writer:
+            for chunk in reader.read_chunks(path, handle):
+                if chunk.empty:
+                    continue
+                try:
+                    summary['towers_created'] += self._upsert_towers(chunk)
+                    self._insert_records(chunk)
+                    analysis_cache.invalidate(chunk['mobile_number'].unique())
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+                archive_writer.write(chunk)
+
+                summary['rows'] += len(chunk)
+                summary['chunks'] += 1
+                summary['bytes_read'] = handle.tell()
+                logging.info(f"Ingested {summary['rows']} records "
+                             f"({summary['bytes_read']}/{total_bytes} bytes)")
+                if progress:
+                    progress(dict(summary))
+
+        # Tower set and record counts changed, so map aggregates must be rebuilt
+        tower_grid.invalidate()
+
+        summary.update(reader.summary())
+        summary['bytes_read'] = total_bytes
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        return summary
+
+    def _upsert_towers(self, chunk: pd.DataFrame) -> int:
+        """Make sure every tower in the chunk exists and its primary key is cached"""
+        towers = chunk.drop_duplicates('tower_id')[['tower_id', 'latitude', 'longitude']]
+        unknown = towers[~towers['tower_id'].isin(self.tower_ids.keys())]
+        if unknown.empty:
+            return 0
+
+        self._load_tower_ids(unknown['tower_id'].tolist())
+        missing = unknown[~unknown['tower_id'].isin(self.tower_ids.keys())]
+        if missing.empty:
+            return 0
+
+        missing = missing.assign(
+            geohash=encode_geohash(missing['latitude'].to_numpy(), missing['longitude'].to_numpy()),
+            created_at=datetime.utcnow()
+        )
+        rows = _records(missing)
+        insert_ignore(CellTower.__table__, rows, ['tower_id'])
+        self._load_tower_ids(missing['tower_id'].tolist())
+        return len(missing)
+
+    def _load_tower_ids(self, tower_ids: List[str]):
+        for batch in _batched(tower_ids, 1000):
+            self.tower_ids.update(
+                db.session.query(CellTower.tower_id, CellTower.id)
+                .filter(CellTower.tower_id.in_(batch))
+                .all()
+            )
+
+    def _insert_records(self, chunk: pd.DataFrame):
+        """Load the chunk into tower_records and fold it into the subscriber rollup"""
+        frame = chunk.reindex(columns=SOURCE_COLUMNS)
+        # The reader's categorical tower column would carry through map(); keys are plain integers
+        frame['tower_id'] = chunk['tower_id'].astype(str).map(self.tower_ids).astype('Int64')
+        frame['call_duration'] = pd.to_numeric(frame['call_duration'], errors='coerce').round().astype('Int64')
+        frame['created_at'] = datetime.utcnow()
+        frame['subscriber_id'] = self._dimension_codes(frame['mobile_number'], Subscriber, 'mobile_number')
+        frame['connected_id'] = self._dimension_codes(frame['connected_number'], Subscriber, 'mobile_number')
+        frame['device_id'] = self._dimension_codes(frame['imei'], Device, 'imei')
+        ensure_partitions(frame['timestamp'])
+
+        if db.engine.dialect.name == 'postgresql':
+            self._copy_records(frame[RECORD_COLUMNS])
+        else:
+            db.session.execute(TowerRecord.__table__.insert(), _records(frame[RECORD_COLUMNS]))
+        # Links to earlier loads must be read before the rollup moves each subscriber's last ping
+        previous = previous_pings(frame)
+        update_tower_transitions(frame, previous)
+        update_travel_anomalies(frame, previous)
+        update_subscriber_stats(frame)
+        update_tower_stats(frame)
+        update_tower_bitmaps(frame)
+
+    def _dimension_codes(self, values: pd.Series, model, column: str) -> pd.Series:
+        """Encode a column as dimension keys; each distinct value is resolved once per file via categorical codes"""
+        values = values.astype('category')
+        categories = values.cat.categories.astype(str)
+        known = self.dimension_keys.setdefault(model.__tablename__, {})
+        unknown = [value for value in categories if value not in known]
+        if unknown:
+            known.update(dimension_ids(model, column, unknown))
+
+        lookup = np.array([known[value] for value in categories], dtype=np.int64)
+        codes = values.cat.codes.to_numpy()
+        missing = codes < 0
+        keys = lookup[np.where(missing, 0, codes)] if len(lookup) else np.zeros(len(codes), dtype=np.int64)
+        return pd.Series(pd.arrays.IntegerArray(keys, missing), index=values.index)
+
+    def _copy_records(self, frame: pd.DataFrame):
+        """Bulk load through COPY, which skips per-row statement overhead"""
+        buffer = io.StringIO()
+        frame.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S.%f')
+        buffer.seek(0)
+
+        connection = db.session.connection().connection
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {TowerRecord.__tablename__} ({', '.join(RECORD_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
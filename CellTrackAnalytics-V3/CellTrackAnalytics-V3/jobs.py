@@ -0,0 +1,343 @@
+import logging
+import os
+import pickle
+import socket
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import app, db
+from models import AnalysisResult, AnalysisJob, CellTower
+from ingest import TowerIngestor
+from readers import CDRReader, concat_chunks
+from ai_models import movement_analyzer, anomaly_detector, speed_detector, ANOMALY_FEATURES
+from markov import next_tower_model
+from anomaly_features import subscriber_features, ensure_anomaly_model
+from api_integration import data_processor, UploadSummary
+from utils import group_offsets
+from trajectory import encode_track
+
+# Share of the progress bar given to the ingest stage in analyze mode
+INGEST_PROGRESS_SHARE = 50.0
+
+# Upload rows analyzed at once; larger uploads are spilled to disk and analyzed in batches of whole subscribers
+ANALYSIS_BATCH_ROWS = int(os.environ.get('ANALYSIS_BATCH_ROWS', 1000000))
+
+# Hash partitions an upload is spilled into; a batch holds one or more of them
+SPILL_PARTITIONS = 64
+
+# Processes used for per-subscriber clustering; defaults to one per core
+MOVEMENT_WORKERS = int(os.environ.get('MOVEMENT_ANALYSIS_WORKERS', 0)) or None
+
+# Douglas-Peucker tolerance applied to stored tracks; 0 keeps every dwell run
+TRACK_SIMPLIFY_METERS = float(os.environ.get('TRACK_SIMPLIFY_METERS', 0))
+
+# Running jobs owned by another host are treated as orphaned after this long without a progress update
+STALE_JOB_SECONDS = 30 * 60
+
+
+def analyze_upload(df: pd.DataFrame, progress: Optional[Callable[[float], None]] = None) -> Dict:
+    """Run the per-number AI analysis over an uploaded frame and store AnalysisResult rows"""
+    df = df.assign(timestamp=pd.to_datetime(df['timestamp']))
+    summary = UploadSummary().add(df)
+    analysis_results = analyze_subscribers(df, progress)
+    db.session.commit()
+    return {
+        'analysis_results': analysis_results,
+        'statistics': summary.stats(),
+        'network_analysis': summary.network_analysis()
+    }
+
+
+def analyze_file(path: str, chunk_size: int, progress: Optional[Callable[[float], None]] = None) -> Dict:
+    """analyze_upload() for an upload file, without ever holding the whole file in memory
+
+    One streaming pass folds each chunk into the upload-wide summary and spills its rows
+    to disk, partitioned by a hash of the number. Partitions are then analyzed in batches
+    of at most ANALYSIS_BATCH_ROWS rows (a single partition can exceed it), so every
+    subscriber is analyzed with all of its records. Results are committed together at the end.
+    """
+    summary = UploadSummary()
+    reader = CDRReader(chunk_size=chunk_size)
+    with tempfile.TemporaryDirectory(prefix='cdr-analysis-') as spill_dir:
+        spills = [open(os.path.join(spill_dir, f"{partition}.pkl"), 'w+b') for partition in range(SPILL_PARTITIONS)]
+        try:
+            sizes = np.zeros(SPILL_PARTITIONS, dtype=np.int64)
+            with open(path, 'rb') as handle:
+                for chunk in reader.read_chunks(path, handle):
+                    chunk = chunk.assign(timestamp=pd.to_datetime(chunk['timestamp']))
+                    summary.add(chunk)
+                    partitions = pd.util.hash_array(chunk['mobile_number'].astype(str).to_numpy(dtype=object)) \
+                        % SPILL_PARTITIONS
+                    for partition, rows in chunk.groupby(partitions, sort=False):
+                        pickle.dump(rows, spills[partition], protocol=pickle.HIGHEST_PROTOCOL)
+                        sizes[partition] += len(rows)
+
+            # Consecutive partitions are analyzed together while they fit in one batch
+            batches, batch, batch_rows = [], [], 0
+            for partition in np.flatnonzero(sizes).tolist():
+                if batch and batch_rows + sizes[partition] > ANALYSIS_BATCH_ROWS:
+                    batches.append(batch)
+                    batch, batch_rows = [], 0
+                batch.append(partition)
+                batch_rows += sizes[partition]
+            if batch:
+                batches.append(batch)
+
+            analysis_results, done, total = [], 0, max(int(sizes.sum()), 1)
+            for batch in batches:
+                frames = []
+                for partition in batch:
+                    spills[partition].seek(0)
+                    while True:
+                        try:
+                            frames.append(pickle.load(spills[partition]))
+                        except EOFError:
+                            break
+                frame = concat_chunks(frames)
+                del frames
+                batch_progress = (lambda fraction, done=done, rows=len(frame):
+                                  progress((done + fraction * rows) / total)) if progress else None
+                analysis_results.extend(analyze_subscribers(frame, batch_progress))
+                done += len(frame)
+        finally:
+            for spill in spills:
+                spill.close()
+
+    db.session.commit()
+    analysis_results.sort(key=lambda result: result['mobile_number'])
+    return {
+        'analysis_results': analysis_results,
+        'statistics': summary.stats(),
+        'network_analysis': summary.network_analysis()
+    }
+
+
+def analyze_subscribers(df: pd.DataFrame, progress: Optional[Callable[[float], None]] = None) -> List[Dict]:
+    """Analyze every number in a frame holding all of their upload records; results are added, not committed"""
+    # Patterns follow the same (mobile_number, timestamp) order as the group offsets
+    sorted_df, starts, ends = group_offsets(df)
+    patterns = data_processor.build_patterns(sorted_df, starts, ends)
+    epoch_seconds = sorted_df['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+    coordinates_all = sorted_df[['latitude', 'longitude']].to_numpy(dtype=float)
+
+    # Cluster every subscriber in one batch fanned out over the process pool
+    movement_analyses = movement_analyzer.analyze_movement_patterns_batch(
+        [(coordinates_all[start:end], epoch_seconds[start:end]) for start, end in zip(starts, ends)],
+        n_jobs=MOVEMENT_WORKERS
+    )
+
+    # Score the upload's numbers on their lifetime rollup features (the upload was ingested first)
+    # against the population model; refits are explicit, see `flask fit-anomaly-model`
+    feature_map = subscriber_features([pattern['mobile_number'] for pattern in patterns])
+    features = np.array([feature_map.get(pattern['mobile_number'], [0.0] * len(ANOMALY_FEATURES))
+                         for pattern in patterns], dtype=float).reshape(-1, len(ANOMALY_FEATURES))
+    ensure_anomaly_model()
+    anomalies = anomaly_detector.detect_anomalies(features)
+
+    # Impossible-travel jumps for every number in one vectorized pass over the contiguous groups
+    groups = np.repeat(np.arange(len(starts)), ends - starts)
+    jumps = speed_detector.detect(groups, coordinates_all[:, 0], coordinates_all[:, 1], epoch_seconds)
+    jump_groups = groups[jumps['position'].to_numpy(dtype=np.int64)]
+    jump_bounds = np.searchsorted(jump_groups, np.arange(len(starts) + 1))
+    tower_labels = sorted_df['tower_id'].astype(str).to_numpy()
+    travel_anomalies = [{
+        'from_tower': tower_labels[origin],
+        'to_tower': tower_labels[position],
+        'departed_at': sorted_df['timestamp'].iat[origin].isoformat(),
+        'arrived_at': sorted_df['timestamp'].iat[position].isoformat(),
+        'distance_km': round(distance_m / 1000, 3),
+        'speed_kmh': round(speed_kmh, 1),
+        'severity': severity
+    } for origin, position, distance_m, speed_kmh, severity in zip(
+        jumps['origin'].tolist(), jumps['position'].tolist(), jumps['distance_m'].tolist(),
+        jumps['speed_kmh'].tolist(), jumps['severity'].tolist()
+    )]
+
+    # Next towers from each number's last record, answered in one batched lookup; the upload
+    # was ingested first, so the transition model already includes it
+    last_records = sorted_df.iloc[ends - 1]
+    last_towers = last_records['tower_id'].astype(str).tolist()
+    tower_keys = {}
+    for start in range(0, len(last_towers), 1000):
+        tower_keys.update(db.session.query(CellTower.tower_id, CellTower.id)
+                          .filter(CellTower.tower_id.in_(last_towers[start:start + 1000])).all())
+    next_locations = next_tower_model.predict_many([
+        (str(number), tower_keys.get(tower), timestamp.hour)
+        for number, tower, timestamp in zip(last_records['mobile_number'], last_towers, last_records['timestamp'])
+    ])
+
+    # Store results and perform AI analysis
+    analysis_results = []
+    for index, pattern in enumerate(patterns):
+        # Prepare data for AI analysis
+        coordinates = coordinates_all[starts[index]:ends[index]]
+        movement_analysis = movement_analyses[index]
+
+        is_anomaly = bool(anomalies[index])
+
+        next_location = next_locations[index]
+
+        # Store analysis result
+        result = AnalysisResult(
+            mobile_number=pattern['mobile_number'],
+            tower_count=pattern['tower_count'],
+            first_seen=datetime.fromisoformat(pattern['first_seen']),
+            last_seen=datetime.fromisoformat(pattern['last_seen']),
+            movement_track=encode_track(
+                coordinates[:, 0], coordinates[:, 1], epoch_seconds[starts[index]:ends[index]],
+                tolerance_m=TRACK_SIMPLIFY_METERS
+            ),
+            common_contacts=pattern['contact_network'],
+            location_frequency={str(k): v for k, v in enumerate(movement_analysis['clusters']) if v != -1} if movement_analysis else None
+        )
+        db.session.add(result)
+        analysis_results.append({
+            'mobile_number': pattern['mobile_number'],
+            'analysis': {
+                'movement_patterns': movement_analysis,
+                'is_anomaly': is_anomaly,
+                'predicted_next_location': next_location,
+                'impossible_travel': travel_anomalies[jump_bounds[index]:jump_bounds[index + 1]],
+                'contact_network': pattern['contact_network']
+            }
+        })
+
+        if progress:
+            progress((index + 1) / len(patterns))
+    return analysis_results
+
+
+class JobQueue:
+    """Local worker pool that runs upload jobs tracked in the analysis_jobs table"""
+
+    def __init__(self, max_workers: int = 2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis-job')
+        # The boot token tells this process apart from an earlier one that had the same pid
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def submit(self, filename: str, file_path: str, mode: str = 'analyze') -> AnalysisJob:
+        """Record a queued job and hand it to the pool"""
+        job = AnalysisJob(filename=filename, file_path=file_path, mode=mode, status='queued')
+        db.session.add(job)
+        db.session.commit()
+        self.executor.submit(self._run, job.id)
+        return job
+
+    def resume_pending(self):
+        """Fail jobs orphaned by a dead process and re-queue jobs that never started"""
+        for job in AnalysisJob.query.filter_by(status='running').all():
+            self.check_orphaned(job)
+
+        for job in AnalysisJob.query.filter_by(status='queued').all():
+            if os.path.exists(job.file_path):
+                self.executor.submit(self._run, job.id)
+            else:
+                self._finish(job, 'failed', error='Upload file no longer available')
+
+    def check_orphaned(self, job: AnalysisJob) -> bool:
+        """Fail a running job whose owning process is gone; returns True if it was failed"""
+        if job.status != 'running' or self._owner_alive(job):
+            return False
+        # Partially ingested chunks stay committed, so the job is failed rather than re-run
+        self._finish(job, 'failed', error='Interrupted by server restart')
+        return True
+
+    def _owner_alive(self, job: AnalysisJob) -> bool:
+        host, _, rest = (job.worker_id or '').partition(':')
+        pid, _, token = rest.partition(':')
+        if job.worker_id == self.worker_id:
+            return True
+        if host == socket.gethostname() and pid.isdigit():
+            if int(pid) == os.getpid():
+                return False  # Same pid, different boot token: an earlier incarnation of this process
+            try:
+                os.kill(int(pid), 0)
+                return True
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                return True
+        # Another host (or no owner recorded): only the heartbeat can tell
+        heartbeat = job.updated_at or job.started_at or job.created_at
+        return heartbeat is not None and heartbeat >= datetime.utcnow() - timedelta(seconds=STALE_JOB_SECONDS)
+
+    def _claim(self, job_id: int) -> Optional[AnalysisJob]:
+        """Atomically move a job from queued to running so it only runs once"""
+        claimed = AnalysisJob.query.filter_by(id=job_id, status='queued').update({
+            'status': 'running',
+            'started_at': datetime.utcnow(),
+            'worker_id': self.worker_id
+        })
+        db.session.commit()
+        return db.session.get(AnalysisJob, job_id) if claimed else None
+
+    def _run(self, job_id: int):
+        with app.app_context():
+            job = self._claim(job_id)
+            if job is None:
+                return
+
+            try:
+                result = self._process(job)
+                self._finish(job, 'completed', result=result)
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Analysis job {job_id} failed: {str(e)}")
+                self._finish(db.session.get(AnalysisJob, job_id), 'failed', error=str(e))
+            finally:
+                if os.path.exists(job.file_path):
+                    os.remove(job.file_path)
+                db.session.remove()
+
+    def _process(self, job: AnalysisJob) -> Dict:
+        ingest_share = INGEST_PROGRESS_SHARE if job.mode == 'analyze' else 100.0
+
+        def ingest_progress(summary):
+            self._update(job, 'ingesting', ingest_share * summary['bytes_read'] / max(summary['bytes_total'], 1))
+
+        self._update(job, 'ingesting', 0.0)
+        ingestor = TowerIngestor(chunk_size=app.config['INGEST_CHUNK_SIZE'])
+        result = {'ingest': ingestor.ingest_file(job.file_path, progress=ingest_progress)}
+        if job.mode == 'ingest':
+            return result
+
+        self._update(job, 'analyzing', ingest_share)
+
+        def analysis_progress(fraction):
+            self._update(job, 'analyzing', ingest_share + (100.0 - ingest_share) * fraction)
+
+        result.update(analyze_file(job.file_path, app.config['INGEST_CHUNK_SIZE'], progress=analysis_progress))
+        return result
+
+    def _update(self, job: AnalysisJob, stage: str, progress: float):
+        # Only write when the bar visibly moves to keep progress commits cheap
+        if job.stage == stage and progress - job.progress < 1.0:
+            return
+        # A separate connection, so the job session's pending AnalysisResult rows are not committed with it
+        with db.engine.begin() as connection:
+            connection.execute(update(AnalysisJob.__table__).where(AnalysisJob.__table__.c.id == job.id).values(
+                stage=stage, progress=progress, updated_at=datetime.utcnow()
+            ))
+        set_committed_value(job, 'stage', stage)
+        set_committed_value(job, 'progress', progress)
+
+    def _finish(self, job: AnalysisJob, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        if status == 'completed':
+            job.progress = 100.0
+        db.session.commit()
+
+
+# Initialize global instance
+job_queue = JobQueue(max_workers=int(os.environ.get('ANALYSIS_JOB_WORKERS', 2)))
@@ -0,0 +1,168 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import tuple_
+
+from app import db
+from models import CellTower, Subscriber, TowerTransition
+
+# Pseudo subscriber holding the population-wide matrix, and pseudo hour holding all hours
+GLOBAL_SUBSCRIBER = 0
+ALL_HOURS = 24
+
+# A scope needs this many observed departures from the tower before it is trusted
+MIN_EVIDENCE = 3
+
+KEY_COLUMNS = ['subscriber_id', 'hour', 'from_tower_id', 'to_tower_id']
+
+
+def transition_counts(subscriber_ids, tower_ids, epoch_seconds, counted=None) -> pd.DataFrame:
+    """Count tower-to-tower moves for every subscriber at once
+
+    Records are ordered by (subscriber, time); a move is a change of tower between
+    consecutive records of the same subscriber, attributed to the hour of the last ping
+    on the tower being left. Rows with counted=False (e.g. each subscriber's last known
+    record from an earlier load) only serve as the origin of the first move.
+    Each move is counted in four sparse matrices: per subscriber and global, each per
+    hour of day and over all hours.
+    """
+    subscriber_ids = np.asarray(subscriber_ids, dtype=np.int64)
+    tower_ids = np.asarray(tower_ids, dtype=np.int64)
+    epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+    counted = np.ones(len(subscriber_ids), dtype=bool) if counted is None else np.asarray(counted, dtype=bool)
+    if len(subscriber_ids) < 2:
+        return pd.DataFrame(columns=KEY_COLUMNS + ['moves'], dtype=np.int64)
+
+    # On timestamp ties the uncounted record from the earlier load sorts first, as the origin
+    order = np.lexsort((counted, epoch_seconds, subscriber_ids))
+    subscriber_ids, tower_ids, epoch_seconds, counted = \
+        subscriber_ids[order], tower_ids[order], epoch_seconds[order], counted[order]
+
+    moved = (subscriber_ids[1:] == subscriber_ids[:-1]) & (tower_ids[1:] != tower_ids[:-1]) & counted[1:]
+    origin = np.flatnonzero(moved)
+    moves = pd.DataFrame({
+        'subscriber_id': subscriber_ids[origin],
+        'hour': (epoch_seconds[origin] // 3600) % 24,
+        'from_tower_id': tower_ids[origin],
+        'to_tower_id': tower_ids[origin + 1]
+    })
+
+    scopes = pd.concat([
+        moves,
+        moves.assign(hour=ALL_HOURS),
+        moves.assign(subscriber_id=GLOBAL_SUBSCRIBER),
+        moves.assign(subscriber_id=GLOBAL_SUBSCRIBER, hour=ALL_HOURS)
+    ], ignore_index=True)
+    return scopes.groupby(KEY_COLUMNS, sort=False).size().reset_index(name='moves')
+
+
+class NextTowerModel:
+    """Sparse Markov next-tower predictor over the tower_transitions table
+
+    The table stores the non-zero cells of the transition matrices, keyed by
+    (subscriber, hour, from tower), so a prediction reads a single matrix row through
+    the primary key. The most specific scope with enough evidence answers: subscriber
+    at that hour, subscriber at any hour, everyone at that hour, then everyone.
+    """
+
+    VERSION = 'markov-1'
+
+    def __init__(self, min_evidence: int = MIN_EVIDENCE):
+        self.min_evidence = min_evidence
+
+    def predict(self, mobile_number: str, tower_id: int, hour: Optional[int] = None, k: int = 3) -> Optional[Dict]:
+        """Top-k next towers after tower_id (cell_towers.id), or None when nothing was ever seen leaving it"""
+        return self.predict_many([(mobile_number, tower_id, hour)], k)[0]
+
+    def predict_many(self, queries: List[Tuple[str, int, Optional[int]]], k: int = 3) -> List[Optional[Dict]]:
+        """Answer (mobile_number, tower_id, hour) queries with batched row lookups; a None tower predicts None"""
+        subscribers = self._subscriber_ids([number for number, _, _ in queries])
+        scopes_per_query = [self._scopes(subscribers.get(number), int(tower_id), hour) if tower_id is not None else []
+                            for number, tower_id, hour in queries]
+        rows = self._rows({scope for scopes in scopes_per_query for scope in scopes})
+        towers = self._towers({to for cells in rows.values() for to, _ in cells})
+
+        predictions = []
+        for scopes in scopes_per_query:
+            prediction = None
+            for scope in scopes:
+                cells = rows.get(scope, [])
+                total = sum(count for _, count in cells)
+                if total >= self.min_evidence or (total and scope == scopes[-1]):
+                    prediction = self._top_k(scope, cells, total, towers, k)
+                    break
+            predictions.append(prediction)
+        return predictions
+
+    @staticmethod
+    def _scopes(subscriber_id: Optional[int], tower_id: int, hour: Optional[int]) -> List[Tuple[int, int, int]]:
+        scopes = []
+        for owner in ([subscriber_id] if subscriber_id is not None else []) + [GLOBAL_SUBSCRIBER]:
+            if hour is not None:
+                scopes.append((owner, int(hour), tower_id))
+            scopes.append((owner, ALL_HOURS, tower_id))
+        return scopes
+
+    @staticmethod
+    def _top_k(scope, cells, total, towers, k) -> Dict:
+        ranked = sorted(cells, key=lambda cell: (-cell[1], cell[0]))[:k]
+        return {
+            'scope': {
+                'subscriber': 'global' if scope[0] == GLOBAL_SUBSCRIBER else 'subscriber',
+                'hour': None if scope[1] == ALL_HOURS else scope[1]
+            },
+            'observed_departures': total,
+            'towers': [{
+                'tower_id': towers[to][0],
+                'latitude': towers[to][1],
+                'longitude': towers[to][2],
+                'probability': count / total,
+                'count': count
+            } for to, count in ranked if to in towers]
+        }
+
+    @staticmethod
+    def _subscriber_ids(numbers: List[str]) -> Dict[str, int]:
+        numbers = list(dict.fromkeys(numbers))
+        ids = {}
+        for start in range(0, len(numbers), 1000):
+            ids.update(
+                db.session.query(Subscriber.mobile_number, Subscriber.id)
+                .filter(Subscriber.mobile_number.in_(numbers[start:start + 1000]))
+                .all()
+            )
+        return ids
+
+    @staticmethod
+    def _rows(scopes) -> Dict[Tuple[int, int, int], List[Tuple[int, int]]]:
+        scopes = list(scopes)
+        rows = defaultdict(list)
+        for start in range(0, len(scopes), 500):
+            for row in db.session.query(
+                TowerTransition.subscriber_id, TowerTransition.hour, TowerTransition.from_tower_id,
+                TowerTransition.to_tower_id, TowerTransition.moves
+            ).filter(
+                tuple_(TowerTransition.subscriber_id, TowerTransition.hour, TowerTransition.from_tower_id)
+                .in_(scopes[start:start + 500])
+            ).all():
+                rows[(row.subscriber_id, row.hour, row.from_tower_id)].append((row.to_tower_id, row.moves))
+        return rows
+
+    @staticmethod
+    def _towers(tower_ids) -> Dict[int, Tuple[str, float, float]]:
+        tower_ids = list(tower_ids)
+        towers = {}
+        for start in range(0, len(tower_ids), 1000):
+            towers.update({
+                row.id: (row.tower_id, row.latitude, row.longitude) for row in
+                db.session.query(CellTower.id, CellTower.tower_id, CellTower.latitude, CellTower.longitude)
+                .filter(CellTower.id.in_(tower_ids[start:start + 1000]))
+                .all()
+            })
+        return towers
+
+
+# Initialize global instance
+next_tower_model = NextTowerModel()
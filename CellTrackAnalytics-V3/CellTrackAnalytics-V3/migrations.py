@@ -0,0 +1,150 @@
+import logging
+
+from sqlalchemy import MetaData, Table, func, inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from models import TowerRecord, Subscriber, Device
+from partitions import ensure_partitions, is_partitioned
+
+# Name the pre-dimension tower_records table is moved to while its rows are copied over
+LEGACY_RECORDS = 'tower_records_legacy'
+
+# Arbitrary key for the PostgreSQL advisory lock that keeps workers from upgrading concurrently
+UPGRADE_LOCK_KEY = 724301
+
+
+def _columns(table_name: str, bind=None) -> set:
+    inspector = inspect(bind if bind is not None else db.engine)
+    if not inspector.has_table(table_name):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table_name)}
+
+
+def _needs_record_migration(bind=None) -> bool:
+    return 'mobile_number' in _columns(TowerRecord.__tablename__, bind)
+
+
+def missing_columns(bind=None) -> list:
+    """Model columns absent from tables that already exist"""
+    inspector = inspect(bind if bind is not None else db.engine)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if inspector.has_table(table.name):
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            missing.extend(column for column in table.columns if column.name not in existing)
+    return missing
+
+
+def upgrade_schema() -> bool:
+    """Upgrade tables created by earlier versions in place, which db.create_all() never alters
+
+    Runs in one transaction and is a no-op on an up-to-date database. Returns whether anything changed.
+    """
+    if not _needs_record_migration() and not missing_columns():
+        return False
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        # Other workers starting at the same time wait here, then find nothing left to do
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': UPGRADE_LOCK_KEY})
+    try:
+        if _needs_record_migration(connection):
+            migrate_legacy_records()
+        for column in missing_columns(connection):
+            add_column(column)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return True
+
+
+def add_column(column):
+    """ALTER TABLE ... ADD COLUMN for a nullable model column, then create the indexes covering it"""
+    table = column.table
+    if not column.nullable:
+        raise RuntimeError(f"{table.name}.{column.name} is required and cannot be added to the existing table; "
+                           f"migrate {table.name} manually")
+    connection = db.session.connection()
+    preparer = connection.dialect.identifier_preparer
+    db.session.execute(text(
+        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+        f"{column.type.compile(dialect=connection.dialect)}"
+    ))
+    for index in table.indexes:
+        if column.name in index.columns:
+            index.create(connection)
+    logging.info(f"Added column {table.name}.{column.name}")
+
+
+def _insert_ignore(table):
+    """INSERT ... ON CONFLICT DO NOTHING for the dialects that support it"""
+    return (postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert)(table)
+
+
+def migrate_legacy_records() -> int:
+    """Move tower_records from string numbers/IMEIs to subscriber and device keys
+
+    The old table is renamed aside, the dimensions are filled from its distinct values, and
+    every row is copied into the new layout with its id kept. Returns the number of rows moved.
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+    table = TowerRecord.__tablename__
+    logging.info(f"Migrating {table} to subscriber/device keys")
+
+    # Index and key names are schema-wide, so the old table gives them up before the new one is created
+    inspector = inspect(connection)
+    primary_key = inspector.get_pk_constraint(table).get('name')
+    for index in inspector.get_indexes(table):
+        db.session.execute(text(f"DROP INDEX {index['name']}"))
+    db.session.execute(text(f"ALTER TABLE {table} RENAME TO {LEGACY_RECORDS}"))
+    if dialect == 'postgresql':
+        if primary_key:
+            db.session.execute(text(f"ALTER TABLE {LEGACY_RECORDS} RENAME CONSTRAINT {primary_key} "
+                                    f"TO {LEGACY_RECORDS}_pkey"))
+        sequence = db.session.execute(text(f"SELECT pg_get_serial_sequence('{LEGACY_RECORDS}', 'id')")).scalar()
+        if sequence:
+            db.session.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {LEGACY_RECORDS}_id_seq"))
+
+    TowerRecord.__table__.create(connection)
+    legacy = Table(LEGACY_RECORDS, MetaData(), autoload_with=connection)
+    if is_partitioned():
+        ensure_partitions(db.session.execute(
+            text(f"SELECT DISTINCT date_trunc('month', timestamp) FROM {LEGACY_RECORDS}")
+        ).scalars())
+
+    for model, column, sources in ((Subscriber, 'mobile_number', ['mobile_number', 'connected_number']),
+                                   (Device, 'imei', ['imei'])):
+        for source in sources:
+            values = select(legacy.c[source]).where(legacy.c[source].isnot(None)).distinct()
+            db.session.execute(
+                _insert_ignore(model.__table__).from_select([column], values)
+                .on_conflict_do_nothing(index_elements=[column])
+            )
+
+    subscriber = Subscriber.__table__.alias('subscriber')
+    contact = Subscriber.__table__.alias('contact')
+    device = Device.__table__.alias('device')
+    rows = select(
+        legacy.c.id, subscriber.c.id, device.c.id, legacy.c.timestamp, legacy.c.tower_id, legacy.c.call_duration,
+        legacy.c.call_type, contact.c.id, legacy.c.ip_address, legacy.c.device_info, legacy.c.created_at
+    ).select_from(
+        legacy.join(subscriber, subscriber.c.mobile_number == legacy.c.mobile_number)
+        .outerjoin(device, device.c.imei == legacy.c.imei)
+        .outerjoin(contact, contact.c.mobile_number == legacy.c.connected_number)
+    )
+    db.session.execute(TowerRecord.__table__.insert().from_select([
+        'id', 'subscriber_id', 'device_id', 'timestamp', 'tower_id', 'call_duration',
+        'call_type', 'connected_id', 'ip_address', 'device_info', 'created_at'
+    ], rows))
+
+    moved = db.session.execute(select(func.count()).select_from(TowerRecord.__table__)).scalar()
+    if dialect == 'postgresql':
+        # Copied ids bypassed the new sequence; continue numbering after them
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}"
+        ))
+    db.session.execute(text(f"DROP TABLE {LEGACY_RECORDS}"))
+    logging.info(f"Migrated {moved} records to subscriber/device keys")
+    return moved
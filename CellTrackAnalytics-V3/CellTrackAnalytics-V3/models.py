@@ -1,5 +1,62 @@
 from datetime import datetime
-from app import db
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.hybrid import Comparator, hybrid_property
+from app import app, db
+
+# tower_records is range-partitioned by month on PostgreSQL, which needs the partition key in the primary key
+PARTITIONED_RECORDS = make_url(app.config['SQLALCHEMY_DATABASE_URI'] or 'sqlite://').get_backend_name() == 'postgresql'
+
+class DimensionComparator(Comparator):
+    """Compares a surrogate key column by the natural value it stands for
+
+    ``TowerRecord.mobile_number == '123'`` becomes ``subscriber_id = (SELECT id FROM subscribers
+    WHERE mobile_number = '123')``, so filters keep using the narrow integer indexes.
+    """
+
+    def __init__(self, name, key, dimension_id, natural):
+        self.name = name
+        self.key = key
+        self.dimension_id = dimension_id
+        self.natural = natural
+        super().__init__(key)
+
+    def _ids(self, condition):
+        return select(self.dimension_id).where(condition)
+
+    def __clause_element__(self):
+        # Reading the value correlates on tower_records, so a query selecting only this
+        # column needs select_from(TowerRecord); hot paths group by the key instead
+        return select(self.natural).where(self.dimension_id == self.key)\
+            .correlate_except(self.natural.class_).scalar_subquery().label(self.name)
+
+    def operate(self, op, *other, **kwargs):
+        return op(self.__clause_element__(), *other, **kwargs)
+
+    def reverse_operate(self, op, other, **kwargs):
+        return op(other, self.__clause_element__(), **kwargs)
+
+    def __eq__(self, other):
+        if other is None:
+            return self.key.is_(None)
+        return self.key == self._ids(self.natural == other).scalar_subquery()
+
+    def __ne__(self, other):
+        if other is None:
+            return self.key.isnot(None)
+        return self.key != self._ids(self.natural == other).scalar_subquery()
+
+    def in_(self, other):
+        return self.key.in_(self._ids(self.natural.in_(other)))
+
+    def is_(self, other):
+        return self.key.is_(other)
+
+    def isnot(self, other):
+        return self.key.isnot(other)
+
+    is_not = isnot
+
 
 class CellTower(db.Model):
     __tablename__ = 'cell_towers'
@@ -8,31 +65,172 @@ class CellTower(db.Model):
     tower_id = db.Column(db.String(50), unique=True, nullable=False)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
+    geohash = db.Column(db.String(12), nullable=True, index=True)  # Spatial key for prefix range scans
     records = db.relationship('TowerRecord', backref='tower', lazy=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class TowerRecord(db.Model):
     __tablename__ = 'tower_records'
 
-    id = db.Column(db.Integer, primary_key=True)
-    mobile_number = db.Column(db.String(20), nullable=False)
-    imei = db.Column(db.String(20), nullable=True)  # Added IMEI tracking
-    timestamp = db.Column(db.DateTime, nullable=False)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Numbers and IMEIs are stored as integer keys into the subscribers/devices dimensions
+    subscriber_id = db.Column(db.Integer, db.ForeignKey('subscribers.id'), nullable=False)
+    device_id = db.Column(db.Integer, db.ForeignKey('devices.id'), nullable=True)  # Added IMEI tracking
+    timestamp = db.Column(db.DateTime, nullable=False, primary_key=PARTITIONED_RECORDS)
     tower_id = db.Column(db.Integer, db.ForeignKey('cell_towers.id'), nullable=False)
     call_duration = db.Column(db.Integer, nullable=True)  # Duration in seconds
     call_type = db.Column(db.String(20), nullable=True)  # incoming, outgoing, missed
-    connected_number = db.Column(db.String(20), nullable=True)  # For tracking call connections
+    connected_id = db.Column(db.Integer, db.ForeignKey('subscribers.id'), nullable=True)  # For tracking call connections
     ip_address = db.Column(db.String(45), nullable=True)  # IPv6 compatible
     device_info = db.Column(db.JSON, nullable=True)  # Store device details
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    subscriber = db.relationship('Subscriber', foreign_keys=[subscriber_id])
+    contact = db.relationship('Subscriber', foreign_keys=[connected_id])
+    device = db.relationship('Device')
+
     __table_args__ = (
-        db.Index('idx_mobile_timestamp', 'mobile_number', 'timestamp'),
-        db.Index('idx_imei', 'imei'),
-        db.Index('idx_connected_number', 'connected_number'),
+        db.Index('idx_subscriber_timestamp', 'subscriber_id', 'timestamp'),
+        db.Index('idx_device', 'device_id'),
+        db.Index('idx_connected', 'connected_id'),
         db.Index('idx_tower_timestamp', 'tower_id', 'timestamp'),
+        db.Index('idx_timestamp_id', 'timestamp', 'id'),  # Keyset pagination order
+        # Monthly range partitions on PostgreSQL, created on demand by partitions.ensure_partitions
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+    # Rows are still identified by id alone
+    __mapper_args__ = {'primary_key': [id]}
+
+    @hybrid_property
+    def mobile_number(self):
+        return self.subscriber.mobile_number
+
+    @mobile_number.comparator
+    def mobile_number(cls):
+        return DimensionComparator('mobile_number', cls.subscriber_id, Subscriber.id, Subscriber.mobile_number)
+
+    @hybrid_property
+    def connected_number(self):
+        return self.contact.mobile_number if self.contact else None
+
+    @connected_number.comparator
+    def connected_number(cls):
+        return DimensionComparator('connected_number', cls.connected_id, Subscriber.id, Subscriber.mobile_number)
+
+    @hybrid_property
+    def imei(self):
+        return self.device.imei if self.device else None
+
+    @imei.comparator
+    def imei(cls):
+        return DimensionComparator('imei', cls.device_id, Device.id, Device.imei)
+
+class SubscriberStats(db.Model):
+    __tablename__ = 'subscriber_stats'
+
+    mobile_number = db.Column(db.String(20), primary_key=True)
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+    tower_count = db.Column(db.Integer, nullable=False, default=0)  # Distinct towers, from subscriber_towers
+    contact_count = db.Column(db.Integer, nullable=False, default=0)  # Distinct contacts, from subscriber_contacts
+    duration_sum = db.Column(db.BigInteger, nullable=False, default=0)
+    duration_count = db.Column(db.Integer, nullable=False, default=0)  # Records with a known duration
+    duration_max = db.Column(db.Integer, nullable=True)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+    last_tower_id = db.Column(db.Integer, db.ForeignKey('cell_towers.id'), nullable=True)  # Tower of the last_seen record
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_stats_record_count', 'record_count'),
+        db.Index('idx_stats_tower_count', 'tower_count'),
+    )
+
+    @property
+    def avg_duration(self):
+        return self.duration_sum / self.duration_count if self.duration_count else 0.0
+
+class TowerStats(db.Model):
+    __tablename__ = 'tower_stats'
+
+    # Per-tower record counts maintained on ingest, so the map index never scans tower_records
+    tower_id = db.Column(db.Integer, db.ForeignKey('cell_towers.id'), primary_key=True)
+    record_count = db.Column(db.BigInteger, nullable=False, default=0)
+
+class SubscriberTower(db.Model):
+    __tablename__ = 'subscriber_towers'
+
+    mobile_number = db.Column(db.String(20), primary_key=True)
+    tower_id = db.Column(db.Integer, db.ForeignKey('cell_towers.id'), primary_key=True)
+
+class SubscriberContact(db.Model):
+    __tablename__ = 'subscriber_contacts'
+
+    mobile_number = db.Column(db.String(20), primary_key=True)
+    connected_number = db.Column(db.String(20), primary_key=True)
+
+class Subscriber(db.Model):
+    __tablename__ = 'subscribers'
+
+    id = db.Column(db.Integer, primary_key=True)  # Dense surrogate key, also the bitmap member
+    mobile_number = db.Column(db.String(20), unique=True, nullable=False)
+
+class Device(db.Model):
+    __tablename__ = 'devices'
+
+    id = db.Column(db.Integer, primary_key=True)
+    imei = db.Column(db.String(20), unique=True, nullable=False)
+
+class TowerDayBitmap(db.Model):
+    __tablename__ = 'tower_day_bitmaps'
+
+    tower_id = db.Column(db.Integer, db.ForeignKey('cell_towers.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    cardinality = db.Column(db.Integer, nullable=False, default=0)  # Subscribers seen on the tower that day
+    bitmap = db.Column(db.LargeBinary, nullable=False)  # Serialized bitmaps.RoaringBitmap of subscribers.id
+
+    __table_args__ = (
+        db.Index('idx_bitmap_day', 'day'),
+    )
+
+class TowerTransition(db.Model):
+    __tablename__ = 'tower_transitions'
+
+    # Non-zero cells of the next-tower transition matrices, see markov.py
+    subscriber_id = db.Column(db.Integer, primary_key=True)  # subscribers.id, or 0 for the global matrix
+    hour = db.Column(db.SmallInteger, primary_key=True)  # Hour of day left, or 24 for all hours
+    from_tower_id = db.Column(db.Integer, db.ForeignKey('cell_towers.id'), primary_key=True)
+    to_tower_id = db.Column(db.Integer, db.ForeignKey('cell_towers.id'), primary_key=True)
+    moves = db.Column(db.Integer, nullable=False, default=0)
+
+class TravelAnomaly(db.Model):
+    __tablename__ = 'travel_anomalies'
+
+    # Jumps between consecutive pings faster than the speed thresholds in ai_models.py
+    id = db.Column(db.Integer, primary_key=True)
+    subscriber_id = db.Column(db.Integer, db.ForeignKey('subscribers.id'), nullable=False)
+    from_tower_id = db.Column(db.Integer, db.ForeignKey('cell_towers.id'), nullable=False)
+    to_tower_id = db.Column(db.Integer, db.ForeignKey('cell_towers.id'), nullable=False)
+    departed_at = db.Column(db.DateTime, nullable=False)
+    arrived_at = db.Column(db.DateTime, nullable=False)
+    distance_m = db.Column(db.Float, nullable=False)
+    speed_kmh = db.Column(db.Float, nullable=False)
+    severity = db.Column(db.String(20), nullable=False)  # suspicious or impossible
+
+    __table_args__ = (
+        db.Index('idx_travel_subscriber_time', 'subscriber_id', 'arrived_at'),
+        db.Index('idx_travel_arrived', 'arrived_at'),
     )
 
+class AnalysisCacheEntry(db.Model):
+    __tablename__ = 'analysis_cache'
+
+    mobile_number = db.Column(db.String(20), primary_key=True)
+    analyzer = db.Column(db.String(50), primary_key=True)  # e.g. movement
+    version = db.Column(db.String(50), nullable=False)  # Analyzer version that produced the result
+    record_stamp = db.Column(db.String(64), nullable=False)  # Record count and last timestamp it was computed from
+    result = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class AnalysisResult(db.Model):
     __tablename__ = 'analysis_results'
 
@@ -42,6 +240,51 @@ class AnalysisResult(db.Model):
     tower_count = db.Column(db.Integer, nullable=False)
     first_seen = db.Column(db.DateTime, nullable=False)
     last_seen = db.Column(db.DateTime, nullable=False)
-    movement_path = db.Column(db.JSON)  # Stores array of [lat, lng] coordinates
+    movement_path = db.Column(db.JSON)  # Legacy array of [lat, lng] coordinates, superseded by movement_track
+    movement_track = db.Column(db.Text, nullable=True)  # Polyline-encoded dwell runs, see trajectory.py
     common_contacts = db.Column(db.JSON, nullable=True)  # Store frequently contacted numbers
-    location_frequency = db.Column(db.JSON, nullable=True)  # Store location visit frequency
\ No newline at end of file
+    location_frequency = db.Column(db.JSON, nullable=True)  # Store location visit frequency
+
+    __table_args__ = (
+        # Keyset orders for the history endpoint
+        db.Index('idx_result_date_id', 'analysis_date', 'id'),
+        db.Index('idx_result_towers_id', 'tower_count', 'id'),
+        db.Index('idx_result_mobile_id', 'mobile_number', 'id'),
+    )
+
+class AnalysisJob(db.Model):
+    __tablename__ = 'analysis_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(512), nullable=False)  # Spooled upload awaiting processing
+    mode = db.Column(db.String(20), nullable=False, default='analyze')  # analyze or ingest
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    stage = db.Column(db.String(50), nullable=True)  # ingesting, analyzing
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # Percentage complete
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Worker heartbeat
+    worker_id = db.Column(db.String(100), nullable=True)  # host:pid:boot token of the process running it
+
+    __table_args__ = (
+        db.Index('idx_job_status', 'status'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'mode': self.mode,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 1),
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'result': self.result if self.status == 'completed' else None
+        }
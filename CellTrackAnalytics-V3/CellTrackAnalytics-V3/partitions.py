@@ -0,0 +1,103 @@
+import logging
+import re
+from datetime import datetime
+from typing import Iterable, List, Set
+
+import pandas as pd
+from sqlalchemy import text
+
+from app import db
+from models import TowerRecord
+
+PARTITION_NAME = re.compile(r'^tower_records_p(\d{4})(\d{2})$')
+
+# Months whose partition is known to exist in this process
+_known_partitions: Set[str] = set()
+
+
+def is_partitioned() -> bool:
+    """True when tower_records is a PostgreSQL range-partitioned table"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    relkind = db.session.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+        {'name': TowerRecord.__tablename__}
+    ).scalar()
+    return relkind == 'p'
+
+
+def warn_if_unpartitioned() -> bool:
+    """Warn when tower_records on PostgreSQL is a plain table, e.g. one created before partitioning
+
+    db.create_all() never converts an existing table, so retention falls back to row deletes
+    until the table is recreated as partitioned and its rows copied over.
+    """
+    if db.engine.dialect.name != 'postgresql' or is_partitioned():
+        return False
+    logging.warning(f"{TowerRecord.__tablename__} is not partitioned; prune-records will delete expired rows "
+                    f"one by one instead of dropping monthly partitions. Recreate the table to partition it.")
+    return True
+
+
+def _next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{TowerRecord.__tablename__}_p{month:%Y%m}"
+
+
+def ensure_partitions(timestamps: Iterable) -> List[str]:
+    """Create the monthly partitions covering the given timestamps, returning the new ones"""
+    timestamps = pd.to_datetime(pd.Series(timestamps)).dropna()
+    months = {period.start_time.to_pydatetime() for period in timestamps.dt.to_period('M').unique()}
+    pending = sorted(month for month in months if partition_name(month) not in _known_partitions)
+    if not pending or not is_partitioned():
+        return []
+
+    created = []
+    for month in pending:
+        name = partition_name(month)
+        if db.session.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar():
+            # Only cache committed partitions; a rolled back chunk also rolls back its DDL
+            _known_partitions.add(name)
+            continue
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TowerRecord.__tablename__} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_next_month(month):%Y-%m-%d}')"
+        ))
+        created.append(name)
+
+    if created:
+        logging.info(f"Created record partitions: {', '.join(created)}")
+    return created
+
+
+def list_partitions() -> List[str]:
+    """Monthly partitions attached to tower_records, oldest first"""
+    rows = db.session.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :name"
+    ), {'name': TowerRecord.__tablename__}).scalars()
+    return sorted(name for name in rows if PARTITION_NAME.match(name))
+
+
+def prune_records(cutoff: datetime) -> dict:
+    """Remove records older than the cutoff, dropping whole partitions where possible"""
+    dropped = []
+    if is_partitioned():
+        for name in list_partitions():
+            year, month = PARTITION_NAME.match(name).groups()
+            if _next_month(datetime(int(year), int(month), 1)) <= cutoff:
+                db.session.execute(text(f"DROP TABLE {name}"))
+                _known_partitions.discard(name)
+                dropped.append(name)
+    else:
+        warn_if_unpartitioned()
+
+    # Only the month straddling the cutoff (or the whole table on SQLite) needs row deletes
+    deleted = TowerRecord.query.filter(TowerRecord.timestamp < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return {'dropped_partitions': dropped, 'deleted_rows': deleted}
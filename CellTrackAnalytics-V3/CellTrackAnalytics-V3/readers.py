@@ -0,0 +1,275 @@
+import csv
+import logging
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+
+# Column kinds of the CDR upload schema; unknown columns are not read. Numbers and IMEIs are
+# categorical so ingest maps each distinct value to its dimension key once
+COLUMN_TYPES = {
+    'mobile_number': 'category',
+    'imei': 'category',
+    'timestamp': 'timestamp',
+    'tower_id': 'category',
+    'latitude': 'float',
+    'longitude': 'float',
+    'call_duration': 'float',
+    'call_type': 'category',
+    'connected_number': 'category',
+    'ip_address': 'string',
+}
+
+REQUIRED_COLUMNS = ['mobile_number', 'timestamp', 'tower_id', 'latitude', 'longitude']
+
+VALUE_RANGES = {
+    'latitude': (-90.0, 90.0),
+    'longitude': (-180.0, 180.0),
+    'call_duration': (0.0, np.inf),
+}
+
+COMPRESSION = {'gz': 'gzip', 'zst': 'zstd', 'bz2': 'bz2'}
+
+CSV_EXTENSIONS = ('.csv',) + tuple(f'.csv.{suffix}' for suffix in COMPRESSION)
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# Only the first errors are kept with their row numbers; the rest are just counted
+MAX_REPORTED_ERRORS = 100
+
+# Rough bytes per CSV row, used to size Arrow read blocks from a row chunk size
+BYTES_PER_ROW = 128
+
+
+def is_supported(filename: str) -> bool:
+    return filename.lower().endswith(CSV_EXTENSIONS + EXCEL_EXTENSIONS)
+
+
+def _compression(path: str) -> Optional[str]:
+    return COMPRESSION.get(path.lower().rsplit('.', 1)[-1])
+
+
+def _arrow_type(kind: str, typed: bool):
+    if kind == 'category':
+        return pa.dictionary(pa.int32(), pa.string())
+    if typed and kind == 'timestamp':
+        return pa.timestamp('us')
+    if typed and kind == 'float':
+        return pa.float64()
+    return pa.string()
+
+
+def _as_strings(values: pd.Series) -> pd.Series:
+    """Stringify non-null cells, e.g. numbers read from spreadsheets"""
+    return values.map(str, na_action='ignore')
+
+
+class _SharedHandle:
+    """File proxy that Arrow may close without closing the caller's handle"""
+
+    def __init__(self, handle):
+        self._handle = handle
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._handle, name)
+
+    def close(self):
+        self.closed = True
+
+
+def concat_chunks(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate reader chunks, keeping categorical columns categorical"""
+    if not frames:
+        return pd.DataFrame(columns=list(COLUMN_TYPES))
+    # Recode every chunk onto the union of categories so concat keeps the codes instead of going through object
+    dtypes = {}
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = np.concatenate([frame[column].cat.categories.to_numpy(dtype=object) for frame in frames])
+            dtypes[column] = pd.CategoricalDtype(pd.unique(categories))
+    return pd.concat([frame.astype(dtypes) for frame in frames], ignore_index=True)
+
+
+class CDRReader:
+    """Streams CSV/Excel CDR files into typed, validated chunks
+
+    Rows with a missing or invalid required value are dropped; invalid optional values
+    are cleared and the row kept. The first MAX_REPORTED_ERRORS problems are kept in
+    ``errors`` with their 1-based data row numbers.
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, max_errors: int = MAX_REPORTED_ERRORS):
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.errors: List[Dict] = []
+        self.invalid_rows = 0
+        self.rows_read = 0
+
+    def read(self, path: str) -> pd.DataFrame:
+        with open(path, 'rb') as handle:
+            return concat_chunks(list(self.read_chunks(path, handle)))
+
+    def read_chunks(self, path: str, handle) -> Iterator[pd.DataFrame]:
+        """Yield validated chunks; handle is the open file, so callers can track bytes read"""
+        if path.lower().endswith(CSV_EXTENSIONS):
+            raw_chunks = self._arrow_csv(path, handle)
+        elif path.lower().endswith('.xlsx'):
+            raw_chunks = self._xlsx(path)
+        else:
+            raw_chunks = self._xls(path)
+
+        for chunk in raw_chunks:
+            offset = self.rows_read
+            self.rows_read += len(chunk)
+            yield self._validate(chunk, offset)
+
+    def summary(self) -> Dict:
+        return {'invalid_rows': self.invalid_rows, 'errors': sorted(self.errors, key=lambda error: error['row'])}
+
+    def _header(self, path: str, handle) -> List[str]:
+        handle.seek(0)
+        first_line = self._arrow_stream(path, handle).read(64 * 1024).split(b'\n', 1)[0]
+        header = next(csv.reader([first_line.decode('utf-8-sig').rstrip('\r')]), [])
+        missing = [column for column in REQUIRED_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"Missing required columns: {missing}")
+        return header
+
+    @staticmethod
+    def _arrow_stream(path: str, handle):
+        stream = pa.PythonFile(_SharedHandle(handle), mode='r')
+        compression = _compression(path)
+        return pa.CompressedInputStream(stream, compression) if compression else stream
+
+    def _arrow_csv(self, path: str, handle) -> Iterator[pd.DataFrame]:
+        """Parse with native types first; if a value will not convert, resume as strings"""
+        columns = [column for column in self._header(path, handle) if column in COLUMN_TYPES]
+        yielded = 0
+        for typed in (True, False):
+            handle.seek(0)
+            try:
+                reader = pa_csv.open_csv(
+                    self._arrow_stream(path, handle),
+                    read_options=pa_csv.ReadOptions(
+                        block_size=self.chunk_size * BYTES_PER_ROW,
+                        skip_rows_after_names=yielded
+                    ),
+                    convert_options=pa_csv.ConvertOptions(
+                        column_types={column: _arrow_type(COLUMN_TYPES[column], typed) for column in columns},
+                        include_columns=columns,
+                        strings_can_be_null=True
+                    )
+                )
+                for batch in reader:
+                    if batch.num_rows:
+                        yielded += batch.num_rows
+                        yield batch.to_pandas()
+                return
+            except pa.ArrowInvalid as e:
+                if not typed:
+                    raise ValueError(f"Could not parse CSV: {str(e)}")
+                logging.info(f"Typed CSV parse failed after {yielded} rows, validating as text: {str(e)}")
+
+    def _xlsx(self, path: str) -> Iterator[pd.DataFrame]:
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(col) for col in next(rows, ())]
+            missing = [column for column in REQUIRED_COLUMNS if column not in header]
+            if missing:
+                raise ValueError(f"Missing required columns: {missing}")
+
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.chunk_size:
+                    yield self._from_cells(batch, header)
+                    batch = []
+            if batch:
+                yield self._from_cells(batch, header)
+        finally:
+            workbook.close()
+
+    def _xls(self, path: str) -> Iterator[pd.DataFrame]:
+        # Legacy .xls has no streaming reader, so it is loaded once and sliced
+        df = pd.read_excel(path)
+        missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+        if missing:
+            raise ValueError(f"Missing required columns: {missing}")
+        for start in range(0, len(df), self.chunk_size):
+            yield self._from_cells(df.iloc[start:start + self.chunk_size], list(df.columns))
+
+    @staticmethod
+    def _from_cells(rows, header: List[str]) -> pd.DataFrame:
+        frame = pd.DataFrame(rows, columns=header)
+        frame = frame[[column for column in header if column in COLUMN_TYPES]]
+        for column in frame.columns:
+            if COLUMN_TYPES[column] in ('string', 'category'):
+                frame[column] = _as_strings(frame[column])
+        return frame
+
+    def _validate(self, chunk: pd.DataFrame, offset: int) -> pd.DataFrame:
+        """Coerce text columns to the schema types, clear invalid optional values and drop invalid rows"""
+        chunk = chunk.reset_index(drop=True)
+        invalid = np.zeros(len(chunk), dtype=bool)
+        for column, kind in COLUMN_TYPES.items():
+            if column not in chunk.columns:
+                continue
+            values = chunk[column]
+            bad = np.zeros(len(chunk), dtype=bool)
+            if kind == 'timestamp' and not pd.api.types.is_datetime64_any_dtype(values):
+                chunk[column] = self._parse_timestamps(values)
+                bad |= self._record(chunk[column].isna() & values.notna(), values, column, offset,
+                                    'invalid timestamp')
+            elif kind == 'float' and not pd.api.types.is_float_dtype(values):
+                chunk[column] = pd.to_numeric(values, errors='coerce').astype(float)
+                bad |= self._record(chunk[column].isna() & values.notna(), values, column, offset, 'not a number')
+            elif kind == 'category' and not isinstance(values.dtype, pd.CategoricalDtype):
+                chunk[column] = values.astype('category')
+
+            if column in VALUE_RANGES:
+                low, high = VALUE_RANGES[column]
+                bad |= self._record(~chunk[column].between(low, high) & chunk[column].notna(), values, column,
+                                    offset, f"outside [{low}, {high}]")
+            if column in REQUIRED_COLUMNS:
+                invalid |= bad | self._record(values.isna().to_numpy(), values, column, offset, 'missing value')
+            elif bad.any():
+                # An unusable optional value does not make the rest of the record unusable
+                chunk.loc[bad, column] = np.nan
+
+        self.invalid_rows += int(invalid.sum())
+        if not invalid.any():
+            return chunk
+        valid = chunk[~invalid].reset_index(drop=True)
+        for column in valid.columns:
+            if isinstance(valid[column].dtype, pd.CategoricalDtype):
+                valid[column] = valid[column].cat.remove_unused_categories()
+        return valid
+
+    @staticmethod
+    def _parse_timestamps(values: pd.Series) -> pd.Series:
+        # The format is inferred from the first value; only rows that miss it take the slow mixed-format parse
+        parsed = pd.to_datetime(values, errors='coerce')
+        retry = parsed.isna() & values.notna()
+        if retry.any():
+            parsed[retry] = pd.to_datetime(values[retry], errors='coerce', format='mixed')
+        return parsed
+
+    def _record(self, mask, values: pd.Series, column: str, offset: int, message: str) -> np.ndarray:
+        mask = np.asarray(mask, dtype=bool)
+        room = self.max_errors - len(self.errors)
+        if room > 0 and mask.any():
+            raw = values.to_numpy()
+            self.errors.extend({
+                'row': offset + int(position) + 1,
+                'column': column,
+                'value': None if pd.isna(raw[position]) else str(raw[position]),
+                'error': message
+            } for position in np.flatnonzero(mask)[:room])
+        return mask
@@ -0,0 +1,368 @@
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+from sqlalchemy import and_, between, func, or_, true
+
+from app import app, db
+from models import CellTower, TowerStats
+
+TILE_SIZE = 256  # Web map tile edge in pixels
+MAX_LATITUDE = 85.05112878  # Web Mercator cut-off
+EARTH_RADIUS_M = 6371008.8
+
+GEOHASH_ALPHABET = np.frombuffer(b'0123456789bcdefghjkmnpqrstuvwxyz', dtype=np.uint8)
+GEOHASH_PRECISION = 9  # ~5m cells
+MAX_COVER_CELLS = 32  # Upper bound on geohash ranges used to cover a bbox
+MAX_AGGREGATE_CELLS = 65536  # Upper bound on heat bins a viewport may span, e.g. 4096x4096 px at 16 px bins
+
+
+def encode_geohash(latitudes, longitudes, precision: int = GEOHASH_PRECISION) -> np.ndarray:
+    """Vectorized geohash encoding of coordinate arrays"""
+    latitudes = np.atleast_1d(np.asarray(latitudes, dtype=float))
+    longitudes = np.atleast_1d(np.asarray(longitudes, dtype=float))
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+
+    lon_cells = np.clip(((longitudes + 180.0) / 360.0 * 2 ** lon_bits).astype(np.int64), 0, 2 ** lon_bits - 1)
+    lat_cells = np.clip(((latitudes + 90.0) / 180.0 * 2 ** lat_bits).astype(np.int64), 0, 2 ** lat_bits - 1)
+
+    # Interleave bits, longitude first, most significant bit first
+    code = np.zeros(len(latitudes), dtype=np.int64)
+    for bit in range(total_bits):
+        if bit % 2 == 0:
+            value = (lon_cells >> (lon_bits - 1 - bit // 2)) & 1
+        else:
+            value = (lat_cells >> (lat_bits - 1 - bit // 2)) & 1
+        code = (code << 1) | value
+
+    shifts = 5 * np.arange(precision - 1, -1, -1)
+    chars = GEOHASH_ALPHABET[(code[:, np.newaxis] >> shifts) & 31]
+    return np.ascontiguousarray(chars).view(f'S{precision}').ravel().astype(str)
+
+
+def geohash_cover(south: float, west: float, north: float, east: float) -> List[str]:
+    """Geohash prefixes whose cells together cover the bounding box
+
+    A box with west > east crosses the antimeridian and is covered as its two halves.
+    """
+    if west > east:
+        return sorted(set(geohash_cover(south, west, north, 180.0)) | set(geohash_cover(south, -180.0, north, east)))
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lon_bits = (5 * precision + 1) // 2
+        lat_bits = (5 * precision) // 2
+        cell_width = 360.0 / 2 ** lon_bits
+        cell_height = 180.0 / 2 ** lat_bits
+        first_col, last_col = (int((lon + 180.0) // cell_width) for lon in (west, east))
+        first_row, last_row = (int((lat + 90.0) // cell_height) for lat in (south, north))
+        if (last_col - first_col + 1) * (last_row - first_row + 1) > MAX_COVER_CELLS:
+            continue
+
+        cols, rows = np.meshgrid(np.arange(first_col, last_col + 1), np.arange(first_row, last_row + 1))
+        centers_lon = (cols.ravel() + 0.5) * cell_width - 180.0
+        centers_lat = (rows.ravel() + 0.5) * cell_height - 90.0
+        return sorted(set(encode_geohash(centers_lat, centers_lon, precision)))
+    return ['']
+
+
+def geohash_range_filter(column, prefixes: List[str]):
+    """SQL filter matching any of the prefixes as B-tree friendly range scans"""
+    if not prefixes:
+        raise ValueError('geohash_range_filter needs at least one prefix')
+    clauses = []
+    for prefix in prefixes:
+        if not prefix:
+            return true()
+        upper = _next_prefix(prefix)
+        clauses.append(and_(column >= prefix, column < upper) if upper else column >= prefix)
+    return or_(*clauses)
+
+
+def _next_prefix(prefix: str) -> Optional[str]:
+    """Smallest string greater than every geohash starting with prefix"""
+    alphabet = GEOHASH_ALPHABET.tobytes().decode()
+    while prefix:
+        position = alphabet.index(prefix[-1])
+        if position + 1 < len(alphabet):
+            return prefix[:-1] + alphabet[position + 1]
+        prefix = prefix[:-1]
+    return None
+
+
+def longitude_filter(column, west: float, east: float):
+    """SQL filter for a longitude span, which wraps when it crosses the antimeridian (west > east)"""
+    if west > east:
+        return or_(column >= west, column <= east)
+    return between(column, west, east)
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Return (south, west, north, east) of a slippy-map tile"""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def to_pixels(latitudes: np.ndarray, longitudes: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Project coordinates to global Web Mercator pixel space at a zoom level"""
+    scale = TILE_SIZE * 2 ** zoom
+    lat = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    px = (longitudes + 180.0) / 360.0 * scale
+    py = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * scale
+    return px, py
+
+
+class TowerGridIndex:
+    """In-process grid index over tower coordinates weighted by record counts
+
+    Counts come from the tower_stats rollup, so a build reads one row per tower. Once a
+    snapshot exists, expired or invalidated snapshots are rebuilt on a background thread
+    while requests keep being served from the previous one.
+    """
+
+    def __init__(self, cell_degrees: float = 0.05, ttl: float = 60.0):
+        self.cell_degrees = cell_degrees
+        self.ttl = ttl
+        self._snapshot: Optional[Dict] = None
+        self._built_at = 0.0
+        self._generation = 0  # Bumped by invalidate()
+        self._built_generation = 0  # Generation the current snapshot was read at
+        self._lock = threading.Lock()
+        self._refreshing: Optional[threading.Thread] = None
+
+    def invalidate(self):
+        """Rebuild on next use, e.g. after new records are ingested"""
+        with self._lock:
+            self._generation += 1
+
+    def refresh(self):
+        """Build a new snapshot now and swap it in"""
+        generation = self._generation
+        snapshot = self._build()
+        with self._lock:
+            self._snapshot = snapshot
+            self._built_at = time.monotonic()
+            self._built_generation = generation
+
+    def _current(self) -> Dict:
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._built_generation = self._generation
+                    self._snapshot = self._build()
+                    self._built_at = time.monotonic()
+        elif self._built_generation != self._generation or time.monotonic() - self._built_at > self.ttl:
+            with self._lock:
+                if self._refreshing is None or not self._refreshing.is_alive():
+                    self._refreshing = threading.Thread(target=self._refresh_in_background, daemon=True,
+                                                        name='tower-grid-refresh')
+                    self._refreshing.start()
+        return self._snapshot
+
+    def _refresh_in_background(self):
+        with app.app_context():
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Error rebuilding tower grid index: {str(e)}")
+                # Keep serving the old snapshot and retry once the TTL passes again
+                with self._lock:
+                    self._built_at = time.monotonic()
+            finally:
+                db.session.remove()
+
+    def _build(self) -> Dict:
+        rows = db.session.query(
+            CellTower.id, CellTower.tower_id, CellTower.latitude, CellTower.longitude,
+            func.coalesce(TowerStats.record_count, 0)
+        ).outerjoin(TowerStats, CellTower.id == TowerStats.tower_id).all()
+
+        ids, tower_ids, latitudes, longitudes, counts = zip(*rows) if rows else ((), (), (), (), ())
+        latitudes = np.array(latitudes, dtype=float)
+        longitudes = np.array(longitudes, dtype=float)
+
+        # Order towers by grid row, then column, so a bbox maps onto contiguous row ranges
+        cell_rows = np.floor(latitudes / self.cell_degrees).astype(np.int64)
+        cell_cols = np.floor(longitudes / self.cell_degrees).astype(np.int64)
+        order = np.lexsort((cell_cols, cell_rows))
+
+        latitudes, longitudes = latitudes[order], longitudes[order]
+        return {
+            'ids': np.array(ids, dtype=np.int64)[order],
+            'tower_ids': np.array(tower_ids, dtype=object)[order],
+            'latitudes': latitudes,
+            'longitudes': longitudes,
+            'counts': np.array(counts, dtype=np.int64)[order],
+            'cell_rows': cell_rows[order],
+            # Unit-sphere points make Euclidean chord distance monotonic in great-circle distance
+            'tree': cKDTree(_unit_vectors(latitudes, longitudes)) if len(latitudes) else None,
+        }
+
+    def query_bbox(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """Primary keys of towers inside the bounding box"""
+        snapshot = self._current()
+        return snapshot['ids'][self._bbox_positions(snapshot, south, west, north, east)]
+
+    def _bbox_positions(self, snapshot: Dict, south: float, west: float, north: float, east: float) -> np.ndarray:
+        first_row = math.floor(south / self.cell_degrees)
+        last_row = math.floor(north / self.cell_degrees)
+        start, end = np.searchsorted(snapshot['cell_rows'], [first_row, last_row + 1])
+
+        latitudes = snapshot['latitudes'][start:end]
+        longitudes = snapshot['longitudes'][start:end]
+        inside = (latitudes >= south) & (latitudes <= north)
+        if west <= east:
+            inside &= (longitudes >= west) & (longitudes <= east)
+        else:
+            # Box crosses the antimeridian
+            inside &= (longitudes >= west) | (longitudes <= east)
+        return start + np.flatnonzero(inside)
+
+    def nearest(self, latitude: float, longitude: float, k: int = 5) -> List[Dict]:
+        """The k towers closest to a point, nearest first"""
+        snapshot = self._current()
+        if snapshot['tree'] is None:
+            return []
+        k = min(k, len(snapshot['ids']))
+        chords, positions = snapshot['tree'].query(_unit_vectors([latitude], [longitude])[0], k=k)
+        return self._towers(snapshot, np.atleast_1d(positions), np.atleast_1d(chords))
+
+    def within_radius(self, latitude: float, longitude: float, radius_m: float) -> List[Dict]:
+        """Towers within radius_m metres of a point, nearest first"""
+        snapshot = self._current()
+        if snapshot['tree'] is None:
+            return []
+        point = _unit_vectors([latitude], [longitude])[0]
+        max_chord = 2 * math.sin(min(radius_m / EARTH_RADIUS_M, math.pi) / 2)
+        positions = np.array(snapshot['tree'].query_ball_point(point, max_chord), dtype=np.int64)
+        chords = np.linalg.norm(snapshot['tree'].data[positions] - point, axis=1) if len(positions) else np.array([])
+        order = np.argsort(chords)
+        return self._towers(snapshot, positions[order], chords[order])
+
+    def within_bbox(self, south: float, west: float, north: float, east: float) -> List[Dict]:
+        snapshot = self._current()
+        positions = self._bbox_positions(snapshot, south, west, north, east)
+        return self._towers(snapshot, positions)
+
+    @staticmethod
+    def _towers(snapshot: Dict, positions: np.ndarray, chords: Optional[np.ndarray] = None) -> List[Dict]:
+        towers = []
+        for i, position in enumerate(positions.tolist()):
+            tower = {
+                'id': int(snapshot['ids'][position]),
+                'tower_id': snapshot['tower_ids'][position],
+                'latitude': float(snapshot['latitudes'][position]),
+                'longitude': float(snapshot['longitudes'][position]),
+                'records': int(snapshot['counts'][position])
+            }
+            if chords is not None:
+                tower['distance_m'] = round(2 * EARTH_RADIUS_M * math.asin(min(chords[i] / 2, 1.0)), 1)
+            towers.append(tower)
+        return towers
+
+    def aggregate(self, south: float, west: float, north: float, east: float, zoom: int,
+                  cluster_pixels: int = 64, heat_pixels: int = 16) -> Dict:
+        """Cluster towers and bin record weights for a viewport at a zoom level
+
+        Raises ValueError when the viewport spans more than MAX_AGGREGATE_CELLS heat bins,
+        i.e. a wide bounding box requested at a high zoom.
+        """
+        (left, right), (top, bottom) = to_pixels(np.array([north, south]), np.array([west, east]), zoom)
+        width = right - left if west <= east else right + TILE_SIZE * 2 ** zoom - left
+        cells = math.ceil(width / heat_pixels) * math.ceil((bottom - top) / heat_pixels)
+        if cells > MAX_AGGREGATE_CELLS:
+            raise ValueError(f"Viewport spans {cells} cells at zoom {zoom} (limit {MAX_AGGREGATE_CELLS}); "
+                             f"zoom out or narrow the bounds")
+
+        snapshot = self._current()
+        positions = self._bbox_positions(snapshot, south, west, north, east)
+        latitudes = snapshot['latitudes'][positions]
+        longitudes = snapshot['longitudes'][positions]
+        counts = snapshot['counts'][positions]
+        px, py = to_pixels(latitudes, longitudes, zoom)
+
+        features = []
+        cluster_keys, cluster_index = self._bin(px, py, cluster_pixels)
+        num_clusters = len(cluster_keys)
+        if num_clusters:
+            towers = np.bincount(cluster_index, minlength=num_clusters)
+            records = np.bincount(cluster_index, weights=counts, minlength=num_clusters)
+            # Record-weighted centroid; clusters without records fall back to the plain mean
+            weights = np.where(records[cluster_index] > 0, counts, 1)
+            weight_sums = np.bincount(cluster_index, weights=weights, minlength=num_clusters)
+            centroid_lat = np.bincount(cluster_index, weights=latitudes * weights, minlength=num_clusters) / weight_sums
+            centroid_lng = np.bincount(cluster_index, weights=longitudes * weights, minlength=num_clusters) / weight_sums
+            members = np.empty(num_clusters, dtype=np.int64)
+            members[cluster_index] = positions
+
+            for c in range(num_clusters):
+                properties = {'towers': int(towers[c]), 'records': int(records[c])}
+                if towers[c] == 1:
+                    properties['tower_id'] = snapshot['tower_ids'][members[c]]
+                features.append({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [float(centroid_lng[c]), float(centroid_lat[c])]},
+                    'properties': properties
+                })
+
+        heat = []
+        heat_keys, heat_index = self._bin(px, py, heat_pixels)
+        if len(heat_keys):
+            heat_weights = np.bincount(heat_index, weights=counts, minlength=len(heat_keys))
+            heat_lat = np.bincount(heat_index, weights=latitudes, minlength=len(heat_keys)) / np.bincount(heat_index)
+            heat_lng = np.bincount(heat_index, weights=longitudes, minlength=len(heat_keys)) / np.bincount(heat_index)
+            peak = heat_weights.max() or 1.0
+            heat = [[float(lat), float(lng), float(weight / peak)]
+                    for lat, lng, weight in zip(heat_lat, heat_lng, heat_weights)]
+
+        return {
+            'type': 'FeatureCollection',
+            'features': features,
+            'heat': heat,
+            'zoom': zoom,
+            'bounds': {'south': south, 'west': west, 'north': north, 'east': east}
+        }
+
+    @staticmethod
+    def _bin(px: np.ndarray, py: np.ndarray, pixels: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Group points into square pixel bins; returns unique bin keys and each point's bin index"""
+        if len(px) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        bx = np.floor(px / pixels).astype(np.int64)
+        by = np.floor(py / pixels).astype(np.int64)
+        return np.unique(by * (2 ** 32) + bx, return_inverse=True)
+
+
+def _unit_vectors(latitudes, longitudes) -> np.ndarray:
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def backfill_geohashes(batch_size: int = 5000) -> int:
+    """Populate geohash for towers stored before the column existed"""
+    updated = 0
+    while True:
+        rows = db.session.query(CellTower.id, CellTower.latitude, CellTower.longitude)\
+            .filter(CellTower.geohash.is_(None)).limit(batch_size).all()
+        if not rows:
+            return updated
+        ids, latitudes, longitudes = zip(*rows)
+        hashes = encode_geohash(latitudes, longitudes)
+        db.session.bulk_update_mappings(CellTower, [
+            {'id': tower_id, 'geohash': geohash} for tower_id, geohash in zip(ids, hashes.tolist())
+        ])
+        db.session.commit()
+        updated += len(rows)
+
+
+# Initialize global instance
+tower_grid = TowerGridIndex()
@@ -0,0 +1,140 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const tbody = document.getElementById('historyRows');
+    if (!tbody) {
+        return;
+    }
+
+    const loadMoreBtn = document.getElementById('loadMoreHistory');
+    const view = tbody.dataset.view;
+    let sort = 'analysis_date';
+    let order = 'desc';
+    let nextCursor = null;
+
+    loadMoreBtn.addEventListener('click', function() {
+        loadHistory(nextCursor);
+    });
+
+    // Clicking a sortable header sorts by it, clicking again flips the order
+    document.querySelectorAll('th.sortable').forEach(header => {
+        header.style.cursor = 'pointer';
+        header.addEventListener('click', function() {
+            order = (sort === this.dataset.sort && order === 'desc') ? 'asc' : 'desc';
+            sort = this.dataset.sort;
+            loadHistory(null);
+        });
+    });
+
+    // Fetch one page of summaries; a cursor continues the current listing
+    async function loadHistory(cursor) {
+        try {
+            const params = new URLSearchParams({sort: sort, order: order});
+            if (cursor) {
+                params.set('cursor', cursor);
+            }
+            const response = await fetch(`/api/analysis/results?${params}`);
+            const page = await response.json();
+            if (!response.ok) {
+                throw new Error(page.error || 'Could not load analysis history');
+            }
+
+            if (cursor === null) {
+                tbody.innerHTML = '';
+            }
+            page.results.forEach(result => tbody.appendChild(createRow(result)));
+            nextCursor = page.next_cursor;
+            loadMoreBtn.classList.toggle('d-none', !nextCursor);
+        } catch (error) {
+            alert('Error: ' + error.message);
+        }
+    }
+
+    // Uploaded values are set as text, never parsed as HTML
+    function createRow(result) {
+        const row = document.createElement('tr');
+        const analysisDate = new Date(result.analysis_date).toLocaleString();
+        if (view === 'upload') {
+            appendCells(row, [
+                analysisDate,
+                result.mobile_number,
+                `${new Date(result.first_seen).toLocaleString()} to ${new Date(result.last_seen).toLocaleString()}`,
+                result.tower_count
+            ]);
+            appendButtons(row, [
+                createButton('View Analysis', 'btn btn-sm btn-primary', () => showAnalysis(result.id)),
+                createButton('Export', 'btn btn-sm btn-outline-primary', () => exportData(result.id))
+            ]);
+        } else {
+            appendCells(row, [analysisDate, result.mobile_number, result.tower_count, `${result.duration_hours} hours`]);
+            const badge = document.createElement('span');
+            badge.className = 'badge bg-primary';
+            badge.textContent = 'Movement Pattern';
+            row.appendChild(document.createElement('td')).appendChild(badge);
+            appendButtons(row, [
+                createButton('View Details', 'btn btn-sm btn-primary', () => viewDetails(result.id)),
+                createButton('Show on Map', 'btn btn-sm btn-outline-primary', () => showOnMap(result.id))
+            ]);
+        }
+        return row;
+    }
+
+    function appendCells(row, values) {
+        values.forEach(value => {
+            row.appendChild(document.createElement('td')).textContent = value;
+        });
+    }
+
+    function appendButtons(row, buttons) {
+        const cell = row.appendChild(document.createElement('td'));
+        buttons.forEach((button, index) => {
+            if (index > 0) {
+                cell.appendChild(document.createTextNode(' '));
+            }
+            cell.appendChild(button);
+        });
+    }
+
+    function createButton(label, className, onClick) {
+        const button = document.createElement('button');
+        button.className = className;
+        button.textContent = label;
+        button.addEventListener('click', onClick);
+        return button;
+    }
+
+    loadHistory(null);
+});
+
+// Load the full result, including contacts and the decoded track, only when asked for
+async function viewDetails(resultId) {
+    try {
+        const response = await fetch(`/api/analysis/results/${resultId}`);
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.error || 'Could not load analysis details');
+        }
+
+        const contacts = result.common_contacts || {};
+        const dwellSeconds = result.runs.reduce((total, run) => total + (run.exit - run.enter), 0);
+        const details = document.getElementById('analysisDetails');
+        details.replaceChildren(...[
+            ['Mobile Number', result.mobile_number],
+            ['Observed', `${new Date(result.first_seen).toLocaleString()} to ${new Date(result.last_seen).toLocaleString()}`],
+            ['Towers', result.tower_count],
+            ['Tower Visits', `${result.runs.length} (${Math.round(dwellSeconds / 3600)} hours dwelling)`],
+            ['Most Frequent Contact', contacts.most_frequent || '-'],
+            ['Frequent Contacts', (contacts.frequent_contacts || []).join(', ') || '-']
+        ].map(([label, value]) => {
+            const paragraph = document.createElement('p');
+            paragraph.appendChild(document.createElement('strong')).textContent = `${label}:`;
+            paragraph.appendChild(document.createTextNode(` ${value}`));
+            return paragraph;
+        }));
+        new bootstrap.Modal(document.getElementById('analysisModal')).show();
+    } catch (error) {
+        alert('Error: ' + error.message);
+    }
+}
+
+function showAnalysis(resultId) {
+    viewDetails(resultId);
+}
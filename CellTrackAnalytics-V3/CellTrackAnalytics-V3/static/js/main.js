@@ -31,12 +31,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error(data.error || 'Upload failed');
             }
 
-            // Update visualizations
-            updateMap(data.patterns);
-            updateChart(data.patterns);
-            updateTable(data.patterns);
-            
-            exportBtn.disabled = false;
+            // Analysis runs in the background; poll until the job finishes
+            const job = await pollJob(data.status_url);
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'Analysis failed');
+            }
+
+            window.location.reload();
         } catch (error) {
             alert('Error: ' + error.message);
         } finally {
@@ -95,3 +96,24 @@ function updateTable(patterns) {
 
     window.analysisResults = patterns;
 }
+
+async function pollJob(statusUrl, interval = 1000) {
+    const progressText = document.querySelector('#loadingModal .modal-body p');
+
+    while (true) {
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.error || 'Could not fetch job status');
+        }
+
+        if (progressText) {
+            progressText.textContent = `Processing data... ${job.stage || 'queued'} (${job.progress}%)`;
+        }
+
+        if (job.status === 'completed' || job.status === 'failed') {
+            return job;
+        }
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+}
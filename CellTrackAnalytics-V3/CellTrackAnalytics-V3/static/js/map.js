@@ -45,8 +45,87 @@ document.addEventListener('DOMContentLoaded', function() {
     if (typeof feather !== 'undefined') {
         feather.replace();
     }
+
+    // On the map page, tower data is fetched lazily for the visible viewport
+    if (document.getElementById('towerList')) {
+        viewportLayer = L.layerGroup();
+        map.on('moveend', loadViewport);
+        loadViewport();
+    }
 });
 
+let viewportLayer;
+let viewportRequest = 0;
+
+async function loadViewport() {
+    const bounds = map.getBounds();
+    const params = new URLSearchParams({
+        south: bounds.getSouth(),
+        west: bounds.getWest(),
+        north: bounds.getNorth(),
+        east: bounds.getEast(),
+        zoom: map.getZoom()
+    });
+
+    // Ignore responses that arrive after the user has moved on
+    const requestId = ++viewportRequest;
+    const response = await fetch(`/api/map/clusters?${params}`);
+    if (!response.ok || requestId !== viewportRequest) {
+        return;
+    }
+    const data = await response.json();
+
+    clearLayers();
+    viewportLayer.clearLayers();
+    data.features.forEach(feature => {
+        const [lng, lat] = feature.geometry.coordinates;
+        const props = feature.properties;
+        const marker = props.towers > 1
+            ? L.marker([lat, lng], {
+                icon: L.divIcon({
+                    html: `<div><span>${escapeHtml(props.towers)}</span></div>`,
+                    className: 'marker-cluster marker-cluster-medium',
+                    iconSize: L.point(40, 40)
+                })
+            }).on('click', () => map.setView([lat, lng], map.getZoom() + 2))
+            : L.circleMarker([lat, lng], {radius: 6, color: '#E74C3C'});
+        marker.bindPopup(`Towers: ${escapeHtml(props.towers)}<br>Records: ${escapeHtml(props.records)}` +
+            (props.tower_id ? `<br>Tower ID: ${escapeHtml(props.tower_id)}` : ''));
+        viewportLayer.addLayer(marker);
+    });
+
+    heatmapLayer = L.heatLayer(data.heat, {
+        radius: 25,
+        blur: 15,
+        max: 1.0,
+        gradient: {0.4: 'blue', 0.65: 'lime', 1: 'red'}
+    });
+    markerCluster = viewportLayer;
+    changeView(currentView);
+    updateTowerList(data.features);
+}
+
+function updateTowerList(features) {
+    const list = document.getElementById('towerList');
+    list.innerHTML = '';
+    features
+        .sort((a, b) => b.properties.records - a.properties.records)
+        .slice(0, 100)
+        .forEach(feature => {
+            const [lng, lat] = feature.geometry.coordinates;
+            const props = feature.properties;
+            const item = document.createElement('div');
+            item.className = 'tower-item p-2 border-bottom';
+            item.appendChild(document.createElement('strong')).textContent =
+                props.tower_id ? `Tower ID: ${props.tower_id}` : `${props.towers} towers`;
+            const detail = item.appendChild(document.createElement('div'));
+            detail.className = 'text-muted small';
+            detail.textContent = `Lat: ${lat.toFixed(5)}, Long: ${lng.toFixed(5)} \u00b7 ${props.records} records`;
+            item.addEventListener('click', () => focusLocation(lat, lng));
+            list.appendChild(item);
+        });
+}
+
 function updateMap(patterns) {
     // Clear existing layers
     clearLayers();
@@ -95,7 +174,7 @@ function updateMap(patterns) {
             weight: 3,
             opacity: 0.7,
             smoothFactor: 1
-        }).bindTooltip(path.mobile);
+        }).bindTooltip(escapeHtml(path.mobile));
 
         // Add arrow decorations
         const decorator = L.polylineDecorator(polyline, {
@@ -157,15 +236,22 @@ function clearLayers() {
 function createPopupContent(pattern, index) {
     return `
         <div class="popup-content">
-            <strong>Mobile: ${pattern.mobile_number}</strong><br>
+            <strong>Mobile: ${escapeHtml(pattern.mobile_number)}</strong><br>
             Location ${index + 1} of ${pattern.movement_path.length}<br>
             First seen: ${new Date(pattern.first_seen).toLocaleString()}<br>
             Last seen: ${new Date(pattern.last_seen).toLocaleString()}<br>
-            Total towers: ${pattern.tower_count}
+            Total towers: ${escapeHtml(pattern.tower_count)}
         </div>
     `;
 }
 
+// Leaflet popups and icons take HTML strings, so uploaded values are escaped before going in
+function escapeHtml(value) {
+    return String(value ?? '').replace(/[&<>"']/g, char => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    })[char]);
+}
+
 function showOnMap(mobileNumber) {
     const pattern = window.analysisResults.find(p => p.mobile_number === mobileNumber);
     if (pattern && pattern.movement_path.length > 0) {
@@ -175,7 +261,7 @@ function showOnMap(mobileNumber) {
         // Highlight the selected pattern's markers
         markers.forEach(marker => {
             if (marker.getPopup() && 
-                marker.getPopup().getContent().includes(mobileNumber)) {
+                marker.getPopup().getContent().includes(escapeHtml(mobileNumber))) {
                 marker.openPopup();
             }
         });
@@ -9,41 +9,58 @@ document.addEventListener('DOMContentLoaded', function() {
         updateSearchFields(this.value);
     });
     
+    const loadMoreBtn = document.getElementById('loadMoreResults');
+    let lastSearch = null;
+    let nextCursor = null;
+    
     // Basic Search Form Handler
     basicSearchForm.addEventListener('submit', async function(e) {
         e.preventDefault();
         
-        const searchData = {
+        lastSearch = {
             type: document.getElementById('searchType').value,
             value: document.getElementById('searchValue').value,
             start_date: document.getElementById('startDate').value,
             end_date: document.getElementById('endDate').value
         };
         
+        await runSearch(null);
+    });
+    
+    loadMoreBtn.addEventListener('click', function() {
+        runSearch(nextCursor);
+    });
+    
+    // Fetch one page of results; a cursor continues the previous search
+    async function runSearch(cursor) {
         try {
             const response = await fetch('/api/search', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify(searchData)
+                body: JSON.stringify({...lastSearch, cursor: cursor})
             });
             
-            const results = await response.json();
+            const page = await response.json();
             if (!response.ok) {
-                throw new Error(results.error || 'Search failed');
+                throw new Error(page.error || 'Search failed');
             }
             
-            updateSearchResults(results);
+            updateSearchResults(page.results, cursor === null);
+            nextCursor = page.next_cursor;
+            loadMoreBtn.classList.toggle('d-none', !nextCursor);
         } catch (error) {
             alert('Error: ' + error.message);
         }
-    });
+    }
     
     // Update search results table
-    function updateSearchResults(results) {
+    function updateSearchResults(results, reset) {
         const tbody = document.querySelector('#searchResultsTable tbody');
-        tbody.innerHTML = '';
+        if (reset) {
+            tbody.innerHTML = '';
+        }
         
         results.forEach(result => {
             const row = document.createElement('tr');
@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# app.py reads its configuration at import time, so point everything at a scratch directory first
+_scratch = tempfile.mkdtemp(prefix='celltrack-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_scratch, 'test.db')}"
+os.environ['CDR_ARCHIVE_PATH'] = os.path.join(_scratch, 'archive')
+os.environ['ANOMALY_MODEL_PATH'] = os.path.join(_scratch, 'anomaly_model.npz')
+os.environ['CELL_TOWER_CACHE_PATH'] = os.path.join(_scratch, 'cell_tower_cache.sqlite3')
+os.environ['CELL_TOWER_OFFLINE'] = '1'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """Application context over freshly created tables"""
+    from ai_models import anomaly_detector
+
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        # Fitted models persist to disk; each test starts without one
+        if os.path.exists(anomaly_detector.model_path):
+            os.remove(anomaly_detector.model_path)
+        anomaly_detector.model = None
+        anomaly_detector._model_mtime = None
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_cdr(rows: int, subscribers: int, towers: int = 200, start: str = '2024-01-01', days: int = 90,
+             seed: int = 0) -> pd.DataFrame:
+    """Synthetic upload in the CSV layout, in random (unsorted) time order"""
+    rng = np.random.default_rng(seed)
+    tower = rng.integers(0, towers, rows)
+    return pd.DataFrame({
+        'mobile_number': (9000000000 + rng.integers(0, subscribers, rows)).astype(str),
+        'imei': (350000000000000 + rng.integers(0, subscribers, rows)).astype(str),
+        'timestamp': (pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days * 86400, rows), unit='s'))
+        .strftime('%Y-%m-%d %H:%M:%S'),
+        'tower_id': [f"T{t}" for t in tower],
+        'latitude': np.round(12.9 + tower * 0.01, 6),
+        'longitude': np.round(77.5 + tower * 0.007, 6),
+        'call_duration': rng.integers(0, 600, rows),
+        'call_type': rng.choice(['incoming', 'outgoing', 'missed', 'sms'], rows),
+        'connected_number': (9000000000 + rng.integers(0, subscribers, rows)).astype(str)
+    })
+
+
+@pytest.fixture
+def cdr_file(tmp_path):
+    """Write make_cdr() output to a CSV and return its path"""
+    def write(name: str = 'upload.csv', **kwargs) -> str:
+        path = tmp_path / name
+        make_cdr(**kwargs).to_csv(path, index=False)
+        return str(path)
+    return write
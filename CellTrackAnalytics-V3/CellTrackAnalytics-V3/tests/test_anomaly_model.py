@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from ai_models import anomaly_detector, ANOMALY_FEATURES
+from anomaly_features import fit_anomaly_model, population_features, subscriber_features
+from ingest import TowerIngestor
+from jobs import analyze_upload
+from models import SubscriberStats
+
+
+def test_model_is_fitted_on_the_rollup(app, cdr_file):
+    TowerIngestor().ingest_file(cdr_file(rows=3000, subscribers=60))
+
+    features = population_features()
+    numbers = [row.mobile_number for row in SubscriberStats.query.all()]
+    assert len(features) == len(numbers) == 60
+    by_number = subscriber_features(numbers)
+    assert sorted(map(tuple, features.tolist())) == sorted(map(tuple, by_number.values()))
+
+    assert fit_anomaly_model() == 60
+    np.testing.assert_allclose(anomaly_detector.model['mean'], features.mean(axis=0))
+
+
+def test_upload_scores_without_refitting(app, client, cdr_file):
+    TowerIngestor().ingest_file(cdr_file(rows=3000, subscribers=60))
+    fit_anomaly_model()
+    baseline = {key: np.copy(value) for key, value in anomaly_detector.model.items()}
+
+    # A small, skewed upload must not replace the population baseline
+    path = cdr_file('skewed.csv', rows=400, subscribers=12, towers=3, seed=5)
+    TowerIngestor().ingest_file(path)
+    result = analyze_upload(pd.read_csv(path, dtype={'mobile_number': str, 'connected_number': str}))
+    for key, value in baseline.items():
+        np.testing.assert_array_equal(anomaly_detector.model[key], value)
+
+    # Upload analysis and the endpoint score the same rollup features
+    flags = {row['mobile_number']: row['analysis']['is_anomaly'] for row in result['analysis_results']}
+    response = client.post('/api/detect/anomalies', json={'mobile_numbers': list(flags)}).get_json()
+    assert {row['mobile_number']: row['is_anomaly'] for row in response['results']} == flags
+
+
+def test_first_use_bootstraps_a_model(app, client, cdr_file):
+    TowerIngestor().ingest_file(cdr_file(rows=2000, subscribers=40))
+    assert not anomaly_detector.has_model()
+
+    response = client.post('/api/detect/anomalies', json={'mobile_numbers': ['9000000001']})
+    assert response.status_code == 200
+    assert anomaly_detector.model['n_samples'] == 40
+
+
+def test_empty_input_flags_nothing(app, cdr_file):
+    empty = np.empty((0, len(ANOMALY_FEATURES)))
+    assert anomaly_detector.detect_anomalies(empty).shape == (0,)
+
+    TowerIngestor().ingest_file(cdr_file(rows=3000, subscribers=60))
+    fit_anomaly_model()
+    flags = anomaly_detector.detect_anomalies(empty)
+    assert flags.dtype == bool and flags.shape == (0,)
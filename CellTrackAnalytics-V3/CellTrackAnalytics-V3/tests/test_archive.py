@@ -0,0 +1,92 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from api_integration import DataProcessor
+from archive import CDRArchive, PROCESSING_COLUMNS, cdr_archive, number_buckets
+from conftest import make_cdr
+from ingest import TowerIngestor
+
+
+def archived(archive, **filters):
+    return pd.concat(list(archive.scan_batches(**filters)), ignore_index=True)
+
+
+def by_record(frame):
+    frame = frame.assign(timestamp=pd.to_datetime(frame['timestamp']).astype('datetime64[us]'))
+    columns = ['mobile_number', 'timestamp', 'tower_id', 'call_type', 'connected_number']
+    return frame.astype({column: str for column in columns}).sort_values(columns, ignore_index=True)
+
+
+def test_ingest_writes_day_and_bucket_partitions(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(cdr_archive, 'root', str(tmp_path / 'archive'))
+    cdr = make_cdr(rows=1000, subscribers=30, days=10)
+    cdr.to_csv(tmp_path / 'upload.csv', index=False)
+    TowerIngestor(chunk_size=200).ingest_file(str(tmp_path / 'upload.csv'))
+
+    files = 0
+    for directory, _, names in os.walk(cdr_archive.root):
+        for name in names:
+            files += 1
+            day, bucket = [part.split('=', 1)[1] for part in os.path.relpath(directory, cdr_archive.root).split(os.sep)]
+            records = pq.read_table(os.path.join(directory, name)).to_pandas()
+            assert (records['timestamp'].dt.date.astype(str) == day).all()
+            assert (number_buckets(records['mobile_number']) == int(bucket)).all()
+    assert files > 1
+
+    stored = archived(cdr_archive, columns=PROCESSING_COLUMNS)
+    pd.testing.assert_frame_equal(
+        by_record(stored)[PROCESSING_COLUMNS[:3]], by_record(cdr)[PROCESSING_COLUMNS[:3]]
+    )
+
+
+def test_scan_filters_match_the_records(tmp_path):
+    archive = CDRArchive(str(tmp_path / 'archive'))
+    cdr = make_cdr(rows=2000, subscribers=40, days=30)
+    archive.write(cdr)
+
+    numbers = sorted(cdr['mobile_number'].unique())[:5]
+    start, end = datetime(2024, 1, 5, 12), datetime(2024, 1, 20, 6)
+    stored = archived(archive, start=start, end=end, mobile_numbers=numbers)
+    timestamps = pd.to_datetime(cdr['timestamp'])
+    expected = cdr[cdr['mobile_number'].isin(numbers) & (timestamps >= start) & (timestamps <= end)]
+    assert len(stored) == len(expected) > 0
+    pd.testing.assert_frame_equal(by_record(stored)[['mobile_number', 'timestamp']],
+                                  by_record(expected)[['mobile_number', 'timestamp']])
+
+    # Bucket scans partition the records by number
+    buckets = [archived(archive, columns=['mobile_number'], buckets=[bucket]) for bucket in range(archive.buckets)]
+    assert sum(len(frame) for frame in buckets) == len(cdr)
+    assert sum(frame['mobile_number'].nunique() for frame in buckets) == cdr['mobile_number'].nunique()
+
+
+def test_archive_analysis_matches_in_memory_processing(tmp_path):
+    archive = CDRArchive(str(tmp_path / 'archive'))
+    cdr = make_cdr(rows=1500, subscribers=25, days=20)
+    archive.write(cdr)
+
+    expected = DataProcessor.process_tower_data(archived(archive, columns=PROCESSING_COLUMNS))
+    result = DataProcessor.process_archive(archive, include_patterns=True)
+    # Hubs tied on degree are listed in record order, which differs when reading bucket by bucket
+    hubs = lambda analysis: [hub['degree'] for hub in analysis.pop('top_hubs')]
+    assert hubs(result['network_analysis']) == hubs(expected['network_analysis'])
+    assert result == expected
+    assert DataProcessor.process_archive(archive)['stats'] == expected['stats']
+
+
+def test_prune_drops_expired_days(tmp_path):
+    archive = CDRArchive(str(tmp_path / 'archive'))
+    cdr = make_cdr(rows=1000, subscribers=20, days=10)
+    archive.write(cdr)
+
+    cutoff = datetime(2024, 1, 4, 15)
+    assert archive.prune(cutoff) == 3
+    days = sorted(name for name in os.listdir(archive.root))
+    assert days[0] == 'date=2024-01-04'
+
+    stored = archived(archive)
+    expected = cdr[pd.to_datetime(cdr['timestamp']) >= cutoff]
+    assert len(stored) == len(expected)
+    assert stored['timestamp'].min() >= cutoff
@@ -0,0 +1,53 @@
+import pandas as pd
+
+from bitmaps import RoaringBitmap
+from conftest import make_cdr
+from ingest import TowerIngestor, rebuild_tower_bitmaps
+from models import TowerDayBitmap
+
+
+def bitmap_rows():
+    return {(row.tower_id, row.day): (row.cardinality, RoaringBitmap.deserialize(row.bitmap).to_array().tolist())
+            for row in TowerDayBitmap.query.all()}
+
+
+def test_incremental_bitmaps_match_rebuild(app, cdr_file):
+    # Overlapping uploads revisit tower-days that earlier chunks and files already stored
+    TowerIngestor(chunk_size=200).ingest_file(cdr_file('first.csv', rows=2000, subscribers=50, towers=20, days=10))
+    TowerIngestor(chunk_size=200).ingest_file(cdr_file('second.csv', rows=2000, subscribers=80, towers=20, days=10,
+                                                       seed=1))
+
+    incremental = bitmap_rows()
+    assert all(cardinality > 0 for cardinality, _ in incremental.values())
+    rebuild_tower_bitmaps()
+    assert incremental == bitmap_rows()
+
+
+def test_presence_queries_match_brute_force(app, client, tmp_path):
+    upload = make_cdr(rows=2000, subscribers=60, towers=12, days=6)
+    upload.to_csv(tmp_path / 'upload.csv', index=False)
+    TowerIngestor(chunk_size=300).ingest_file(str(tmp_path / 'upload.csv'))
+    upload['day'] = pd.to_datetime(upload['timestamp']).dt.strftime('%Y-%m-%d')
+
+    def seen(tower, start='0000', end='9999'):
+        rows = upload[(upload['tower_id'] == tower) & upload['day'].between(start, end)]
+        return set(rows['mobile_number'])
+
+    # Connected numbers are subscribers too, so "not" is taken against them as well
+    everyone = set(upload['mobile_number']) | set(upload['connected_number'])
+    a, b, c = upload['tower_id'].value_counts().index[:3]
+    day = upload.loc[upload['tower_id'] == a, 'day'].iloc[0]
+    cases = [
+        ({'and': [{'tower': a, 'start_date': '2024-01-02', 'end_date': '2024-01-04'}, {'tower': b},
+                  {'not': {'tower': c, 'date': day}}]},
+         (seen(a, '2024-01-02', '2024-01-04') & seen(b)) - seen(c, day, day)),
+        ({'or': [{'tower': a, 'date': day}, {'tower': b, 'date': day}]}, seen(a, day, day) | seen(b, day, day)),
+        ({'not': {'tower': a, 'date': day}}, everyone - seen(a, day, day)),
+        ({'and': [{'not': {'tower': a, 'date': day}}, {'not': {'tower': b, 'date': day}}]},
+         everyone - seen(a, day, day) - seen(b, day, day)),
+    ]
+    for expression, expected in cases:
+        assert expected
+        response = client.post('/api/towers/presence', json={'expression': expression, 'limit': 100000}).get_json()
+        assert response['count'] == len(expected)
+        assert set(response['mobile_numbers']) == expected
@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+import colocation
+from conftest import make_cdr
+from ingest import TowerIngestor
+
+
+@pytest.mark.parametrize('window_minutes', [1, 30, 600])
+def test_colocations_match_brute_force(app, client, tmp_path, monkeypatch, window_minutes):
+    # Few ranges per query so the target's windows span several batched range scans
+    monkeypatch.setattr(colocation, 'RANGES_PER_QUERY', 7)
+    upload = make_cdr(rows=3000, subscribers=40, towers=15, days=3)
+    upload.to_csv(tmp_path / 'upload.csv', index=False)
+    TowerIngestor().ingest_file(str(tmp_path / 'upload.csv'))
+
+    upload['timestamp'] = pd.to_datetime(upload['timestamp'])
+    target = upload['mobile_number'].iloc[0]
+    others = upload[upload['mobile_number'] != target]
+    pairs = others.merge(upload.loc[upload['mobile_number'] == target, ['tower_id', 'timestamp']],
+                         on='tower_id', suffixes=('', '_target'))
+    pairs = pairs[(pairs['timestamp'] - pairs['timestamp_target']).abs() <= pd.Timedelta(minutes=window_minutes)]
+    # Each of the other number's pings counts once, however many target pings it is near
+    expected = pairs.drop_duplicates(['mobile_number', 'tower_id', 'timestamp']).groupby('mobile_number').size()
+    assert not expected.empty
+
+    response = client.post('/api/colocation', json={
+        'mobile_number': target, 'window_minutes': window_minutes, 'limit': 1000
+    }).get_json()
+    assert {row['mobile_number']: row['co_occurrences'] for row in response['results']} == expected.to_dict()
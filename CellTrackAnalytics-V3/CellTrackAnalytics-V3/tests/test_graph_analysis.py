@@ -0,0 +1,66 @@
+from collections import deque
+
+import numpy as np
+import pytest
+
+from graph_analysis import ContactGraph
+
+
+def random_calls(seed, nodes=150, calls=70):
+    """Sparse random calls with repeats, reversed repeats and self-calls, so there are several components"""
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, nodes, calls)
+    targets = rng.integers(0, nodes, calls)
+    targets[:8] = sources[:8]
+    sources = np.concatenate([sources, targets[10:20], sources[20:25]])
+    targets = np.concatenate([targets, sources[10:20], targets[20:25]])
+    return [f"9{n:09d}" for n in sources], [f"9{n:09d}" for n in targets]
+
+
+def reference_graph(sources, targets):
+    """Adjacency sets and BFS components, one call at a time"""
+    adjacency = {}
+    for source, target in zip(sources, targets):
+        adjacency.setdefault(source, set()).add(target)
+        adjacency.setdefault(target, set()).add(source)
+
+    components, seen = [], set()
+    for start in adjacency:
+        if start in seen:
+            continue
+        component, queue = set(), deque([start])
+        seen.add(start)
+        while queue:
+            node = queue.popleft()
+            component.add(node)
+            for neighbor in adjacency[node] - seen:
+                seen.add(neighbor)
+                queue.append(neighbor)
+        components.append(frozenset(component))
+    return adjacency, components
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_graph_matches_brute_force(seed):
+    sources, targets = random_calls(seed)
+    adjacency, components = reference_graph(sources, targets)
+    graph = ContactGraph(np.array(sources), np.array(targets))
+
+    assert graph.num_nodes == len(adjacency) and graph.num_calls == len(sources)
+    assert len(graph.edge_low) == len({frozenset(pair) for pair in zip(sources, targets)})
+    for node, number in enumerate(graph.numbers):
+        # A self-call is one adjacency entry, so it adds one to the degree
+        assert {graph.numbers[neighbor] for neighbor in graph.neighbors(node)} == adjacency[number]
+        assert graph.degrees[node] == len(adjacency[number])
+
+    labels = graph.connected_components()
+    found = {}
+    for node, label in enumerate(labels.tolist()):
+        found.setdefault(label, set()).add(graph.numbers[node])
+    assert {frozenset(component) for component in found.values()} == set(components)
+    assert graph.component_sizes().tolist() == sorted((len(c) for c in components), reverse=True)
+    assert len(components) > 1
+
+    # Ties on degree keep first-appearance order
+    order = sorted(adjacency, key=lambda number: (-len(adjacency[number]), graph.numbers.index(number)))
+    assert [hub['number'] for hub in graph.top_hubs(10)] == order[:10]
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from models import AnalysisResult
+
+
+@pytest.mark.parametrize('sort', ['analysis_date', 'mobile_number', 'tower_count'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_history_pages_cover_every_result_once(app, client, sort, order):
+    base = datetime(2024, 1, 1)
+    db.session.add_all(AnalysisResult(
+        analysis_date=base + timedelta(hours=i % 3), mobile_number=f"90000000{i % 5:02d}", tower_count=i % 4,
+        first_seen=base, last_seen=base + timedelta(hours=i)
+    ) for i in range(120))
+    db.session.commit()
+
+    ids, cursor = [], None
+    while True:
+        params = {'sort': sort, 'order': order, 'limit': 7}
+        if cursor:
+            params['cursor'] = cursor
+        page = client.get('/api/analysis/results', query_string=params).get_json()
+        ids.extend(row['id'] for row in page['results'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    rows = AnalysisResult.query.all()
+    expected = [row.id for row in sorted(rows, key=lambda row: (getattr(row, sort), row.id), reverse=order == 'desc')]
+    assert ids == expected
@@ -0,0 +1,89 @@
+import os
+import socket
+from datetime import datetime, timedelta
+
+import jobs
+from app import db
+from jobs import job_queue
+from models import AnalysisJob, AnalysisResult
+from readers import CDRReader
+
+
+def running_job(worker_id, heartbeat=None):
+    job = AnalysisJob(filename='upload.csv', file_path='/nonexistent.csv', status='running', worker_id=worker_id,
+                      started_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    if heartbeat is not None:
+        AnalysisJob.query.filter_by(id=job.id).update({'updated_at': heartbeat})
+        db.session.commit()
+    return job.id
+
+
+def test_resume_fails_recently_orphaned_jobs(app):
+    now = datetime.utcnow()
+    host = socket.gethostname()
+    ours = running_job(job_queue.worker_id)
+    # Same host and pid but another boot token: the process that owned it has restarted
+    restarted = running_job(f"{host}:{os.getpid()}:00000000", heartbeat=now)
+    other_host_active = running_job('elsewhere:1:abcd', heartbeat=now)
+    other_host_stale = running_job('elsewhere:1:abcd', heartbeat=now - timedelta(hours=1))
+
+    job_queue.resume_pending()
+
+    status = {job.id: job.status for job in AnalysisJob.query.all()}
+    assert status == {ours: 'running', restarted: 'failed', other_host_active: 'running',
+                      other_host_stale: 'failed'}
+
+
+def test_status_endpoint_rechecks_orphans(app, client):
+    job_id = running_job(f"{socket.gethostname()}:{os.getpid()}:00000000")
+    assert client.get(f'/api/jobs/{job_id}').get_json()['status'] == 'failed'
+
+
+def test_failed_analysis_leaves_no_partial_results(app, cdr_file, monkeypatch):
+    calls = []
+
+    def failing_encode(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 5:
+            raise RuntimeError('boom')
+        return ''
+
+    monkeypatch.setattr(jobs, 'encode_track', failing_encode)
+    job = AnalysisJob(filename='upload.csv', file_path=cdr_file(rows=500, subscribers=20), status='queued')
+    db.session.add(job)
+    db.session.commit()
+
+    job_queue._run(job.id)
+
+    db.session.expire_all()
+    job = db.session.get(AnalysisJob, job.id)
+    assert job.status == 'failed' and job.stage == 'analyzing' and job.progress > 50.0
+    assert AnalysisResult.query.count() == 0
+
+
+def test_file_analysis_runs_in_bounded_batches(app, cdr_file, monkeypatch):
+    path = cdr_file(rows=3000, subscribers=60)
+    expected = jobs.analyze_upload(CDRReader().read(path))
+    AnalysisResult.query.delete()
+    db.session.commit()
+
+    batch_rows = []
+    analyze_subscribers = jobs.analyze_subscribers
+
+    def spy(df, progress=None):
+        batch_rows.append(len(df))
+        return analyze_subscribers(df, progress)
+
+    monkeypatch.setattr(jobs, 'analyze_subscribers', spy)
+    monkeypatch.setattr(jobs, 'ANALYSIS_BATCH_ROWS', 400)
+    result = jobs.analyze_file(path, chunk_size=250)
+
+    # The whole upload is never analyzed at once, and no subscriber is split across batches
+    assert len(batch_rows) > 1 and max(batch_rows) <= 400 and sum(batch_rows) == 3000
+    assert AnalysisResult.query.count() == 60
+    by_number = lambda results: sorted(results, key=lambda item: item['mobile_number'])
+    assert by_number(result['analysis_results']) == by_number(expected['analysis_results'])
+    assert result['statistics'] == expected['statistics']
+    assert result['network_analysis'] == expected['network_analysis']
@@ -0,0 +1,94 @@
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from app import db
+from ingest import rebuild_subscriber_stats
+from migrations import upgrade_schema
+from spatial_index import backfill_geohashes, encode_geohash
+from models import CellTower, TowerRecord, Subscriber, Device, SubscriberStats
+
+# Tables as created before the geohash column and the subscriber/device dimensions
+LEGACY_TOWERS_DDL = """
+CREATE TABLE cell_towers (
+    id INTEGER NOT NULL PRIMARY KEY,
+    tower_id VARCHAR(50) NOT NULL UNIQUE,
+    latitude FLOAT NOT NULL,
+    longitude FLOAT NOT NULL,
+    created_at DATETIME
+)
+"""
+LEGACY_RECORDS_DDL = """
+CREATE TABLE tower_records (
+    id INTEGER NOT NULL PRIMARY KEY,
+    mobile_number VARCHAR(20) NOT NULL,
+    imei VARCHAR(20),
+    timestamp DATETIME NOT NULL,
+    tower_id INTEGER NOT NULL REFERENCES cell_towers (id),
+    call_duration INTEGER,
+    call_type VARCHAR(20),
+    connected_number VARCHAR(20),
+    ip_address VARCHAR(45),
+    device_info JSON,
+    created_at DATETIME
+)
+"""
+LEGACY_INDEXES = [
+    "CREATE INDEX idx_mobile_timestamp ON tower_records (mobile_number, timestamp)",
+    "CREATE INDEX idx_imei ON tower_records (imei)",
+    "CREATE INDEX idx_connected_number ON tower_records (connected_number)",
+    "CREATE INDEX idx_tower_timestamp ON tower_records (tower_id, timestamp)",
+]
+
+
+def create_legacy_records():
+    db.drop_all()
+    with db.engine.begin() as connection:
+        connection.execute(text(LEGACY_TOWERS_DDL))
+        connection.execute(text(LEGACY_RECORDS_DDL))
+        for statement in LEGACY_INDEXES:
+            connection.execute(text(statement))
+        connection.execute(text(
+            "INSERT INTO cell_towers (id, tower_id, latitude, longitude) VALUES (1, 'T1', 12.9, 77.5), (2, 'T2', 13.0, 77.6)"
+        ))
+        connection.execute(text(
+            "INSERT INTO tower_records (id, mobile_number, imei, timestamp, tower_id, call_duration, call_type, "
+            "connected_number) VALUES "
+            "(5, '900', '3501', '2024-01-01 10:00:00.000000', 1, 60, 'outgoing', '901'), "
+            "(9, '900', NULL, '2024-01-01 11:00:00.000000', 2, NULL, 'sms', NULL), "
+            "(12, '901', '3502', '2024-01-02 09:30:00.000000', 2, 30, 'incoming', '900')"
+        ))
+    db.create_all()
+
+
+def test_legacy_records_move_to_dimension_keys(app):
+    create_legacy_records()
+
+    assert upgrade_schema()
+    assert not upgrade_schema()
+
+    records = {row.id: row for row in TowerRecord.query.all()}
+    assert sorted(records) == [5, 9, 12]
+    assert (records[5].mobile_number, records[5].imei, records[5].connected_number) == ('900', '3501', '901')
+    assert (records[9].imei, records[9].connected_number, records[9].call_duration) == (None, None, None)
+    assert records[12].timestamp == datetime(2024, 1, 2, 9, 30)
+    assert {row.mobile_number for row in Subscriber.query.all()} == {'900', '901'}
+    assert {row.imei for row in Device.query.all()} == {'3501', '3502'}
+    assert TowerRecord.query.filter(TowerRecord.mobile_number == '900').count() == 2
+
+    # New rows continue after the copied ids, and the rollups rebuild from the moved records
+    db.session.add(TowerRecord(subscriber_id=records[5].subscriber_id, timestamp=datetime(2024, 1, 3), tower_id=1))
+    db.session.commit()
+    assert TowerRecord.query.order_by(TowerRecord.id.desc()).first().id > 12
+    rebuild_subscriber_stats()
+    assert db.session.get(SubscriberStats, '900').record_count == 3
+
+
+def test_missing_columns_are_added_with_their_indexes(app):
+    create_legacy_records()
+
+    assert upgrade_schema()
+    assert 'geohash' in {column['name'] for column in inspect(db.engine).get_columns('cell_towers')}
+    assert any(index['column_names'] == ['geohash'] for index in inspect(db.engine).get_indexes('cell_towers'))
+    assert backfill_geohashes() == 2
+    assert db.session.get(CellTower, 1).geohash == encode_geohash([12.9], [77.5])[0]
@@ -0,0 +1,78 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ai_models import movement_analyzer
+from app import movement_records
+from conftest import make_cdr
+from ingest import TowerIngestor
+
+
+def test_single_ping_has_stay_points():
+    result = movement_analyzer.analyze_movement_patterns(np.array([[12.9, 77.5]]), np.array([1704067200]))
+    assert result['stay_points'] == []
+    assert movement_analyzer.analyze_movement_patterns_batch([(np.array([[12.9, 77.5]]), np.array([0]))])[0][
+        'stay_points'] == []
+
+
+@pytest.fixture
+def non_utc_host():
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'America/New_York'
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+
+def test_stored_records_use_utc_epochs(app, cdr_file, non_utc_host):
+    path = cdr_file(rows=200, subscribers=2)
+    TowerIngestor().ingest_file(path)
+    upload = pd.read_csv(path, dtype={'mobile_number': str})
+    number = upload['mobile_number'].iloc[0]
+
+    _, timestamps, _ = movement_records(number)
+    expected = np.sort(pd.to_datetime(upload.loc[upload['mobile_number'] == number, 'timestamp'])
+                       .to_numpy(dtype='datetime64[s]').astype(np.int64))
+    np.testing.assert_array_equal(timestamps, expected)
+
+
+def test_parallel_batch_matches_serial():
+    rng = np.random.default_rng(3)
+    subscribers = []
+    for _ in range(25):
+        count = int(rng.integers(1, 80))
+        towers = rng.integers(0, 3, count)
+        coordinates = np.column_stack([12.9 + towers * 0.01, 77.5 + towers * 0.007])
+        subscribers.append((coordinates, np.sort(rng.integers(0, 86400, count))))
+
+    serial = [movement_analyzer.analyze_movement_patterns(*pair) for pair in subscribers]
+    assert any(result['stay_points'] for result in serial)
+    assert movement_analyzer.analyze_movement_patterns_batch(subscribers, n_jobs=2, chunk_size=4) == serial
+
+
+def test_incremental_movement_matches_fresh(app, client, tmp_path):
+    from analysis_cache import analysis_cache
+
+    def analyze(fresh=False):
+        if fresh:
+            analysis_cache.clear()
+            movement_analyzer.clear()
+        return client.post('/api/analyze/movement', json={'mobile_number': number}).get_json()['movement_analysis']
+
+    movement_analyzer.clear()
+    upload = make_cdr(rows=900, subscribers=3, towers=3, days=3).sort_values('timestamp', kind='stable')
+    number = upload['mobile_number'].iloc[0]
+    # The middle third first, then newer records (folded in), then older ones (state rebuilt)
+    for part, rows in enumerate([upload.iloc[300:600], upload.iloc[600:], upload.iloc[:300]]):
+        rows.to_csv(tmp_path / f"part{part}.csv", index=False)
+        TowerIngestor().ingest_file(str(tmp_path / f"part{part}.csv"))
+        incremental = analyze()
+        assert incremental['stay_points']
+        assert incremental == analyze(fresh=True)
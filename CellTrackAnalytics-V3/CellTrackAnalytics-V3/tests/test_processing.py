@@ -0,0 +1,78 @@
+import inspect
+
+import numpy as np
+import pandas as pd
+
+from api_integration import DataProcessor
+from conftest import make_cdr
+from utils import calculate_movement_patterns
+
+
+def reference_patterns(df: pd.DataFrame):
+    """Per-number patterns computed the straightforward way, one subscriber at a time"""
+    patterns = []
+    for number, group in df.sort_values(['mobile_number', 'timestamp'], kind='stable').groupby('mobile_number'):
+        contacts = pd.Series([n for n in group['connected_number'] if isinstance(n, str) and n])
+        network = {}
+        if not contacts.empty:
+            frequency = contacts.value_counts()
+            network = {
+                'most_frequent': frequency.index[0],
+                'contact_count': len(frequency),
+                'frequent_contacts': frequency[frequency >= 3].index.tolist()
+            }
+        patterns.append({
+            'mobile_number': number,
+            'tower_count': group['tower_id'].nunique(),
+            'first_seen': group['timestamp'].min().isoformat(),
+            'last_seen': group['timestamp'].max().isoformat(),
+            'total_records': len(group),
+            'movement_path': group[['latitude', 'longitude']].to_numpy(dtype=float).tolist(),
+            'avg_call_duration': float(group['call_duration'].mean()),
+            'max_call_duration': float(group['call_duration'].max()),
+            'contact_network': network
+        })
+    return patterns
+
+
+def reference_movement_patterns(df: pd.DataFrame):
+    """The original calculate_movement_patterns: one filter and sort per number, in first-appearance order"""
+    patterns = []
+    for number in df['mobile_number'].unique():
+        number_data = df[df['mobile_number'] == number].sort_values('timestamp', kind='stable')
+        patterns.append({
+            'mobile_number': number,
+            'tower_count': len(number_data['tower_id'].unique()),
+            'first_seen': number_data['timestamp'].min().isoformat(),
+            'last_seen': number_data['timestamp'].max().isoformat(),
+            'movement_path': number_data[['latitude', 'longitude']].values.tolist()
+        })
+    return patterns
+
+
+def test_patterns_match_reference():
+    df = make_cdr(rows=3000, subscribers=40, towers=30, days=5)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    rng = np.random.default_rng(7)
+    # Missing durations and blank contacts are skipped, as in the per-number computation
+    df['call_duration'] = df['call_duration'].astype(float).mask(rng.random(len(df)) < 0.1)
+    df['connected_number'] = df['connected_number'].mask(rng.random(len(df)) < 0.1, '')
+
+    result = DataProcessor.process_tower_data(df)
+    assert result['patterns'] == reference_patterns(df)
+
+
+def test_movement_patterns_match_per_number_loop():
+    df = make_cdr(rows=2000, subscribers=30, towers=40, days=3)
+    # Numbers with a single ping, mixed into the (already time-unsorted) upload
+    singles = make_cdr(rows=5, subscribers=5, seed=3).assign(mobile_number=[f"80000000{i:02d}" for i in range(5)])
+    df = pd.concat([df, singles], ignore_index=True).sample(frac=1, random_state=11, ignore_index=True)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+
+    expected = reference_movement_patterns(df)
+    assert len(expected) == 35
+    assert calculate_movement_patterns(df) == expected
+
+    streamed = calculate_movement_patterns(df, stream=True)
+    assert inspect.isgenerator(streamed)
+    assert list(streamed) == expected
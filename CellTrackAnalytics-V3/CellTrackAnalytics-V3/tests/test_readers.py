@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from conftest import make_cdr
+from readers import CDRReader
+
+
+def read(path, **kwargs):
+    reader = CDRReader(**kwargs)
+    return reader.read(str(path)), reader
+
+
+def test_compressed_csv_matches_plain(tmp_path):
+    cdr = make_cdr(rows=300, subscribers=10)
+    cdr.to_csv(tmp_path / 'upload.csv', index=False)
+    cdr.to_csv(tmp_path / 'upload.csv.gz', index=False)
+    with pa.CompressedOutputStream(str(tmp_path / 'upload.csv.zst'), 'zstd') as stream:
+        stream.write(cdr.to_csv(index=False).encode())
+
+    plain, _ = read(tmp_path / 'upload.csv', chunk_size=50)
+    for name in ('upload.csv.gz', 'upload.csv.zst'):
+        compressed, reader = read(tmp_path / name, chunk_size=50)
+        pd.testing.assert_frame_equal(compressed, plain)
+        assert reader.rows_read == 300 and reader.invalid_rows == 0
+
+
+def test_xlsx_matches_csv(tmp_path):
+    pytest.importorskip('openpyxl')
+    cdr = make_cdr(rows=120, subscribers=5)
+    cdr.to_csv(tmp_path / 'upload.csv', index=False)
+    cdr.to_excel(tmp_path / 'upload.xlsx', index=False)
+
+    from_csv, _ = read(tmp_path / 'upload.csv')
+    from_xlsx, reader = read(tmp_path / 'upload.xlsx', chunk_size=50)
+    assert reader.rows_read == 120 and reader.invalid_rows == 0
+    pd.testing.assert_frame_equal(from_xlsx.astype(str), from_csv.astype(str))
+
+
+def test_typed_parse_falls_back_to_strings(tmp_path):
+    # The bad value sits well past the first Arrow block, so typed chunks were already yielded
+    cdr = make_cdr(rows=2000, subscribers=20).astype({'latitude': object})
+    cdr.loc[1500, 'latitude'] = 'north'
+    cdr.to_csv(tmp_path / 'upload.csv', index=False)
+
+    df, reader = read(tmp_path / 'upload.csv', chunk_size=100)
+    assert len(df) == 1999 and reader.rows_read == 2000
+    assert reader.summary() == {'invalid_rows': 1, 'errors': [
+        {'row': 1501, 'column': 'latitude', 'value': 'north', 'error': 'not a number'}
+    ]}
+    expected = cdr.drop(index=1500)
+    assert df['mobile_number'].astype(str).tolist() == expected['mobile_number'].tolist()
+    assert np.allclose(df['latitude'], expected['latitude'].astype(float))
+
+
+def test_invalid_values_report_one_based_rows(tmp_path):
+    cdr = make_cdr(rows=10, subscribers=3).astype({'call_duration': object})
+    cdr.loc[1, 'timestamp'] = 'yesterday'
+    cdr.loc[4, 'longitude'] = 200.0
+    cdr.loc[6, 'call_duration'] = -5
+    cdr.loc[8, 'call_duration'] = 'long'
+    cdr.to_csv(tmp_path / 'upload.csv', index=False)
+
+    df, reader = read(tmp_path / 'upload.csv', chunk_size=4)
+    errors = {(error['row'], error['column']) for error in reader.summary()['errors']}
+    assert errors == {(2, 'timestamp'), (5, 'longitude'), (7, 'call_duration'), (9, 'call_duration')}
+
+    # Rows with bad required values are dropped; a bad call_duration only clears that field
+    assert reader.invalid_rows == 2 and len(df) == 8
+    kept = cdr.drop(index=[1, 4]).reset_index(drop=True)
+    assert df['mobile_number'].astype(str).tolist() == kept['mobile_number'].tolist()
+    assert df['call_duration'].isna().tolist() == [value in (-5, 'long') for value in kept['call_duration']]
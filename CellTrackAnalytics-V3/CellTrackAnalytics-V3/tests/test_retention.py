@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from ai_models import movement_analyzer
+from app import db
+from archive import cdr_archive
+from conftest import make_cdr
+from ingest import TowerIngestor
+from models import AnalysisCacheEntry, TowerDayBitmap, TowerRecord, TravelAnomaly
+
+
+def test_prune_commits_every_expired_row(app, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(cdr_archive, 'root', str(tmp_path / 'archive'))
+    upload = make_cdr(rows=3000, subscribers=15, towers=25, days=20).sort_values('timestamp', kind='stable')
+    upload.to_csv(tmp_path / 'upload.csv', index=False)
+    TowerIngestor(chunk_size=500).ingest_file(str(tmp_path / 'upload.csv'))
+    number = upload['mobile_number'].iloc[0]
+    assert client.post('/api/analyze/movement', json={'mobile_number': number}).status_code == 200
+    assert number in movement_analyzer._states
+
+    # The cutoff lands during 2024-01-10, so everything before that day is expired
+    cutoff = datetime(2024, 1, 10)
+    days = (datetime.utcnow() - cutoff).days
+    result = app.test_cli_runner().invoke(args=['prune-records', '--days', str(days)])
+    assert result.exit_code == 0, result.output
+
+    # Anything the command left uncommitted is discarded here
+    db.session.rollback()
+    assert TowerRecord.query.filter(TowerRecord.timestamp < cutoff).count() == 0
+    assert TowerDayBitmap.query.filter(TowerDayBitmap.day < cutoff.date()).count() == 0
+    assert TravelAnomaly.query.filter(TravelAnomaly.departed_at < cutoff).count() == 0
+    assert TowerRecord.query.count() and TowerDayBitmap.query.count() and TravelAnomaly.query.count()
+    # Detector states folded from the removed records are dropped along with the cached results
+    assert not movement_analyzer._states and AnalysisCacheEntry.query.count() == 0
@@ -0,0 +1,96 @@
+import threading
+
+import numpy as np
+from sqlalchemy import func
+
+from app import db
+from ingest import TowerIngestor, rebuild_tower_stats
+from models import TowerRecord, TowerStats
+from spatial_index import TowerGridIndex, encode_geohash, geohash_cover
+from conftest import make_cdr
+
+
+def record_counts():
+    return dict(db.session.query(TowerRecord.tower_id, func.count()).group_by(TowerRecord.tower_id).all())
+
+
+def test_tower_stats_match_records(app, cdr_file):
+    TowerIngestor(chunk_size=300).ingest_file(cdr_file(rows=1500, subscribers=20, towers=40))
+    TowerIngestor(chunk_size=300).ingest_file(cdr_file('again.csv', rows=500, subscribers=20, towers=40, seed=1))
+
+    expected = record_counts()
+    assert dict(db.session.query(TowerStats.tower_id, TowerStats.record_count).all()) == expected
+    rebuild_tower_stats()
+    assert dict(db.session.query(TowerStats.tower_id, TowerStats.record_count).all()) == expected
+
+
+def test_grid_serves_old_snapshot_while_refreshing(app, cdr_file, monkeypatch):
+    TowerIngestor().ingest_file(cdr_file(rows=300, subscribers=10, towers=20))
+    grid = TowerGridIndex()
+    old = grid._current()
+    assert dict(zip(old['ids'].tolist(), old['counts'].tolist())) == record_counts()
+
+    # Hold the background build until the request has been answered from the old snapshot
+    release = threading.Event()
+    build = grid._build
+    monkeypatch.setattr(grid, '_build', lambda: release.wait(5) and build())
+    grid.invalidate()
+    assert grid._current() is old
+
+    release.set()
+    grid._refreshing.join(5)
+    assert grid._current() is not old
+
+
+def random_boxes(rng, count):
+    for _ in range(count):
+        south = rng.uniform(-80, 75)
+        north = south + rng.uniform(1e-4, 5)
+        west = rng.uniform(-180, 180)
+        east = west + rng.uniform(1e-4, 20)
+        # Boxes pushed past 180 wrap round to a west > east box across the antimeridian
+        yield south, west, north, east - 360 if east > 180 else east
+
+
+def test_geohash_cover_contains_bbox():
+    rng = np.random.default_rng(0)
+    for south, west, north, east in random_boxes(rng, 300):
+        prefixes = geohash_cover(south, west, north, east)
+        assert prefixes
+        width = east - west if west <= east else east + 360 - west
+        latitudes = rng.uniform(south, north, 200)
+        longitudes = (west + rng.uniform(0, width, 200) + 180) % 360 - 180
+        for geohash in encode_geohash(latitudes, longitudes):
+            assert any(geohash.startswith(prefix) for prefix in prefixes), (south, west, north, east)
+
+
+def test_geo_fence_search_across_antimeridian(app, client, tmp_path):
+    upload = make_cdr(rows=300, subscribers=5, towers=6)
+    upload['longitude'] = upload['tower_id'].map({'T0': 179.5, 'T1': 179.9, 'T2': -179.8, 'T3': -179.2,
+                                                 'T4': 170.0, 'T5': -170.0})
+    upload['latitude'] = 10.0
+    path = tmp_path / 'pacific.csv'
+    upload.to_csv(path, index=False)
+    TowerIngestor().ingest_file(str(path))
+
+    response = client.post('/api/search', json={
+        'type': 'geo_fence', 'bounds': {'south': 9, 'west': 179, 'north': 11, 'east': -179}, 'limit': 1000
+    }).get_json()
+    assert {row['location']['lng'] for row in response['results']} == {179.5, 179.9, -179.8, -179.2}
+    assert len(response['results']) == upload['tower_id'].isin(['T0', 'T1', 'T2', 'T3']).sum()
+
+
+def test_map_aggregates_are_bounded_by_viewport_cells(app, client, cdr_file):
+    TowerIngestor().ingest_file(cdr_file(rows=300, subscribers=10, towers=20))
+    world = {'south': -85, 'west': -180, 'north': 85, 'east': 180}
+
+    overview = client.get('/api/map/clusters', query_string={**world, 'zoom': 2})
+    assert overview.status_code == 200 and overview.get_json()['features']
+    # The same box at street level would span millions of bins
+    assert client.get('/api/map/clusters', query_string={**world, 'zoom': 16}).status_code == 400
+    # A narrow box crossing the antimeridian is measured the short way round
+    assert client.get('/api/map/clusters', query_string={
+        'south': -1, 'west': 179.9, 'north': -0.9, 'east': -179.9, 'zoom': 12
+    }).status_code == 200
+    # Tiles are always one tile wide, at any zoom
+    assert client.get('/api/map/tiles/22/3000000/2000000').status_code == 200
@@ -0,0 +1,154 @@
+import os
+import threading
+
+import pandas as pd
+import pytest
+import requests
+
+import api_integration
+from api_integration import CellTowerAPI, TowerLookupCache
+
+
+class Clock:
+    """Deterministic time.time() that ticks one second per call"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(api_integration.time, 'time', clock)
+    return clock
+
+
+def cells(*coordinates):
+    return [{'lat': lat, 'lon': lon, 'cellid': index} for index, (lat, lon) in enumerate(coordinates)]
+
+
+def online_api(tmp_path):
+    api = CellTowerAPI()
+    api.api_key = 'test-key'
+    api.offline = False
+    api.cache = TowerLookupCache(str(tmp_path / 'cache.sqlite3'))
+    return api
+
+
+def test_cache_opens_lazily_and_persists(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = TowerLookupCache(path)
+    assert not os.path.exists(path)
+
+    assert cache.get('a') is None
+    cache.put('a', cells((12.9, 77.5)))
+    assert cache.get('a') == cells((12.9, 77.5))
+    # A fresh instance starts with an empty memory tier and reads the disk tier
+    assert TowerLookupCache(path).get('a') == cells((12.9, 77.5))
+
+
+def test_cache_expires_entries(tmp_path, clock):
+    cache = TowerLookupCache(str(tmp_path / 'cache.sqlite3'), ttl=5)
+    cache.put('a', cells((12.9, 77.5)))
+    assert cache.get('a') is not None
+    clock.advance(10)
+    assert cache.get('a') is None
+    assert TowerLookupCache(cache.path, ttl=5).get('a') is None
+
+
+def test_cache_evicts_least_recently_used(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = TowerLookupCache(path, max_entries=2, memory_entries=1)
+    cache.put('a', cells((1, 1)))
+    cache.put('b', cells((2, 2)))
+    # 'a' left the memory tier when 'b' arrived; reading it back from disk refreshes its recency
+    assert cache.get('a') == cells((1, 1))
+    cache.put('c', cells((3, 3)))
+
+    reopened = TowerLookupCache(path)
+    assert reopened.get('b') is None
+    assert reopened.get('a') == cells((1, 1)) and reopened.get('c') == cells((3, 3))
+
+
+def test_cache_is_safe_across_threads(tmp_path):
+    cache = TowerLookupCache(str(tmp_path / 'cache.sqlite3'), memory_entries=8)
+    errors = []
+
+    def work(worker):
+        try:
+            for i in range(50):
+                key = f"{worker}:{i % 20}"
+                cache.put(key, cells((worker, i)))
+                assert cache.get(key) is not None
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_offline_mode_serves_the_opencellid_dump(tmp_path):
+    api = CellTowerAPI()
+    api.offline = True
+    api.cache = TowerLookupCache(str(tmp_path / 'cache.sqlite3'))
+    assert api.get_nearby_towers(12.9, 77.5) == []
+
+    pd.DataFrame([
+        ['LTE', 404, 45, 100, 1, 0, 77.5010, 12.9010, 500, 10, 1, 0, 0, 0],
+        ['GSM', 404, 45, 100, 2, 0, 77.5001, 12.9001, 500, 10, 1, 0, 0, 0],
+        ['LTE', 404, 45, 101, 3, 0, 78.0000, 13.5000, 500, 10, 1, 0, 0, 0],
+    ], columns=TowerLookupCache.OPENCELLID_COLUMNS).to_csv(tmp_path / 'cells.csv', index=False)
+    assert api.cache.import_opencellid(str(tmp_path / 'cells.csv')) == 3
+
+    # Nearest first, and only within the radius; the network is never consulted
+    api.session = None
+    assert [cell['cellid'] for cell in api.get_nearby_towers(12.9, 77.5, radius=1000)] == [2, 1]
+
+
+def test_online_lookups_are_cached_per_tile(tmp_path, monkeypatch):
+    api = online_api(tmp_path)
+    requests_made = []
+
+    class Response:
+        status_code = 200
+
+        def json(self):
+            return {'cells': cells((12.9051, 77.5052), (12.9059, 77.5058))}
+
+    def get(url, params, timeout):
+        requests_made.append((params, timeout))
+        return Response()
+
+    monkeypatch.setattr(api.session, 'get', get)
+    assert len(api.get_nearby_towers(12.905, 77.505, radius=500)) == 2
+    # A nearby query in the same tile is answered from the cache
+    assert len(api.get_nearby_towers(12.906, 77.506, radius=500)) == 2
+    assert len(requests_made) == 1
+    assert requests_made[0][1] == api.timeout
+
+
+def test_failed_lookups_are_not_cached(tmp_path, monkeypatch):
+    api = online_api(tmp_path)
+
+    def timeout(*args, **kwargs):
+        raise requests.Timeout('read timed out')
+
+    monkeypatch.setattr(api.session, 'get', timeout)
+    assert api.get_nearby_towers(12.905, 77.505) == []
+    tile_lat, tile_lon, tile_radius = api._tile(12.905, 77.505, 5000)
+    assert api.cache.get(f"{tile_lat:.4f}:{tile_lon:.4f}:{tile_radius}") is None
+
+    # Transient gateway errors are retried by the mounted adapter before surfacing
+    retries = api.session.get_adapter('https://opencellid.org').max_retries
+    assert retries.total == 2 and set(retries.status_forcelist) == {502, 503, 504}
@@ -0,0 +1,66 @@
+import json
+from datetime import datetime
+
+import numpy as np
+
+from app import db
+from models import AnalysisResult
+from trajectory import decode_track, dwell_runs, encode_track, expand_path, path_runs
+
+
+def dwelling_path(runs: int = 60, seed: int = 0):
+    """Pings that sit on one tower for a while before moving, south-west of the origin so deltas go both ways"""
+    rng = np.random.default_rng(seed)
+    towers = np.column_stack([-33.9 + rng.normal(0, 0.05, runs), -70.6 + rng.normal(0, 0.05, runs)])
+    counts = rng.integers(1, 200, runs)
+    coordinates = np.repeat(towers, counts, axis=0)
+    epoch_seconds = 1704067200 + np.cumsum(rng.integers(30, 900, len(coordinates)))
+    return coordinates, epoch_seconds, counts
+
+
+def test_track_round_trip():
+    coordinates, epoch_seconds, counts = dwelling_path()
+    runs = decode_track(encode_track(coordinates[:, 0], coordinates[:, 1], epoch_seconds))
+
+    expected = dwell_runs(coordinates[:, 0], coordinates[:, 1], epoch_seconds)
+    assert [run['count'] for run in runs] == counts.tolist()
+    assert [run['enter'] for run in runs] == expected[:, 2].tolist()
+    assert [run['exit'] for run in runs] == expected[:, 3].tolist()
+    path = expand_path(runs)
+    assert len(path) == len(coordinates)
+    np.testing.assert_allclose(path, coordinates, atol=0.5e-5)
+
+
+def test_simplification_drops_runs_within_tolerance():
+    # Runs along a meridian, one 5 m and one 500 m off the line
+    latitudes = np.array([0.0, 0.01, 0.02, 0.03, 0.04])
+    longitudes = np.array([0.0, 0.00005, 0.0, 0.0045, 0.0])
+    epoch_seconds = np.arange(5) * 60
+
+    kept = decode_track(encode_track(latitudes, longitudes, epoch_seconds, tolerance_m=50))
+    assert [run['lat'] for run in kept] == [0.0, 0.02, 0.03, 0.04]
+    assert len(decode_track(encode_track(latitudes, longitudes, epoch_seconds, tolerance_m=1))) == 5
+    assert len(decode_track(encode_track(latitudes, longitudes, epoch_seconds, tolerance_m=1000))) == 2
+
+
+def test_track_is_much_smaller_than_the_json_path():
+    coordinates, epoch_seconds, _ = dwelling_path()
+    track = encode_track(coordinates[:, 0], coordinates[:, 1], epoch_seconds)
+    assert len(track) * 20 < len(json.dumps(coordinates.tolist()))
+
+
+def test_legacy_results_fall_back_to_movement_path(app, client):
+    path = [[12.9, 77.5], [12.9, 77.5], [12.95, 77.55], [12.9, 77.5]]
+    result = AnalysisResult(mobile_number='900', tower_count=2, first_seen=datetime(2024, 1, 1),
+                            last_seen=datetime(2024, 1, 2), movement_path=path)
+    db.session.add(result)
+    db.session.commit()
+
+    runs = [{'lat': 12.9, 'lng': 77.5, 'enter': None, 'exit': None, 'count': 2},
+            {'lat': 12.95, 'lng': 77.55, 'enter': None, 'exit': None, 'count': 1},
+            {'lat': 12.9, 'lng': 77.5, 'enter': None, 'exit': None, 'count': 1}]
+    assert path_runs(path) == runs
+    assert client.get(f"/api/analysis/results/{result.id}").get_json()['runs'] == runs
+    track = client.get(f"/api/analysis/{result.id}/track", query_string={'expand': 'true'}).get_json()
+    assert track['runs'] == runs
+    assert track['movement_path'] == path
@@ -0,0 +1,138 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Coordinates are stored at 1e-5 degrees (about 1 m), as in Google's polyline format
+COORDINATE_SCALE = 1e5
+
+# Each run is encoded as: delta lat, delta lon, delta enter time, dwell seconds, ping count
+RUN_FIELDS = 5
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def dwell_runs(latitudes, longitudes, epoch_seconds) -> np.ndarray:
+    """Collapse consecutive pings at the same location into (lat, lon, enter, exit, count) rows
+
+    A tower has fixed coordinates, so a run of identical coordinates is a dwell on one tower.
+    """
+    latitudes = np.round(np.asarray(latitudes, dtype=float) * COORDINATE_SCALE).astype(np.int64)
+    longitudes = np.round(np.asarray(longitudes, dtype=float) * COORDINATE_SCALE).astype(np.int64)
+    epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+    if len(latitudes) == 0:
+        return np.empty((0, RUN_FIELDS), dtype=np.int64)
+
+    moved = (latitudes[1:] != latitudes[:-1]) | (longitudes[1:] != longitudes[:-1])
+    starts = np.flatnonzero(np.r_[True, moved])
+    ends = np.r_[starts[1:], len(latitudes)]
+    return np.column_stack([
+        latitudes[starts],
+        longitudes[starts],
+        epoch_seconds[starts],
+        epoch_seconds[ends - 1],
+        ends - starts
+    ])
+
+
+def simplify_runs(runs: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """Douglas-Peucker over the run locations, keeping runs that deviate more than tolerance_m"""
+    if tolerance_m <= 0 or len(runs) < 3:
+        return runs
+
+    # Equirectangular projection is accurate enough at the scale of a single track
+    lat = np.radians(runs[:, 0] / COORDINATE_SCALE)
+    lon = np.radians(runs[:, 1] / COORDINATE_SCALE)
+    x = lon * np.cos(lat.mean()) * EARTH_RADIUS_M
+    y = lat * EARTH_RADIUS_M
+
+    keep = np.zeros(len(runs), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(runs) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance_m:
+            split = first + 1 + index
+            keep[split] = True
+            stack.extend([(first, split), (split, last)])
+    return runs[keep]
+
+
+def _encode_values(values: np.ndarray) -> str:
+    """Polyline-encode signed integers into printable ASCII, 5 bits per character"""
+    chunks = []
+    for value in values.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def _decode_values(encoded: str) -> List[int]:
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    return values
+
+
+def encode_track(latitudes, longitudes, epoch_seconds, tolerance_m: float = 0.0) -> str:
+    """Encode a time-ordered path as delta/polyline text of its dwell runs"""
+    runs = simplify_runs(dwell_runs(latitudes, longitudes, epoch_seconds), tolerance_m)
+    if len(runs) == 0:
+        return ''
+    fields = np.column_stack([
+        np.diff(runs[:, 0], prepend=0),
+        np.diff(runs[:, 1], prepend=0),
+        np.diff(runs[:, 2], prepend=0),
+        runs[:, 3] - runs[:, 2],
+        runs[:, 4]
+    ])
+    return _encode_values(fields.ravel())
+
+
+def decode_track(encoded: Optional[str]) -> List[Dict]:
+    """Decode an encoded track into runs with lat, lng, enter, exit (epoch seconds) and count"""
+    if not encoded:
+        return []
+    fields = np.array(_decode_values(encoded), dtype=np.int64).reshape(-1, RUN_FIELDS)
+    latitudes = np.cumsum(fields[:, 0]) / COORDINATE_SCALE
+    longitudes = np.cumsum(fields[:, 1]) / COORDINATE_SCALE
+    enters = np.cumsum(fields[:, 2])
+    return [
+        {'lat': lat, 'lng': lng, 'enter': enter, 'exit': enter + dwell, 'count': count}
+        for lat, lng, enter, dwell, count in zip(
+            latitudes.tolist(), longitudes.tolist(), enters.tolist(), fields[:, 3].tolist(), fields[:, 4].tolist()
+        )
+    ]
+
+
+def expand_path(runs: List[Dict]) -> List[List[float]]:
+    """Rebuild the per-ping [lat, lng] path that movement_path used to store"""
+    return [[run['lat'], run['lng']] for run in runs for _ in range(run['count'])]
+
+
+def path_runs(path) -> List[Dict]:
+    """Runs of a legacy movement_path, which has no timestamps (enter and exit are None)"""
+    coordinates = np.asarray(path, dtype=float).reshape(-1, 2)
+    runs = dwell_runs(coordinates[:, 0], coordinates[:, 1], np.zeros(len(coordinates), dtype=np.int64))
+    return [
+        {'lat': lat / COORDINATE_SCALE, 'lng': lng / COORDINATE_SCALE, 'enter': None, 'exit': None, 'count': count}
+        for lat, lng, count in zip(runs[:, 0].tolist(), runs[:, 1].tolist(), runs[:, 4].tolist())
+    ]
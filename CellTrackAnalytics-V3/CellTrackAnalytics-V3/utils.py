@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
@@ -21,18 +22,56 @@ def validate_tower_data(df):
     
     return df
 
-def calculate_movement_patterns(df):
-    patterns = []
-    for number in df['mobile_number'].unique():
-        number_data = df[df['mobile_number'] == number].sort_values('timestamp')
-        
-        pattern = {
-            'mobile_number': number,
-            'tower_count': len(number_data['tower_id'].unique()),
-            'first_seen': number_data['timestamp'].min().isoformat(),
-            'last_seen': number_data['timestamp'].max().isoformat(),
-            'movement_path': number_data[['latitude', 'longitude']].values.tolist()
+def calculate_movement_patterns(df, stream=False):
+    """Per-number movement summaries in first-appearance order, computed from a single sort
+
+    With stream=True a generator is returned that yields one pattern at a time.
+    """
+    patterns = _iter_movement_patterns(df)
+    return patterns if stream else list(patterns)
+
+def _iter_movement_patterns(df):
+    codes, numbers = pd.factorize(df['mobile_number'])
+    known = codes >= 0
+    if not known.any():
+        return
+
+    timestamps = df['timestamp']
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps)
+
+    # Order by (appearance code, timestamp) so each number is one contiguous, time-ordered slice
+    positions = np.flatnonzero(known)
+    positions = positions[np.lexsort((timestamps.to_numpy()[positions].astype(np.int64), codes[positions]))]
+    sorted_codes = codes[positions]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    ends = np.r_[starts[1:], len(positions)]
+
+    sorted_timestamps = timestamps.iloc[positions]
+    first_seen = sorted_timestamps.iloc[starts].tolist()
+    last_seen = sorted_timestamps.iloc[ends - 1].tolist()
+    tower_pairs = pd.DataFrame({'code': sorted_codes, 'tower_id': df['tower_id'].to_numpy()[positions]})
+    tower_counts = np.bincount(tower_pairs.drop_duplicates()['code'], minlength=len(numbers))
+    coordinates = df[['latitude', 'longitude']].to_numpy()[positions]
+
+    for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        code = sorted_codes[start]
+        yield {
+            'mobile_number': numbers[code],
+            'tower_count': int(tower_counts[code]),
+            'first_seen': first_seen[i].isoformat(),
+            'last_seen': last_seen[i].isoformat(),
+            'movement_path': coordinates[start:end].tolist()
         }
-        patterns.append(pattern)
-    
-    return patterns
+
+def group_offsets(df, key='mobile_number', order='timestamp'):
+    """Sort once by (key, order) and return the sorted frame with per-group start/end offsets"""
+    sorted_df = df.sort_values([key, order], kind='stable', ignore_index=True)
+    keys = sorted_df[key].to_numpy()
+    if len(keys) == 0:
+        empty = np.array([], dtype=np.int64)
+        return sorted_df, empty, empty
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)]
+    return sorted_df, starts, ends